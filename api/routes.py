@@ -3,15 +3,18 @@ from fastapi import FastAPI, APIRouter
 from pydantic import BaseModel
 from utils.logger import log_api
 import logging
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, PlainTextResponse
 import os
 import json
-from typing import Optional, Any, Dict
-from pydantic import Field
+import asyncio
+from typing import Optional, Any, Dict, List, Literal, Tuple
+from pydantic import Field, ValidationError
 import base64
 import tempfile
 # Add PnL analyzer imports
-from utils.pnl_analyzer import BinanceFuturesPnLTracker
+from utils.pnl_analyzer import BinanceFuturesPnLTracker, get_shared_tracker
+from utils.income_ledger import get_income_ledger
+from utils.result_cache import ResultCache
 from utils.config import BINANCE_API_KEY, BINANCE_API_SECRET, TEST
 from datetime import datetime
 from fastapi import Query
@@ -63,6 +66,68 @@ def bot_status():
     log_api("Bot status checked via API. Running: {}".format(running))
     return {"running": running}
 
+@router.get("/bot/state")
+def bot_live_state():
+    """
+    Live position, active orders and last candle (with HA values) of the trading bot,
+    read from the shared-memory block the bot process updates.
+    """
+    from main import is_bot_running
+    from utils.shared_state import read_bot_state, format_bot_state
+    return {"running": is_bot_running(), "state": format_bot_state(read_bot_state())}
+
+@router.get("/metrics")
+def metrics_endpoint():
+    """
+    Prometheus metrics of the API process, the bot subprocess (read over its local socket)
+    and services that push to /metrics/push (Telegram).
+    """
+    from main import is_bot_running
+    from utils import metrics
+    metrics.gauge('bot_running', '1 while the trading bot subprocess is alive').set(1 if is_bot_running() else 0)
+    families = {"api": metrics.REGISTRY.collect()}
+    bot_families = metrics.fetch_bot_metrics()
+    if bot_families is not None:
+        families["bot"] = bot_families
+    families.update(metrics.get_pushed_metrics())
+    return PlainTextResponse(metrics.render(families), media_type="text/plain; version=0.0.4")
+
+class MetricFamily(BaseModel):
+    name: str
+    type: Literal["counter", "gauge", "histogram", "summary", "untyped"]
+    help: str = ""
+    samples: List[Tuple[str, Dict[str, str], float]]  # (sample name, labels, value)
+
+class MetricsPushRequest(BaseModel):
+    service: str
+    families: list
+
+@router.post("/metrics/push")
+def metrics_push(req: MetricsPushRequest):
+    """
+    Receive the metric families of a separate service (e.g. the Telegram bot).
+    """
+    from utils import metrics
+    if req.service in ("api", "bot"):
+        return JSONResponse(content={"error": "Reserved service name"}, status_code=400)
+    try:
+        families = [MetricFamily.model_validate(family).model_dump() for family in req.families]
+    except ValidationError as e:
+        return JSONResponse(content={"error": f"Invalid metric families: {e}"}, status_code=400)
+    metrics.store_pushed_metrics(req.service, families)
+    return {"status": "ok"}
+
+@router.get("/metrics/latency")
+def metrics_latency():
+    """
+    Candle-to-order latency histograms per stage and REST endpoint, read from the running bot process.
+    """
+    from utils.latency_trace import load_latency_metrics
+    metrics = load_latency_metrics()
+    if metrics is None:
+        return JSONResponse(content={"message": "No latency metrics recorded yet (or the bot is not running)"}, status_code=404)
+    return metrics
+
 @router.get("/order_book/historical")
 def order_book_historical():
     """
@@ -170,107 +235,186 @@ class TradingConfigUpdateRequest(BaseModel):
 def update_trading_config(req: TradingConfigUpdateRequest):
     """
     Update trading_config.json with only the provided fields. Unspecified fields remain unchanged.
+    The merged config is validated and written atomically; the bot picks it up on its next candle.
     """
-    config_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'api', 'trading_config.json')
-    if not os.path.exists(config_path):
-        log_api(f"Error: trading_config.json not found at {config_path}")
+    from utils.config import save_trading_config, TRADING_CONFIG_PATH
+    if not os.path.exists(TRADING_CONFIG_PATH):
+        log_api(f"Error: trading_config.json not found at {TRADING_CONFIG_PATH}")
         return JSONResponse(content={"error": "trading_config.json not found"}, status_code=404)
     
-    with open(config_path, 'r', encoding='utf-8') as f:
-        try:
-            config = json.load(f)
-        except Exception as e:
-            log_api(f"Error parsing trading_config.json: {str(e)}")
-            return JSONResponse(content={"error": "Invalid JSON in trading_config.json"}, status_code=500)
-    
     update_data = req.dict(exclude_unset=True)
     
     # Log the received update data
     log_api(f"Updating trading config with: {update_data}")
     
-    # Apply updates
-    for k, v in update_data.items():
-        if v is not None:
-            config[k] = v
-    
-    # Write the updated config back to the file
-    with open(config_path, 'w', encoding='utf-8') as f:
-        json.dump(config, f, indent=4)
+    try:
+        config = save_trading_config(update_data)
+    except json.JSONDecodeError as e:
+        log_api(f"Error parsing trading_config.json: {str(e)}")
+        return JSONResponse(content={"error": "Invalid JSON in trading_config.json"}, status_code=500)
+    except ValueError as e:
+        log_api(f"Rejected trading config update: {e}")
+        return JSONResponse(content={"error": str(e)}, status_code=400)
     
     log_api(f"Trading config updated successfully")
-    return {"status": "success", "updated_config": config}
+    return {"status": "success", "updated_config": dict(config.raw)}
 
 @router.get("/trading_config")
 def get_trading_config():
     """
     Get the current trading_config.json contents.
     """
-    config_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'api', 'trading_config.json')
-    if not os.path.exists(config_path):
+    from utils.config import refresh_trading_config
+    try:
+        config = refresh_trading_config()
+    except FileNotFoundError:
         return JSONResponse(content={"error": "trading_config.json not found"}, status_code=404)
-    with open(config_path, 'r', encoding='utf-8') as f:
-        try:
-            config = json.load(f)
-        except Exception:
-            return JSONResponse(content={"error": "Invalid JSON in trading_config.json"}, status_code=500)
-    return config
+    except ValueError:
+        return JSONResponse(content={"error": "Invalid JSON in trading_config.json"}, status_code=500)
+    return dict(config.raw)
+
+PNL_CACHE_TTL_SECONDS = int(os.getenv('PNL_CACHE_TTL_SECONDS', '15'))  # Income summary served without recomputing
+PNL_CACHE_STALE_SECONDS = int(os.getenv('PNL_CACHE_STALE_SECONDS', '300'))  # Served while recomputing
+income_summary_cache = ResultCache(PNL_CACHE_TTL_SECONDS, PNL_CACHE_STALE_SECONDS, name='income-summary')
+# Balances and positions: a burst of requests shares one fetch, but nothing older is ever served
+ACCOUNT_CACHE_TTL_SECONDS = float(os.getenv('ACCOUNT_CACHE_TTL_SECONDS', '2'))
+account_cache = ResultCache(ACCOUNT_CACHE_TTL_SECONDS, ACCOUNT_CACHE_TTL_SECONDS, max_entries=1, workers=1, name='account-snapshot')
+
+
+def _submit_income_summary(key, days, start_date, end_date, tz):
+    # Reading the ledger's event count touches disk, so this runs off the event loop
+    return income_summary_cache.submit(
+        key,
+        lambda: get_shared_tracker().get_income_summary(days, start_date=start_date, end_date=end_date, tz=tz),
+        len(get_income_ledger())
+    )
 
 class PnLAnalysisRequest(BaseModel):
     start_date: Optional[str] = None
     end_date: Optional[str] = None
     days: Optional[int] = 30
+    timezone: Optional[str] = 'UTC'  # Day boundaries: 'UTC' or 'IST'
 
 @router.post("/pnl/analyze")
-def analyze_pnl(req: PnLAnalysisRequest):
+async def analyze_pnl(req: PnLAnalysisRequest):
     """
     Analyze PnL for a specific date range or number of days.
     Does not save data to a JSON file - only returns the data for display.
+    The income summary of a period is cached (PNL_CACHE_TTL_SECONDS, dropped when new income
+    arrives, refreshed in the background once expired) and identical concurrent requests share
+    one computation of it. Balances, unrealized PnL and positions are never older than
+    ACCOUNT_CACHE_TTL_SECONDS, and concurrent requests share one fetch of them.
     """
+    # Validate date inputs if provided
+    if (req.start_date and not req.end_date) or (not req.start_date and req.end_date):
+        log_api("Error: Both start_date and end_date must be provided together.")
+        return JSONResponse(
+            status_code=400,
+            content={"error": "Both start_date and end_date must be provided together."}
+        )
+    tz = req.timezone or 'UTC'
+    key = (req.start_date, req.end_date, None if req.start_date else req.days, tz)
     try:
-        tracker = BinanceFuturesPnLTracker(BINANCE_API_KEY, BINANCE_API_SECRET, testnet=TEST)
-        
-        # Validate date inputs if provided
-        if (req.start_date and not req.end_date) or (not req.start_date and req.end_date):
-            log_api("Error: Both start_date and end_date must be provided together.")
-            return JSONResponse(
-                status_code=400,
-                content={"error": "Both start_date and end_date must be provided together."}
-            )
-        
-        # Get trading stats
-        stats = tracker.get_trading_stats(
+        # Totals and the daily breakdown from the local ledger's daily rollups; the ledger's
+        # event count changes exactly when new income is stored
+        income_future = await asyncio.to_thread(
+            _submit_income_summary, key, req.days, req.start_date, req.end_date, tz)
+        account_future = account_cache.submit('account', lambda: get_shared_tracker().get_account_snapshot())
+        income_summary = await asyncio.wrap_future(income_future)
+        account_snapshot = await asyncio.wrap_future(account_future)
+        stats = get_shared_tracker().get_trading_stats(
             days=req.days,
             start_date=req.start_date,
-            end_date=req.end_date
+            end_date=req.end_date,
+            income_summary=income_summary,
+            account_snapshot=account_snapshot
         )
-        
-        # Get daily PnL breakdown
-        daily_pnl = tracker.get_daily_pnl(
-            days=req.days if not req.start_date else req.days,
-            start_date=req.start_date,
-            end_date=req.end_date
-        )
-        
-        # Convert DataFrame to dict for JSON serialization
-        daily_pnl_dict = {}
-        if not daily_pnl.empty:
-            daily_pnl_dict = daily_pnl.reset_index().to_dict(orient='records')
-        
-        response_data = {
-            "trading_stats": stats,
-            "daily_pnl": daily_pnl_dict,
-            "timestamp": datetime.now().isoformat()
-        }
-        
-        log_api(f"PnL analysis completed for period: {req.start_date or f'Last {req.days} days'} to {req.end_date or 'now'}")
-        return response_data
-        
+    except ValueError as e:
+        log_api(f"Error: invalid PnL analysis request: {e}")
+        return JSONResponse(status_code=400, content={"error": str(e)})
     except Exception as e:
         log_api(f"Error analyzing PnL: {str(e)}")
         return JSONResponse(
             status_code=500,
             content={"error": f"Failed to analyze PnL: {str(e)}"}
         )
+    log_api(f"PnL analysis completed for period: {req.start_date or f'Last {req.days} days'} to {req.end_date or 'now'}")
+    return {
+        "trading_stats": stats,
+        "daily_pnl": income_summary['daily'],
+        "timezone": income_summary['timezone'],
+        "timestamp": datetime.now().isoformat()
+    }
+
+@router.get("/analytics/trades")
+def analytics_trades(
+    symbol: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    days: int = 30,
+    timezone: str = 'UTC',
+    limit: int = Query(50, ge=0, le=10000),
+    excursions: bool = False
+):
+    """
+    Round trips paired from the filled orders in order_book.json and their statistics:
+    win rate, expectancy, profit factor, max drawdown, holding time and MAE/MFE.
+    - symbol: Trading pair symbol (e.g., 'ETHUSDT')
+    - start_date / end_date: Exit date range (YYYY-MM-DD, both or neither)
+    - days: Number of days to look back when no date range is given
+    - timezone: Day boundaries, 'UTC' or 'IST'
+    - limit: Number of latest trades to return
+    - excursions: Also compute MAE/MFE from the klines already stored locally
+    """
+    from utils.trade_analytics import analyze_trades
+
+    if bool(start_date) != bool(end_date):
+        return JSONResponse(status_code=400, content={"error": "Both start_date and end_date must be provided together."})
+    try:
+        result = analyze_trades(symbol, days, start_date, end_date, timezone, limit, excursions)
+    except ValueError as e:
+        log_api(f"Error: invalid trade analytics request: {e}")
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except Exception as e:
+        log_api(f"Error analyzing trades: {str(e)}")
+        return JSONResponse(status_code=500, content={"error": f"Failed to analyze trades: {str(e)}"})
+    log_api(f"Trade analytics: {result['stats']['trades']} trades for {symbol or 'all symbols'}")
+    return result
+
+@router.get("/analytics/equity")
+def analytics_equity(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    days: int = 30,
+    timezone: str = 'UTC',
+    start_time: Optional[int] = None,
+    end_time: Optional[int] = None,
+    resolution: str = 'auto',
+    max_points: int = Query(500, ge=1, le=10000)
+):
+    """
+    Account equity curve: min, max and last margin balance and last wallet balance per bucket.
+    - start_date / end_date: Date range (YYYY-MM-DD, both or neither), or
+    - start_time / end_time: Range in ms (overrides the dates, e.g. when zooming a chart)
+    - days: Number of days to look back when no range is given
+    - timezone: Day boundaries of the dates, 'UTC' or 'IST'
+    - resolution: Bucket size ('1m' .. '3d'), or 'auto' for the finest that fits max_points
+    """
+    from utils.equity_store import get_equity_store
+    from utils.income_ledger import date_range_ms
+
+    if bool(start_date) != bool(end_date):
+        return JSONResponse(status_code=400, content={"error": "Both start_date and end_date must be provided together."})
+    try:
+        start_ms, end_ms = date_range_ms(days, start_date, end_date, timezone)
+        if start_time is not None:
+            start_ms = start_time
+        if end_time is not None:
+            end_ms = end_time
+        return get_equity_store().series(start_ms, end_ms, resolution, max_points)
+    except ValueError as e:
+        log_api(f"Error: invalid equity request: {e}")
+        return JSONResponse(status_code=400, content={"error": str(e)})
 
 @router.get("/order_book/filter")
 def filter_order_book(
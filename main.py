@@ -1,11 +1,26 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from api.routes import router
 import multiprocessing
 import time
 from utils.websocket_handler import websocket_runner
+from utils.shared_state import create_state_block
+from utils.income_ledger import start_income_sync
+from utils.equity_store import start_equity_poll
+from utils.time_sync import start_time_sync
 import uvicorn
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(_app):
+    # Signed requests of this process follow the exchange clock
+    start_time_sync()
+    # PnL queries read the local income ledger; keep it synced in the background
+    start_income_sync()
+    # Balance snapshots for the equity curve
+    start_equity_poll()
+    yield
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(router)
 
 ws_process = None
@@ -14,6 +29,8 @@ ws_stop_event = None
 def start_bot():
     global ws_process, ws_stop_event
     if ws_process is None or not ws_process.is_alive():
+        # The bot writes its live state into this block; /bot/state reads it in place
+        create_state_block()
         ws_stop_event = multiprocessing.Event()
         ws_process = multiprocessing.Process(target=websocket_runner, args=(ws_stop_event,))
         ws_process.start()
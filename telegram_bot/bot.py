@@ -13,6 +13,8 @@ import json
 import os
 import random
 import string
+import sys
+from telegram.error import RetryAfter
 from razerpay import (
     create_payment_link_with_breakdown, check_payment_status, 
     save_customer_details, get_customer_details,
@@ -128,6 +130,14 @@ except ImportError as e:
     print(f"❌ Failed to import server_call: {e}")
     SERVER_CALL_AVAILABLE = False
 
+# Metrics are pushed to the API's /metrics (the shared registry lives in the repo's utils package)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import metrics
+
+SEND_QUEUE_DEPTH = metrics.gauge('telegram_send_queue_depth', 'Telegram notifications waiting for send_message to complete')
+MESSAGES_SENT = metrics.counter('telegram_messages_total', 'Telegram notifications by outcome', ('result',))
+RATE_LIMITED = metrics.counter('telegram_rate_limited_total', 'Telegram 429 Too Many Requests (RetryAfter) responses')
+
 # Load environment variables
 load_dotenv()
 
@@ -282,6 +292,13 @@ def format_filled_order(order):
 
 async def send_telegram_message(context: ContextTypes.DEFAULT_TYPE, chat_id: int, message: str):
     """Helper function to send Telegram messages with proper error handling"""
+    SEND_QUEUE_DEPTH.inc()
+    try:
+        return await _send_telegram_message(context, chat_id, message)
+    finally:
+        SEND_QUEUE_DEPTH.dec()
+
+async def _send_telegram_message(context: ContextTypes.DEFAULT_TYPE, chat_id: int, message: str):
     try:
         await context.bot.send_message(
             chat_id=chat_id,
@@ -293,10 +310,13 @@ async def send_telegram_message(context: ContextTypes.DEFAULT_TYPE, chat_id: int
         )
         print(f"✅ Message sent successfully to chat_id: {chat_id}")
         log_message("SENT", chat_id, "", "private", message)  # Log sent message
+        MESSAGES_SENT.labels(result='sent').inc()
         return True
     except Exception as e:
         print(f"❌ Error sending Telegram message: {e}")
         print(f"❌ Error type: {type(e).__name__}")
+        if isinstance(e, RetryAfter):
+            RATE_LIMITED.inc()
         # Try sending without markdown as fallback
         try:
             await context.bot.send_message(
@@ -309,9 +329,13 @@ async def send_telegram_message(context: ContextTypes.DEFAULT_TYPE, chat_id: int
             )
             print(f"✅ Fallback message sent to chat_id: {chat_id}")
             log_message("SENT", chat_id, "", "private", message)  # Log sent message
+            MESSAGES_SENT.labels(result='fallback').inc()
             return True
         except Exception as fallback_error:
             print(f"❌ Fallback also failed: {fallback_error}")
+            if isinstance(fallback_error, RetryAfter):
+                RATE_LIMITED.inc()
+            MESSAGES_SENT.labels(result='failed').inc()
             return False
 
 def poll_filled_orders_sync(chat_id: int, context: ContextTypes.DEFAULT_TYPE):
@@ -492,6 +516,26 @@ async def stop_bot_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(response_message, parse_mode='Markdown')
     log_message("SENT", update.effective_chat.id, "", "private", response_message)  # Log sent message
 
+def format_live_state(state):
+    """Format the bot's live state (from /bot/state) for /status"""
+    position = (state.get('position') or 'NONE').replace('_', '\\_')
+    lines = ["📡 *Live State*", f"Position: {position}"]
+    if state.get('buy_filled_price') is not None:
+        lines.append(f"Entry Price: {state['buy_filled_price']}")
+    for label, order in (("Buy Order", state.get('active_buy_order')), ("Stop Loss Order", state.get('active_sell_order'))):
+        if order:
+            lines.append(f"{label}: {order.get('quantity')} @ {order.get('price')} (stop {order.get('stop_price')})")
+    candle = state.get('last_candle')
+    if candle:
+        candle_time = datetime.fromtimestamp(candle['candle_time'] / 1000).strftime('%Y-%m-%d %H:%M')
+        lines.append(f"Last Candle: {candle_time} close {candle.get('close')}")
+        if candle.get('ha_close') is not None:
+            lines.append(f"HA O/H/L/C: {candle.get('ha_open'):.2f} / {candle.get('ha_high'):.2f} / "
+                         f"{candle.get('ha_low'):.2f} / {candle.get('ha_close'):.2f}")
+        if candle.get('entry') is not None or candle.get('stop_loss') is not None:
+            lines.append(f"Next Entry: {candle.get('entry')} | Stop Loss: {candle.get('stop_loss')}")
+    return "\n".join(lines) + "\n"
+
 async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /status command"""
     # Log the command
@@ -504,10 +548,11 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         response_message = "❌ Trading bot service is not available. Please check server connection."
     else:
         try:
-            # Get bot running status
-            status_result = server_call.get_bot_status()
+            # Get bot running status and live trading state
+            status_result = server_call.get_bot_state()
             is_running = status_result.get('running', False)
             status_emoji = "🟢" if is_running else "🔴"
+            live_state = status_result.get('state')
             
             # Get trading configuration
             config_result = server_call.get_trading_config()
@@ -539,6 +584,8 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 f"Sell Offset: {sell_offset}\n"
                 f"Leverage: {leverage}x\n"
             )
+            if is_running and live_state:
+                response_message += "\n" + format_live_state(live_state)
         except Exception as e:
             print(f"❌ Error getting bot status: {e}")
             response_message = f"❌ Error getting bot status: {str(e)}"
@@ -786,6 +833,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle errors"""
+    if isinstance(context.error, RetryAfter):
+        RATE_LIMITED.inc()
     logger.warning(f'Update {update} caused error {context.error}')
 
 async def total_messages_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1535,14 +1584,12 @@ async def handle_payment_overdue_actions():
                     
                     # Check if there are any open positions
                     try:
-                        # Import bot state to check current positions
-                        import sys
-                        sys.path.append(os.path.dirname(os.path.dirname(__file__)))
-                        from utils.bot_state import get_position, get_active_buy_order, get_active_sell_order
+                        # Live state of the bot process (this process has its own, unused bot_state)
+                        live_state = server_call.get_bot_state().get('state') or {}
                         
-                        current_position = get_position()
-                        active_buy = get_active_buy_order()
-                        active_sell = get_active_sell_order()
+                        current_position = live_state.get('position')
+                        active_buy = live_state.get('active_buy_order')
+                        active_sell = live_state.get('active_sell_order')
                         
                         # Log current trading state
                         print(f"Current position: {current_position}")
@@ -1761,7 +1808,30 @@ async def profit_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     response_message += f"• *Net:* {sign}{daily_total:.2f} USDT\n\n"
         else:
             response_message += "*No daily data available for this period.*\n"
-            
+
+        # Round trips paired from the bot's own fills
+        try:
+            trade_stats = server_call.get_trade_analytics(start_date_str, end_date_str).get('stats', {})
+        except Exception as e:
+            logger.error(f"Error retrieving trade analytics: {e}")
+            trade_stats = {}
+        if trade_stats.get('trades'):
+            profit_factor = trade_stats.get('profit_factor')
+            response_message += (
+                f"---\n\n"
+                f"🔁 *Trades:* {trade_stats['trades']} ({trade_stats['wins']} won, {trade_stats['losses']} lost)\n"
+                f"• Win Rate: {trade_stats['win_rate']:.1f}%\n"
+                f"• Expectancy: {trade_stats['expectancy']:.2f} USDT/trade\n"
+                f"• Profit Factor: {f'{profit_factor:.2f}' if profit_factor is not None else '∞'}\n"
+                f"• Max Drawdown: {trade_stats['max_drawdown']:.2f} USDT\n"
+                f"• Avg Holding: {trade_stats['avg_holding_minutes']:.0f} min\n"
+            )
+            if trade_stats.get('avg_mae') is not None:
+                response_message += (
+                    f"• Avg MAE / MFE: {trade_stats['avg_mae']:.2f} / {trade_stats['avg_mfe']:.2f} USDT\n"
+                )
+            response_message += "\n"
+
         response_message += f"---\n\n"
             
         response_message += (
@@ -1974,6 +2044,10 @@ def main():
     print("🚀 Bot is starting...")
     print("💡 Send /start to begin!")
     
+    # Publish send queue and rate limit metrics to the API's /metrics
+    if SERVER_CALL_AVAILABLE:
+        metrics.start_metrics_pusher(f"{server_call.base_url}/metrics/push", 'telegram')
+    
     # Run the bot
     application.run_polling(allowed_updates=Update.ALL_TYPES)
 
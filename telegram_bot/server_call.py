@@ -45,6 +45,18 @@ def get_bot_status():
     else:
         raise Exception(f"Failed to get bot status: {response.text}")
     
+def get_bot_state():
+    """
+    Get the live position, active orders and last candle of the trading bot
+    """
+    url = f"{base_url}/bot/state"
+    response = requests.get(url)
+
+    if response.status_code == 200:
+        return response.json()
+    else:
+        raise Exception(f"Failed to get bot state: {response.text}")
+
 def get_historical_order_book():
     """
     Get historical order book data
@@ -198,7 +210,7 @@ def get_latest_update():
     else:
         raise Exception(f"Failed to get latest update: {response.text}")
 
-def get_pnl_analysis(start_date=None, end_date=None, days=30):
+def get_pnl_analysis(start_date=None, end_date=None, days=30, timezone="UTC"):
     """
     Get PnL analysis for a specific date range or number of days
     
@@ -206,13 +218,15 @@ def get_pnl_analysis(start_date=None, end_date=None, days=30):
         start_date (str, optional): Start date in YYYY-MM-DD format
         end_date (str, optional): End date in YYYY-MM-DD format
         days (int, optional): Number of days to look back (default: 30)
+        timezone (str, optional): Day boundaries, "UTC" or "IST" (default: "UTC")
         
     Returns:
         dict: PnL analysis data
     """
     url = f"{base_url}/pnl/analyze"
     data = {
-        "days": days
+        "days": days,
+        "timezone": timezone
     }
     
     if start_date and end_date:
@@ -226,6 +240,38 @@ def get_pnl_analysis(start_date=None, end_date=None, days=30):
     else:
         raise Exception(f"Failed to get PnL analysis: {response.text}")
 
+def get_trade_analytics(start_date=None, end_date=None, days=30, symbol=None, limit=0, excursions=False):
+    """
+    Get round-trip trade statistics from the bot's filled orders
+
+    Args:
+        start_date (str, optional): Start date in YYYY-MM-DD format
+        end_date (str, optional): End date in YYYY-MM-DD format
+        days (int, optional): Number of days to look back (default: 30)
+        symbol (str, optional): Only trades of this symbol
+        limit (int, optional): Number of latest trades to include (default: 0, statistics only)
+        excursions (bool, optional): Also compute MAE/MFE from the API's stored klines
+
+    Returns:
+        dict: Trade statistics and trades
+    """
+    url = f"{base_url}/analytics/trades"
+    params = {"days": days, "limit": limit}
+    if start_date and end_date:
+        params["start_date"] = start_date
+        params["end_date"] = end_date
+    if symbol:
+        params["symbol"] = symbol
+    if excursions:
+        params["excursions"] = "true"
+
+    response = requests.get(url, params=params)
+
+    if response.status_code == 200:
+        return response.json()
+    else:
+        raise Exception(f"Failed to get trade analytics: {response.text}")
+
 def get_trading_config():
     """
     Get the current trading configuration
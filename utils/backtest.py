@@ -0,0 +1,313 @@
+"""
+Vectorized backtest of the Heikin Ashi stop-entry / trailing-stop strategy.
+
+Replays the rules of `format_row_with_strategy` on arrays of historical klines:
+
+- While flat, at the close of every candle a BUY STOP order is placed with
+  stop = nearest-tick(HA_High) and limit = nearest-tick(HA_High + buy_offset).
+  It is skipped if the close is already at/above the stop (the exchange would
+  reject it as "would immediately trigger") and lives for exactly one candle.
+- The buy fills during the next candle if it trades through the stop and the
+  limit is reachable. The fill is seen at that candle's close, where the first
+  stop loss is placed at floor-to-tick(HA_Low - sell_offset).
+- While long, the stop is replaced at every candle close from that candle's HA_Low.
+  A stop is skipped for a candle if the close is already at/below it.
+- A stop fill is seen at the close of the candle it fills in (CLOSED_LONG); the
+  next candle resets to NONE and places the next buy, so the earliest re-entry is
+  two candles after the exit candle.
+
+Per-candle order prices and fill conditions are computed with NumPy, then one
+Python iteration per trade walks "next entry" / "next exit" index arrays.
+"""
+from typing import NamedTuple
+import numpy as np
+from utils import kline_store
+from utils.kline_store import klines_to_arrays  # noqa: F401 (re-exported)
+from utils.symbol_filters import TickGrid
+from utils.websocket_client.heikin_ashi import calculate_heikin_ashi_arrays
+
+DEFAULT_FEE_RATE = 0.0005  # Binance USD-M taker fee, charged on both fills
+DEFAULT_INITIAL_BALANCE = 1000.0
+
+TRADE_FIELDS = ('entry_index', 'exit_index', 'entry_time', 'exit_time', 'entry_price',
+                'exit_price', 'quantity', 'pnl', 'fees', 'net_pnl', 'bars_held')
+
+
+class BacktestResult(NamedTuple):
+    """Output of run_backtest()"""
+    trades: dict  # Column name -> array, one row per round trip (see TRADE_FIELDS)
+    equity: np.ndarray  # Mark-to-market equity at every candle close
+    stats: dict
+
+    def trade_records(self):
+        """Trades as a list of dicts (one per round trip)"""
+        count = len(self.trades['entry_index'])
+        return [{name: self.trades[name][i].item() for name in TRADE_FIELDS} for i in range(count)]
+
+
+def load_klines(symbol, interval, start_ms, end_ms, client=None):
+    """
+    Closed futures klines for [start_ms, end_ms) as column arrays
+
+    Read from the local kline store, which downloads only the candles it is missing.
+
+    Args:
+        symbol (str): Trading pair symbol (e.g., 'ETHUSDT')
+        interval (str): Kline interval (e.g., '1m')
+        start_ms (int): Start of the range, epoch ms
+        end_ms (int): End of the range (exclusive), epoch ms
+        client: python-binance client (a new one is created if needed)
+
+    Returns:
+        dict of arrays, see klines_to_arrays()
+    """
+    return kline_store.load_klines(symbol, interval, start_ms, end_ms, client=client)
+
+
+def _next_true_index(mask):
+    """For every i, the smallest j >= i with mask[j] (len(mask) if there is none)"""
+    n = len(mask)
+    index = np.where(mask, np.arange(n), n)
+    return np.minimum.accumulate(index[::-1])[::-1]
+
+
+def strategy_orders(candles, buy_offset, sell_offset, tick_size):
+    """
+    Order prices placed at each candle close and whether each candle fills them
+
+    Returns:
+        dict of per-candle arrays: HA values, 'buy_stop', 'buy_limit', 'sell_stop' (orders
+        placed at the close of candle i), 'entry_hit'/'exit_hit' (the order placed at the close
+        of candle i-1 fills during candle i), 'entry_price'/'exit_price' (its fill price)
+    """
+    open_, high, low, close = candles['open'], candles['high'], candles['low'], candles['close']
+    ha_open, ha_high, ha_low, ha_close = calculate_heikin_ashi_arrays(open_, high, low, close)
+    grid = TickGrid(tick_size)
+    buy_stop = grid.to_floats(grid.nearest_units(ha_high))
+    buy_limit = grid.to_floats(grid.nearest_units(ha_high + buy_offset))
+    sell_stop = grid.to_floats(grid.floor_units(ha_low - sell_offset))
+
+    # Orders that would trigger immediately are rejected by the exchange, so they never rest
+    buy_placed = close < buy_stop
+    sell_placed = close > sell_stop
+
+    n = len(close)
+    entry_hit = np.zeros(n, dtype=bool)
+    exit_hit = np.zeros(n, dtype=bool)
+    entry_price = np.zeros(n)
+    exit_price = np.zeros(n)
+    if n > 1:
+        prev_stop, prev_limit = buy_stop[:-1], buy_limit[:-1]
+        # Triggered once the price trades at the stop; the limit order fills if the price is at or under it
+        entry_hit[1:] = buy_placed[:-1] & (high[1:] >= prev_stop) & (low[1:] <= prev_limit)
+        entry_price[1:] = np.minimum(np.maximum(open_[1:], prev_stop), prev_limit)
+        # The stop loss is a stop-limit at its own trigger price: it fills if the price trades at that level
+        prev_sell = sell_stop[:-1]
+        exit_hit[1:] = sell_placed[:-1] & (low[1:] <= prev_sell) & (high[1:] >= prev_sell)
+        exit_price[1:] = prev_sell
+
+    return {
+        'ha_open': ha_open, 'ha_high': ha_high, 'ha_low': ha_low, 'ha_close': ha_close,
+        'buy_stop': buy_stop, 'buy_limit': buy_limit, 'sell_stop': sell_stop,
+        'entry_hit': entry_hit, 'exit_hit': exit_hit,
+        'entry_price': entry_price, 'exit_price': exit_price,
+    }
+
+
+def run_backtest(candles, buy_offset, sell_offset, tick_size, step_size=None,
+                 quantity_type='fixed', quantity=1.0, quantity_percentage=100.0, leverage=1,
+                 initial_balance=DEFAULT_INITIAL_BALANCE, fee_rate=DEFAULT_FEE_RATE, orders=None):
+    """
+    Backtest the strategy over column arrays of candles
+
+    Args:
+        candles (dict): Arrays from klines_to_arrays() / load_klines()
+        buy_offset (float): Added to HA_High for the entry limit price
+        sell_offset (float): Subtracted from HA_Low for the stop loss
+        tick_size (float|str): Symbol tickSize
+        step_size (float|str, optional): Symbol stepSize; quantities are floored to it if given
+        quantity_type (str): 'fixed' (use `quantity`) or 'percentage' (of the current balance, times leverage)
+        quantity (float): Fixed order quantity in base asset
+        quantity_percentage (float): Percentage of the balance used per trade
+        leverage (int): Leverage applied to percentage sizing
+        initial_balance (float): Starting balance in quote asset
+        fee_rate (float): Fee rate charged on the notional of every fill
+        orders (dict, optional): Precomputed strategy_orders() for these candles and offsets; an
+            'entry_capacity' array (see utils.intrabar_fills) caps the quantity of each entry fill
+
+    Returns:
+        BacktestResult
+    """
+    if orders is None:
+        orders = strategy_orders(candles, buy_offset, sell_offset, tick_size)
+    close = candles['close']
+    n = len(close)
+    next_entry = _next_true_index(orders['entry_hit']).tolist()
+    next_exit = _next_true_index(orders['exit_hit']).tolist()
+    next_exit.append(n)
+    entry_px = orders['entry_price']
+    exit_px = orders['exit_price']
+
+    # Walk the round trips: fill candle of the next buy, then fill candle of the trailing stop
+    entries, exits = [], []
+    place = 0  # Candle at whose close the next buy order is placed
+    while place + 1 < n:
+        entry = next_entry[place + 1]
+        if entry >= n:
+            break
+        exit_ = next_exit[entry + 1]
+        entries.append(entry)
+        exits.append(exit_)
+        # CLOSED_LONG candle, then a NONE candle that places the next buy
+        place = exit_ + 1
+
+    entries = np.asarray(entries, dtype=np.int64)
+    exits = np.asarray(exits, dtype=np.int64)
+    quantities = _position_sizes(entries, exits, entry_px, exit_px, n, step_size, quantity_type, quantity,
+                                 quantity_percentage, leverage, initial_balance, fee_rate,
+                                 orders.get('entry_capacity'))
+    closed = exits < n
+    open_time = candles['open_time']
+
+    # Closed round trips
+    c_entry, c_exit, c_qty = entries[closed], exits[closed], quantities[closed]
+    entry_prices = entry_px[c_entry]
+    exit_prices = exit_px[c_exit]
+    pnl = c_qty * (exit_prices - entry_prices)
+    fees = fee_rate * c_qty * (entry_prices + exit_prices)
+    trades = {
+        'entry_index': c_entry,
+        'exit_index': c_exit,
+        'entry_time': open_time[c_entry],
+        'exit_time': open_time[c_exit],
+        'entry_price': entry_prices,
+        'exit_price': exit_prices,
+        'quantity': c_qty,
+        'pnl': pnl,
+        'fees': fees,
+        'net_pnl': pnl - fees,
+        'bars_held': c_exit - c_entry,
+    }
+
+    # Equity: realised cash flows plus the open position marked at each close
+    # (entry and exit candles are strictly increasing and never coincide, so plain fancy indexing is safe)
+    cash_flow = np.zeros(n)
+    held_delta = np.zeros(n)
+    cost_delta = np.zeros(n)
+    all_entry_prices = entry_px[entries]
+    cash_flow[entries] = -fee_rate * quantities * all_entry_prices
+    held_delta[entries] = quantities
+    cost_delta[entries] = quantities * all_entry_prices
+    cash_flow[c_exit] = pnl - fee_rate * c_qty * exit_prices
+    held_delta[c_exit] = -c_qty
+    cost_delta[c_exit] = -c_qty * entry_prices
+    held = np.cumsum(held_delta)
+    equity = initial_balance + np.cumsum(cash_flow) - np.cumsum(cost_delta) + held * close
+
+    open_position = None
+    if len(entries) and not closed[-1]:
+        open_position = {
+            'entry_index': int(entries[-1]),
+            'entry_time': int(open_time[entries[-1]]),
+            'entry_price': float(all_entry_prices[-1]),
+            'quantity': float(quantities[-1]),
+        }
+    return BacktestResult(trades, equity, backtest_stats(trades, equity, initial_balance, held, open_position))
+
+
+def _position_sizes(entries, exits, entry_px, exit_px, n, step_size, quantity_type, quantity,
+                    quantity_percentage, leverage, initial_balance, fee_rate, capacity=None):
+    """
+    Quantity of every round trip; percentage sizing compounds on the realised balance
+
+    With `capacity`, an entry only fills up to the capacity of its fill candle (partial fill).
+    """
+    qty_grid = TickGrid(step_size) if step_size is not None else None
+    if quantity_type != 'percentage':
+        qty = quantity if qty_grid is None else qty_grid.to_float(qty_grid.floor(quantity).units)
+        quantities = np.full(len(entries), qty, dtype=np.float64)
+        if capacity is not None:
+            quantities = np.minimum(quantities, capacity[entries])
+            if qty_grid is not None:
+                quantities = qty_grid.to_floats(qty_grid.floor_units(quantities))
+        return quantities
+
+    fraction = quantity_percentage / 100 * leverage
+    entry_prices = entry_px[entries].tolist()
+    exit_prices = exit_px[np.minimum(exits, n - 1)].tolist()
+    capacities = capacity[entries].tolist() if capacity is not None else [float('inf')] * len(entries)
+    quantities = []
+    balance = initial_balance
+    for entry_price, exit_price, fillable in zip(entry_prices, exit_prices, capacities):
+        qty = min(balance * fraction / entry_price, fillable)
+        if qty_grid is not None:
+            qty = qty_grid.to_float(qty_grid.floor(qty).units)
+        quantities.append(qty)
+        balance += qty * (exit_price - entry_price) - fee_rate * qty * (entry_price + exit_price)
+    return np.asarray(quantities, dtype=np.float64)
+
+
+def backtest_stats(trades, equity, initial_balance, held, open_position=None):
+    """Summary statistics for a backtest"""
+    net = trades['net_pnl']
+    wins = net[net > 0]
+    losses = net[net <= 0]
+    gross_profit = float(wins.sum())
+    gross_loss = float(-losses.sum())
+    final_equity = float(equity[-1]) if len(equity) else initial_balance
+    if len(equity):
+        peak = np.maximum.accumulate(np.maximum(equity, initial_balance))
+        drawdown = peak - equity
+        worst = int(np.argmax(drawdown))
+        max_drawdown = float(drawdown[worst])
+        max_drawdown_pct = float(drawdown[worst] / peak[worst] * 100) if peak[worst] > 0 else 0.0
+    else:
+        max_drawdown = max_drawdown_pct = 0.0
+    return {
+        'bars': int(len(equity)),
+        'trades': int(len(net)),
+        'wins': int(len(wins)),
+        'losses': int(len(losses)),
+        'win_rate': float(len(wins) / len(net) * 100) if len(net) else 0.0,
+        'gross_profit': gross_profit,
+        'gross_loss': gross_loss,
+        'profit_factor': gross_profit / gross_loss if gross_loss > 0 else (float('inf') if gross_profit > 0 else 0.0),
+        'net_pnl': float(net.sum()),
+        'total_fees': float(trades['fees'].sum()),
+        'avg_trade': float(net.mean()) if len(net) else 0.0,
+        'avg_bars_held': float(trades['bars_held'].mean()) if len(net) else 0.0,
+        'exposure_pct': float(np.count_nonzero(held > 0) / len(held) * 100) if len(held) else 0.0,
+        'initial_balance': initial_balance,
+        'final_equity': final_equity,
+        'return_pct': (final_equity - initial_balance) / initial_balance * 100 if initial_balance else 0.0,
+        'max_drawdown': max_drawdown,
+        'max_drawdown_pct': max_drawdown_pct,
+        'open_position': open_position,
+    }
+
+
+# Run a backtest from the command line
+if __name__ == "__main__":
+    import sys
+    from datetime import datetime
+    from utils.config import get_buy_offset, get_sell_offset
+    from utils.symbol_filters import get_symbol_filters
+    from utils.logger import log_websocket
+
+    if len(sys.argv) < 5:
+        log_websocket("Usage: python -m utils.backtest <symbol> <interval> <start dd-mm-YYYY> <end dd-mm-YYYY> [buy_offset] [sell_offset]")
+        log_websocket("Example: python -m utils.backtest ETHUSDT 1m 01-01-2024 01-01-2025 1 1")
+        sys.exit(1)
+
+    symbol = sys.argv[1].upper()
+    interval = sys.argv[2]
+    start_ms = int(datetime.strptime(sys.argv[3], '%d-%m-%Y').timestamp() * 1000)
+    end_ms = int(datetime.strptime(sys.argv[4], '%d-%m-%Y').timestamp() * 1000)
+    buy_offset = float(sys.argv[5]) if len(sys.argv) > 5 else get_buy_offset()
+    sell_offset = float(sys.argv[6]) if len(sys.argv) > 6 else get_sell_offset()
+
+    filters = get_symbol_filters(symbol)
+    candles = load_klines(symbol, interval, start_ms, end_ms)
+    result = run_backtest(candles, buy_offset, sell_offset, filters.tick_size, filters.step_size)
+    for key, value in result.stats.items():
+        log_websocket(f"{key}: {value}")
@@ -0,0 +1,29 @@
+from binance.client import Client
+from utils.config import BINANCE_API_KEY, BINANCE_API_SECRET, MODE, SIM, SIM_URL
+from utils.time_sync import attach_client
+from utils.latency_trace import instrument_client
+
+
+def create_client(api_key=BINANCE_API_KEY, api_secret=BINANCE_API_SECRET, testnet=MODE, ping=True):
+    """
+    Create a Binance client whose request signing follows the server clock.
+
+    The client is attached to the time sync service, so once a long-running process
+    has started it (start_time_sync), signed requests use the smoothed server offset
+    instead of the raw local clock (avoids -1021). Creating a client starts no thread.
+    With MODE=sim every endpoint points at the local exchange simulator.
+    Every request is timed for the candle-to-order latency trace.
+
+    A client keeps the last response on itself (client.response), so it must not be
+    shared between threads; extra clients for worker threads can skip the ping.
+    """
+    if SIM:
+        client = Client(api_key, api_secret, ping=False)
+        client.API_URL = f"{SIM_URL}/api"
+        client.FUTURES_URL = f"{SIM_URL}/fapi"
+        client.FUTURES_DATA_URL = f"{SIM_URL}/futures/data"
+    else:
+        client = Client(api_key, api_secret, testnet=testnet, ping=ping)
+    attach_client(client)
+    instrument_client(client)
+    return client
@@ -1,6 +1,10 @@
 """
 Bot state management module to track positions and orders across the application
 """
+from utils import metrics
+from utils.shared_state import publish_bot_state
+
+POSITION_TRANSITIONS = metrics.counter('bot_position_transitions_total', 'Strategy position state changes', ('from_state', 'to_state'))
 
 # Global state variables
 position = 'NONE'  # Current position: 'NONE', 'LONG', 'SHORT', 'CLOSED_LONG', 'CLOSED_SHORT'
@@ -9,6 +13,10 @@ active_sell_order = None  # Details of the current sell order
 buy_filled_price = None  # Price at which the buy order was filled
 candle_order_created_at = None  # Timestamp of the candle when the order was created
 
+def publish():
+    """Mirror the state into the shared-memory block read by the API process"""
+    publish_bot_state(position, active_buy_order, active_sell_order, buy_filled_price, candle_order_created_at)
+
 def get_position():
     """Get current position"""
     global position
@@ -17,7 +25,10 @@ def get_position():
 def set_position(new_position):
     """Set current position"""
     global position
+    if new_position != position:
+        POSITION_TRANSITIONS.labels(from_state=position, to_state=new_position).inc()
     position = new_position
+    publish()
     return position
 
 def get_active_buy_order():
@@ -29,6 +40,7 @@ def set_active_buy_order(order):
     """Set current active buy order"""
     global active_buy_order
     active_buy_order = order
+    publish()
     return active_buy_order
 
 def get_active_sell_order():
@@ -40,6 +52,7 @@ def set_active_sell_order(order):
     """Set current active sell order"""
     global active_sell_order
     active_sell_order = order
+    publish()
     return active_sell_order
 
 def get_buy_filled_price():
@@ -51,6 +64,7 @@ def set_buy_filled_price(price):
     """Set price at which the buy order was filled"""
     global buy_filled_price
     buy_filled_price = price
+    publish()
     return buy_filled_price
 
 def get_candle_order_created_at():
@@ -62,6 +76,7 @@ def set_candle_order_created_at(timestamp):
     """Set timestamp of the candle when the order was created"""
     global candle_order_created_at
     candle_order_created_at = timestamp
+    publish()
     return candle_order_created_at
 
 def reset_state():
@@ -72,5 +87,6 @@ def reset_state():
     active_sell_order = None
     buy_filled_price = None
     candle_order_created_at = None
+    publish()
     return True
 
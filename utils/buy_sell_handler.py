@@ -1,15 +1,24 @@
 from binance.enums import *
 from binance.client import Client
+from binance.exceptions import BinanceAPIException, BinanceRequestException
 from utils.config import BINANCE_API_KEY, BINANCE_API_SECRET, MODE
 from pprint import pprint
 from rich import print as rich_print
 from rich.pretty import Pretty
 import math
+import time
+import hashlib
+import requests
+from collections import OrderedDict
 from utils.order_storage import save_filled_order, enrich_order_details
-from utils.logger import log_websocket, log_error
+from utils.symbol_filters import TickGrid, get_symbol_filters
+from utils.pretrade_validator import validate_order
+from utils.binance_client import create_client
+from utils.time_sync import resync_time
+from utils.logger import log_websocket, log_error, log_verbose
 
 
-client = Client(BINANCE_API_KEY, BINANCE_API_SECRET, testnet=MODE)
+client = create_client()
 
 
 def round_to_tick(price, tick_size):
@@ -17,12 +26,9 @@ def round_to_tick(price, tick_size):
     Round price to the closest valid tick size for the exchange
     Floor the result to be conservative with stop loss prices
     """
-    # Floor to the nearest tick size (this is what Binance appears to do)
-    # This will ensure prices match exactly with what the exchange expects
-    rounded = math.floor(price / tick_size) * tick_size
-    
-    # Format to max 2 decimal places to avoid floating point issues
-    return round(rounded, 2)
+    # Floor on the integer tick grid (this is what Binance appears to do),
+    # so the result matches the exchange exactly for any tick size
+    return float(TickGrid(tick_size).floor(price))
 
 def enable_hedge_mode():
     try:
@@ -33,13 +39,169 @@ def enable_hedge_mode():
 
 # enable_hedge_mode()
 
-def long_buy_order(symbol:str, price:float, stopLimit:float, quantity:float):
+# Client order ids must match ^[.A-Z:/a-z0-9_-]{1,36}$ on Binance Futures
+CLIENT_ORDER_ID_PREFIX = 'hab'
+CLIENT_ORDER_ID_MAX_LEN = 36
+
+# Retry settings for transport-level failures (timeouts, dropped connections, 5xx)
+ORDER_SUBMIT_RETRIES = 3
+ORDER_SUBMIT_RETRY_DELAY = 0.25  # seconds, doubled after every attempt
+
+# Binance error codes that leave the order state unknown or signal a duplicate submission
+UNKNOWN_STATUS_CODES = (-1006, -1007)
+INVALID_TIMESTAMP_CODE = -1021
+DUPLICATE_CLIENT_ORDER_ID_CODE = -4116
+ORDER_DOES_NOT_EXIST_CODE = -2013
+
+# Local dedup table: clientOrderId -> order acknowledged by the exchange
+MAX_TRACKED_CLIENT_ORDERS = 512
+submitted_orders = OrderedDict()
+
+
+def make_client_order_id(symbol: str, candle_time, intent: str) -> str:
+    """
+    Build a deterministic clientOrderId for a (symbol, candle, intent) triple.
+
+    The same candle and intent always map to the same id, so a retried or
+    replayed submission can never open a second order on the exchange.
+
+    Args:
+        symbol (str): Trading pair symbol (e.g., 'ETHUSDT')
+        candle_time (int): Open time of the candle the order belongs to (ms)
+        intent (str): Short tag describing the purpose of the order (e.g., 'BL', 'SLT')
+
+    Returns:
+        str: A valid Binance clientOrderId
+    """
+    client_order_id = f"{CLIENT_ORDER_ID_PREFIX}-{intent}-{symbol.upper()}-{int(candle_time)}"
+    if len(client_order_id) > CLIENT_ORDER_ID_MAX_LEN:
+        digest = hashlib.sha1(client_order_id.encode()).hexdigest()[:16]
+        client_order_id = f"{CLIENT_ORDER_ID_PREFIX}-{intent}-{digest}"[:CLIENT_ORDER_ID_MAX_LEN]
+    return client_order_id
+
+
+def remember_client_order(client_order_id: str, order):
+    """Record an acknowledged order in the local dedup table"""
+    submitted_orders[client_order_id] = order
+    submitted_orders.move_to_end(client_order_id)
+    while len(submitted_orders) > MAX_TRACKED_CLIENT_ORDERS:
+        submitted_orders.popitem(last=False)
+
+
+def get_remembered_order(client_order_id: str):
+    """Return the order previously acknowledged for this clientOrderId, if any"""
+    return submitted_orders.get(client_order_id)
+
+
+def is_transport_error(error) -> bool:
+    """
+    Check whether an exception leaves the order state unknown.
+
+    Network failures, timeouts, 5xx responses and Binance's "send status unknown"
+    errors may or may not have created the order on the exchange.
+    """
+    if isinstance(error, (requests.exceptions.RequestException, BinanceRequestException)):
+        return True
+    if isinstance(error, BinanceAPIException):
+        return error.status_code >= 500 or error.code in UNKNOWN_STATUS_CODES
+    return False
+
+
+def lookup_order_by_client_id(symbol: str, client_order_id: str):
+    """
+    Resolve an ambiguous submission with a single lookup by clientOrderId.
+
+    Returns:
+        The order dictionary if the exchange knows the order, None if it does not exist
+
+    Raises:
+        Exception: If the lookup itself fails
+    """
+    try:
+        return client.futures_get_order(symbol=symbol, origClientOrderId=client_order_id)
+    except BinanceAPIException as e:
+        if e.code == ORDER_DOES_NOT_EXIST_CODE:
+            return None
+        raise
+
+
+def submit_order(client_order_id=None, **params):
+    """
+    Submit a futures order idempotently.
+
+    When a clientOrderId is given, the local dedup table is consulted first and the
+    id is sent as newClientOrderId. Transport errors are retried immediately; before
+    every retry the order is looked up by its clientOrderId so an order that did
+    reach the exchange is returned instead of being placed twice.
+
+    Args:
+        client_order_id (str, optional): Deterministic id from make_client_order_id
+        **params: Parameters for client.futures_create_order
+
+    Returns:
+        Order details dictionary or None if the order was rejected or could not be placed
+    """
+    if client_order_id is None:
+        return client.futures_create_order(**params)
+
+    existing = get_remembered_order(client_order_id)
+    if existing:
+        log_websocket(f"[ORDER] Order {client_order_id} already submitted (orderId {existing.get('orderId')}), skipping duplicate")
+        return existing
+
+    params['newClientOrderId'] = client_order_id
+    delay = ORDER_SUBMIT_RETRY_DELAY
+    for attempt in range(1, ORDER_SUBMIT_RETRIES + 1):
+        try:
+            order = client.futures_create_order(**params)
+            remember_client_order(client_order_id, order)
+            return order
+        except BinanceAPIException as e:
+            if e.code == INVALID_TIMESTAMP_CODE and attempt < ORDER_SUBMIT_RETRIES:
+                # Rejected before reaching the matching engine: resync the clock and resend at once
+                log_websocket(f"[ORDER] Timestamp rejected for {client_order_id}, resyncing with server time (offset {resync_time():.0f} ms)")
+                continue
+            if e.code == DUPLICATE_CLIENT_ORDER_ID_CODE:
+                # An earlier attempt made it through; fetch it instead of failing
+                order = lookup_order_by_client_id(params['symbol'], client_order_id)
+                if order:
+                    remember_client_order(client_order_id, order)
+                return order
+            if not is_transport_error(e):
+                raise
+            error = e
+        except Exception as e:
+            if not is_transport_error(e):
+                raise
+            error = e
+
+        log_websocket(f"[ORDER] Submission of {client_order_id} failed with transport error ({error}), resolving by client id (attempt {attempt}/{ORDER_SUBMIT_RETRIES})")
+        try:
+            order = lookup_order_by_client_id(params['symbol'], client_order_id)
+        except Exception as lookup_error:
+            log_error(f"Error looking up order {client_order_id}: {lookup_error}", exc_info=True)
+            order = None
+        if order:
+            log_websocket(f"[ORDER] Order {client_order_id} exists on the exchange (orderId {order.get('orderId')})")
+            remember_client_order(client_order_id, order)
+            return order
+        if attempt < ORDER_SUBMIT_RETRIES:
+            time.sleep(delay)
+            delay *= 2
+
+    raise error
+
+
+def long_buy_order(symbol:str, price:float, stopLimit:float, quantity:float, client_order_id:str=None):
     try:
-        # Round price and stopLimit to 2 decimal places
-        price = round(price, 2)
-        stopLimit = round(stopLimit, 2)
+        # Convert price, stopLimit and quantity to exact strings on the symbol's tick/step grid
+        filters = get_symbol_filters(symbol)
+        price = filters.price_str(price)
+        stopLimit = filters.price_str(stopLimit)
+        quantity = filters.qty_str(quantity)
         
-        order = client.futures_create_order(
+        order = submit_order(
+            client_order_id,
             symbol=symbol,
             side=SIDE_BUY,
             price=price,
@@ -55,13 +217,16 @@ def long_buy_order(symbol:str, price:float, stopLimit:float, quantity:float):
 
 
 
-def long_sell_order(symbol:str, price:float, stopLimit:float, quantity:float):
+def long_sell_order(symbol:str, price:float, stopLimit:float, quantity:float, client_order_id:str=None):
     try:
-        # Round price and stopLimit to 2 decimal places
-        price = round(price, 2)
-        stopLimit = round(stopLimit, 2)
+        # Convert price, stopLimit and quantity to exact strings on the symbol's tick/step grid
+        filters = get_symbol_filters(symbol)
+        price = filters.price_str(price)
+        stopLimit = filters.price_str(stopLimit)
+        quantity = filters.qty_str(quantity)
         
-        order = client.futures_create_order(
+        order = submit_order(
+            client_order_id,
             symbol=symbol,
             side=SIDE_SELL,
             price=price,
@@ -77,13 +242,16 @@ def long_sell_order(symbol:str, price:float, stopLimit:float, quantity:float):
 
 
 
-def short_buy_order(symbol:str, price:float, stopLimit:float, quantity:float):
+def short_buy_order(symbol:str, price:float, stopLimit:float, quantity:float, client_order_id:str=None):
     try:
-        # Round price and stopLimit to 2 decimal places
-        price = round(price, 2)
-        stopLimit = round(stopLimit, 2)
+        # Convert price, stopLimit and quantity to exact strings on the symbol's tick/step grid
+        filters = get_symbol_filters(symbol)
+        price = filters.price_str(price)
+        stopLimit = filters.price_str(stopLimit)
+        quantity = filters.qty_str(quantity)
         
-        order = client.futures_create_order(
+        order = submit_order(
+            client_order_id,
             symbol=symbol,
             side=SIDE_BUY,
             price=price,
@@ -97,13 +265,16 @@ def short_buy_order(symbol:str, price:float, stopLimit:float, quantity:float):
         log_error(f"Error creating short buy order: {e}", exc_info=True)
         return None
 
-def short_sell_order(symbol:str, price:float, stopLimit:float, quantity:float):
+def short_sell_order(symbol:str, price:float, stopLimit:float, quantity:float, client_order_id:str=None):
     try:
-        # Round price and stopLimit to 2 decimal places
-        price = round(price, 2)
-        stopLimit = round(stopLimit, 2)
+        # Convert price, stopLimit and quantity to exact strings on the symbol's tick/step grid
+        filters = get_symbol_filters(symbol)
+        price = filters.price_str(price)
+        stopLimit = filters.price_str(stopLimit)
+        quantity = filters.qty_str(quantity)
         
-        order = client.futures_create_order(
+        order = submit_order(
+            client_order_id,
             symbol=symbol,
             side=SIDE_SELL,
             price=price,
@@ -119,13 +290,7 @@ def short_sell_order(symbol:str, price:float, stopLimit:float, quantity:float):
 
 
 def get_tick_size(symbol: str):
-    info = client.futures_exchange_info()
-    for s in info['symbols']:
-        if s['symbol'] == symbol:
-            for f in s['filters']:
-                if f['filterType'] == 'PRICE_FILTER':
-                    return float(f['tickSize'])
-    raise ValueError(f"Tick size not found for symbol {symbol}")
+    return get_symbol_filters(symbol).tick_size
 
 
 def format_order_info(order):
@@ -158,12 +323,12 @@ def print_order_info(order):
     """
     info = format_order_info(order)
     if info:
-        # Convert the Pretty object to a string representation and log it
-        log_websocket(f"{info}")
+        # Converted to text by the log writer, and only if the sampled record is kept
+        log_verbose("[ORDER] Order info: %s", info)
     else:
         log_websocket("No order information available")
 
-def buy_long(symbol, price, stop_limit, quantity):
+def buy_long(symbol, price, stop_limit, quantity, candle_time=None):
     """
     Create a long buy order with stop price
     
@@ -172,35 +337,29 @@ def buy_long(symbol, price, stop_limit, quantity):
         price (float): Order price
         stop_limit (float): Stop price to trigger the order
         quantity (float): Order quantity
+        candle_time (int, optional): Open time of the candle the order is placed for (ms).
+            When given, the order gets a deterministic clientOrderId and is submitted idempotently.
         
     Returns:
         Order details dictionary or None if error
     """
     try:
-        # Round price and stop_limit to 2 decimal places
-        price = round(price, 2)
-        stop_limit = round(stop_limit, 2)
-        
-        # Get tick size and adjust to valid exchange values
-        tick_size = get_tick_size(symbol)
-        price = round_to_tick(price, tick_size)
-        stop_limit = round_to_tick(stop_limit, tick_size)
+        # Floor price and stop_limit onto the symbol's integer tick grid
+        filters = get_symbol_filters(symbol)
+        price = float(filters.price.floor(price))
+        stop_limit = float(filters.price.floor(stop_limit))
         
         log_websocket(f"[BUY_LONG] Rounded price: {price}, stop_limit: {stop_limit}")
         
-        # Check current market price to avoid "would immediately trigger" error
-        try:
-            ticker = client.futures_symbol_ticker(symbol=symbol)
-            current_price = float(ticker['price'])
-            
-            if current_price >= stop_limit:
-                log_websocket(f"[BUY_LONG] Cannot place stop order - current price ({current_price}) is already above stop limit ({stop_limit})")
-                return None
-        except Exception as e:
-            log_error(f"Error checking market price in buy_long: {e}", exc_info=True)
-            # Continue with order attempt even if price check fails
+        # Validate in memory (filters, live price, account mirror) to avoid "would immediately trigger"
+        # and other rejections without a signed round-trip
+        rejection = validate_order(symbol, SIDE_BUY, price, stop_limit, float(filters.qty.floor(quantity)), position_side='LONG', client=client)
+        if rejection:
+            log_websocket(f"[BUY_LONG] Order rejected locally - {rejection}")
+            return None
         
-        order = long_buy_order(symbol, price=price, stopLimit=stop_limit, quantity=quantity)
+        client_order_id = make_client_order_id(symbol, candle_time, 'BL') if candle_time is not None else None
+        order = long_buy_order(symbol, price=price, stopLimit=stop_limit, quantity=quantity, client_order_id=client_order_id)
         
         if order:
             # No longer saving open orders
@@ -211,7 +370,7 @@ def buy_long(symbol, price, stop_limit, quantity):
         log_error(f"Error in buy_long: {e}", exc_info=True)
         return None
 
-def sell_long(symbol, price, stop_limit, quantity):
+def sell_long(symbol, price, stop_limit, quantity, candle_time=None, intent='SLT'):
     """
     Create a long sell order with stop price (for stop-loss)
     
@@ -220,29 +379,27 @@ def sell_long(symbol, price, stop_limit, quantity):
         price (float): Order price - should be the same as stop_limit for consistency
         stop_limit (float): Stop price to trigger the order
         quantity (float): Order quantity
+        candle_time (int, optional): Open time of the candle the order is placed for (ms).
+            When given, the order gets a deterministic clientOrderId and is submitted idempotently.
+        intent (str): clientOrderId tag, 'SLI' for the initial stop after a fill, 'SLT' for trailing updates
         
     Returns:
         Order details dictionary or None if error
     """
     try:
-        # Round price and stop_limit to 2 decimal places
-        price = round(price, 2)
-        stop_limit = round(stop_limit, 2)
-        
         # Make price and stop_limit the same for consistent execution
-        # Use stop_limit as the source of truth
-        price = stop_limit
-        
-        # Get tick size and adjust to valid exchange values
-        tick_size = get_tick_size(symbol)
-        price = round_to_tick(price, tick_size)
-        stop_limit = round_to_tick(stop_limit, tick_size)
-        
-        # Make sure price and stop_limit are identical
+        # Use stop_limit, floored onto the symbol's integer tick grid, as the source of truth
+        filters = get_symbol_filters(symbol)
+        stop_limit = float(filters.price.floor(stop_limit))
         price = stop_limit
         
         log_websocket(f"[SELL_LONG] Rounded price: {price}, stop_limit: {stop_limit}")
-        order = long_sell_order(symbol, price=price, stopLimit=stop_limit, quantity=quantity)
+        rejection = validate_order(symbol, SIDE_SELL, price, stop_limit, float(filters.qty.floor(quantity)), position_side='LONG', client=client)
+        if rejection:
+            log_websocket(f"[SELL_LONG] Order rejected locally - {rejection}")
+            return None
+        client_order_id = make_client_order_id(symbol, candle_time, intent) if candle_time is not None else None
+        order = long_sell_order(symbol, price=price, stopLimit=stop_limit, quantity=quantity, client_order_id=client_order_id)
         
         if order:
             # No longer saving open orders
@@ -1,5 +1,8 @@
 import os
 import json
+import threading
+from types import MappingProxyType
+from typing import Any, Mapping, NamedTuple
 from dotenv import load_dotenv
 from binance.client import Client  # Importing Client from python-binance
 # Load environment variables from .env file
@@ -14,8 +17,12 @@ def get_binance_keys():
     Returns the appropriate Binance API key and secret based on MODE.
     If MODE is 'test' or 'true', use testnet keys.
     If MODE is 'live' or 'false', use mainnet keys.
+    If MODE is 'sim', use SIM keys (the local exchange simulator does not check them).
     """
-    if MODE_ENV in ['test', 'true']:
+    if MODE_ENV == 'sim':
+        api_key = os.getenv('SIM_API_KEY', 'sim')
+        secret_key = os.getenv('SIM_SECRET_KEY', 'sim')
+    elif MODE_ENV in ['test', 'true']:
         api_key = os.getenv('BINANCE_TESTNET_API_KEY')
         secret_key = os.getenv('BINANCE_TESTNET_SECRET_KEY')
     else:
@@ -43,6 +50,11 @@ def print_mode_status():
 MODE = print_mode_status()
 TEST = MODE  # For backward compatibility
 
+# Local exchange simulator (python -m utils.exchange_sim.server); MODE=sim points REST and websockets at it
+SIM = MODE_ENV == 'sim'
+SIM_URL = os.getenv('SIM_URL', 'http://127.0.0.1:8090')
+SIM_WS_URL = os.getenv('SIM_WS_URL', 'ws://127.0.0.1:8090/ws')
+
 BINANCE_API_KEY, BINANCE_API_SECRET, GEMINI_API_KEY = get_binance_keys()
 
 # print(f"Binance API Key: {BINANCE_API_KEY}")
@@ -58,36 +70,176 @@ BINANCE_API_KEY, BINANCE_API_SECRET, GEMINI_API_KEY = get_binance_keys()
 # Path to trading_config.json in the api folder
 TRADING_CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'api', 'trading_config.json')
 
+QUANTITY_TYPES = ('fixed', 'percentage', 'price')
+
+
+class TradingConfig(NamedTuple):
+    """Immutable, validated snapshot of trading_config.json (hot-path reads are attribute lookups)"""
+    symbol_name: str
+    candle_interval: str
+    quantity_type: str
+    quantity: float
+    quantity_percentage: float
+    price_value: float
+    leverage: int
+    buy_long_offset: float
+    sell_long_offset: float
+    raw: Mapping[str, Any]  # Full file contents, read-only (payment fields etc.)
+
+
+def parse_trading_config(data):
+    """
+    Validate trading_config.json contents into a TradingConfig
+
+    Raises:
+        ValueError: if a trading field is missing or invalid
+    """
+    from utils.interval_calendar import SUPPORTED_INTERVALS
+    if not isinstance(data, dict):
+        raise ValueError("trading config must be a JSON object")
+    try:
+        config = TradingConfig(
+            symbol_name=str(data.get('symbol_name') or '').upper(),
+            candle_interval=data.get('candle_interval'),
+            quantity_type=data.get('quantity_type', 'fixed'),
+            quantity=float(data.get('quantity', os.getenv('QUANTITY', '0.01'))),
+            quantity_percentage=float(data.get('quantity_percentage', '10')),
+            price_value=float(data.get('price_value', '10')),
+            leverage=int(data.get('leverage', '1')),
+            buy_long_offset=float(data.get('buy_long_offset', 0)),
+            sell_long_offset=float(data.get('sell_long_offset', 0)),
+            raw=MappingProxyType(dict(data)),
+        )
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"invalid trading config value: {e}") from None
+    if not config.symbol_name:
+        raise ValueError("symbol_name is required")
+    if config.candle_interval not in SUPPORTED_INTERVALS:
+        raise ValueError(f"unsupported candle_interval {config.candle_interval!r}")
+    if config.quantity_type not in QUANTITY_TYPES:
+        raise ValueError(f"quantity_type must be one of {', '.join(QUANTITY_TYPES)}")
+    if config.leverage < 1:
+        raise ValueError("leverage must be at least 1")
+    if min(config.quantity, config.quantity_percentage, config.price_value) < 0:
+        raise ValueError("quantity, quantity_percentage and price_value must not be negative")
+    return config
+
+
 def load_trading_config():
     with open(TRADING_CONFIG_PATH, 'r') as f:
         return json.load(f)
 
+
+# Current snapshot and the (mtime_ns, size) of the file it was read from
+_trading_config = None
+_trading_config_stamp = None
+_trading_config_lock = threading.Lock()
+
+
+def _config_file_stamp():
+    stat = os.stat(TRADING_CONFIG_PATH)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def refresh_trading_config():
+    """
+    Reload the snapshot if trading_config.json changed (one stat call when it did not)
+
+    The bot calls this once per candle. An invalid or unreadable file keeps the previous snapshot.
+
+    Returns:
+        TradingConfig: the current snapshot
+    """
+    global _trading_config, _trading_config_stamp
+    try:
+        stamp = _config_file_stamp()
+    except OSError:
+        if _trading_config is None:
+            raise
+        return _trading_config
+    if stamp == _trading_config_stamp and _trading_config is not None:
+        return _trading_config
+    with _trading_config_lock:
+        try:
+            config = parse_trading_config(load_trading_config())
+        except (OSError, ValueError) as e:
+            if _trading_config is None:
+                raise
+            from utils.logger import log_error
+            log_error(f"Ignoring invalid {TRADING_CONFIG_PATH} ({e}); keeping the previous trading config")
+            _trading_config_stamp = stamp
+            return _trading_config
+        _trading_config, _trading_config_stamp = config, stamp
+    return config
+
+
+def get_trading_config():
+    """The current TradingConfig snapshot (loaded on first use, then swapped only by refresh/save)"""
+    return _trading_config if _trading_config is not None else refresh_trading_config()
+
+
+def save_trading_config(updates):
+    """
+    Merge `updates` into trading_config.json, validate, write atomically and swap the snapshot
+
+    Concurrent readers see either the old or the new file, never a partial write; the bot
+    process picks the change up with its next per-candle refresh.
+
+    Returns:
+        TradingConfig: the new snapshot
+
+    Raises:
+        ValueError: if the merged config is invalid (nothing is written)
+    """
+    global _trading_config, _trading_config_stamp
+    with _trading_config_lock:
+        data = load_trading_config()
+        data.update({key: value for key, value in updates.items() if value is not None})
+        config = parse_trading_config(data)
+        tmp_path = f"{TRADING_CONFIG_PATH}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, TRADING_CONFIG_PATH)
+        _trading_config, _trading_config_stamp = config, _config_file_stamp()
+    return config
+
+
 def get_quantity_type():
-    return load_trading_config().get('quantity_type', 'fixed')
+    return get_trading_config().quantity_type
 
 def get_fixed_quantity():
-    return float(load_trading_config().get('quantity', os.getenv('QUANTITY', '0.01')))
+    return get_trading_config().quantity
 
 def get_quantity_percentage():
-    return float(load_trading_config().get('quantity_percentage', '10'))
+    return get_trading_config().quantity_percentage
 
 def get_price_value():
-    return float(load_trading_config().get('price_value', '10'))
+    return get_trading_config().price_value
 
 def get_leverage():
-    return int(load_trading_config().get('leverage', '1'))
+    return get_trading_config().leverage
 
 def get_trading_symbol():
-    return load_trading_config().get('symbol_name')
+    return get_trading_config().symbol_name
 
 def get_sell_offset():
-    return float(load_trading_config().get('sell_long_offset', 0))
+    return get_trading_config().sell_long_offset
 
 def get_buy_offset():
-    return float(load_trading_config().get('buy_long_offset', 0))
+    return get_trading_config().buy_long_offset
 
 def get_candle_interval():
-    return load_trading_config().get('candle_interval')
+    return get_trading_config().candle_interval
+
+# Websocket capture: record raw kline frames for offline replay (see utils/websocket_client/ws_recorder.py)
+WS_RECORD = os.getenv('WS_RECORD', 'false').lower() in ['true', '1', 'yes']
+WS_RECORD_DIR = os.getenv('WS_RECORD_DIR')  # Defaults to data/ws_capture
+
+# Candle-to-order latency tracing (see utils/latency_trace.py)
+LATENCY_TRACE = os.getenv('LATENCY_TRACE', 'true').lower() in ['true', '1', 'yes']
+LATENCY_SUMMARY_EVERY = int(os.getenv('LATENCY_SUMMARY_EVERY', '20'))  # Closed candles per rolling log summary
 
 # Order settings
 MAX_ORDERS = 1  # Maximum number of open orders per symbol
@@ -0,0 +1,234 @@
+"""
+Account equity time series, stored pre-downsampled for charting any period.
+
+Snapshots of the margin balance (wallet balance plus unrealized PnL) are folded into
+three levels, 1m, 1h and 1d buckets, each keeping the min, max and last equity and
+the last wallet balance of its bucket. Layout: data/equity/<level>/<column>.bin, raw
+little-endian arrays sorted by bucket time, read zero-copy through np.memmap. A
+snapshot in the current bucket rewrites the last row in place, a later one appends.
+
+A query picks the finest resolution that fits its range into a point budget and
+aggregates it from the finest stored level it is a multiple of, so a year renders
+from a few hundred daily points and an hour from 60 one-minute points.
+
+The API process polls the account in the background; there is no user data stream
+in this bot to deliver ACCOUNT_UPDATE events.
+"""
+import os
+import threading
+import time
+import numpy as np
+from utils.interval_calendar import INTERVAL_MS, MINUTE_MS
+from utils.logger import log_api, log_error
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, single writer assumed
+    fcntl = None
+
+EQUITY_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'equity')
+EQUITY_LEVELS = ('1m', '1h', '1d')  # Stored bucket sizes
+EQUITY_COLUMNS = (('time', np.int64), ('min', np.float64), ('max', np.float64), ('last', np.float64),
+                  ('wallet', np.float64))
+# Resolutions a query may ask for: whole minutes, aligned to the epoch like the stored levels
+EQUITY_RESOLUTIONS = tuple(interval for interval, ms in INTERVAL_MS.items() if ms % MINUTE_MS == 0 and interval != '1w')
+EQUITY_MAX_POINTS = 500  # Default point budget of a query with automatic resolution
+EQUITY_POLL_SECONDS = int(os.getenv('EQUITY_POLL_SECONDS', '60'))  # Background snapshot period
+
+
+class EquityLevel:
+    """
+    One bucket size of the equity series
+
+    Args:
+        resolution (str): Bucket size, one of EQUITY_LEVELS
+        directory (str): Directory of the store
+    """
+
+    def __init__(self, resolution, directory=EQUITY_DIR):
+        self.resolution = resolution
+        self.bucket_ms = INTERVAL_MS[resolution]
+        self.path = os.path.join(directory, resolution)
+        self._columns = None
+        self._rows = -1  # Row count the cached memmaps were opened with
+
+    def _column_path(self, name):
+        return os.path.join(self.path, f"{name}.bin")
+
+    def _row_count(self):
+        sizes = []
+        for name, dtype in EQUITY_COLUMNS:
+            path = self._column_path(name)
+            sizes.append(os.path.getsize(path) // np.dtype(dtype).itemsize if os.path.exists(path) else 0)
+        # A crash between column writes leaves some columns longer; only complete rows count
+        return min(sizes)
+
+    def columns(self):
+        """Column name -> read-only memmap of the whole level (reopened after an append)"""
+        rows = self._row_count()
+        if self._columns is None or rows != self._rows:
+            self._columns = {
+                name: np.memmap(self._column_path(name), dtype=dtype, mode='r', shape=(rows,)) if rows
+                else np.empty(0, dtype=dtype)
+                for name, dtype in EQUITY_COLUMNS
+            }
+            self._rows = rows
+        return self._columns
+
+    def __len__(self):
+        return len(self.columns()['time'])
+
+    def arrays(self, start_ms=None, end_ms=None):
+        """Zero-copy column views of the buckets overlapping [start_ms, end_ms]"""
+        columns = self.columns()
+        times = columns['time']
+        lo = int(np.searchsorted(times, start_ms // self.bucket_ms * self.bucket_ms, side='left')) \
+            if start_ms is not None else 0
+        hi = int(np.searchsorted(times, end_ms, side='right')) if end_ms is not None else len(times)
+        return {name: column[lo:hi] for name, column in columns.items()}
+
+    def add(self, time_ms, equity, wallet):
+        """Fold a snapshot into its bucket; snapshots older than the last bucket are ignored"""
+        bucket = time_ms // self.bucket_ms * self.bucket_ms
+        columns = self.columns()
+        count = len(columns['time'])
+        last_time = int(columns['time'][-1]) if count else None
+        if last_time is not None and bucket < last_time:
+            return False
+        if bucket == last_time:
+            row = (bucket, min(float(columns['min'][-1]), equity), max(float(columns['max'][-1]), equity),
+                   equity, wallet)
+            offset = count - 1
+        else:
+            row = (bucket, equity, equity, equity, wallet)
+            offset = count
+        os.makedirs(self.path, exist_ok=True)
+        self._columns = None  # Drop the memmaps before writing
+        for (name, dtype), value in zip(EQUITY_COLUMNS, row):
+            path = self._column_path(name)
+            with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+                f.truncate(count * np.dtype(dtype).itemsize)  # Drop a torn row from an interrupted append
+                f.seek(offset * np.dtype(dtype).itemsize)
+                np.array([value], dtype=dtype).tofile(f)
+        return True
+
+
+def _downsample(arrays, bucket_ms):
+    """Aggregate finer buckets into `bucket_ms` buckets (min of min, max of max, last of last)"""
+    buckets = arrays['time'] // bucket_ms * bucket_ms
+    if not len(buckets):
+        return {name: np.empty(0, dtype=dtype) for name, dtype in EQUITY_COLUMNS}
+    starts = np.flatnonzero(np.concatenate(([True], buckets[1:] != buckets[:-1])))
+    ends = np.append(starts[1:], len(buckets)) - 1
+    return {
+        'time': buckets[starts],
+        'min': np.minimum.reduceat(arrays['min'], starts),
+        'max': np.maximum.reduceat(arrays['max'], starts),
+        'last': np.asarray(arrays['last'])[ends],
+        'wallet': np.asarray(arrays['wallet'])[ends],
+    }
+
+
+class EquityStore:
+    """
+    Equity series of the account at every stored level
+
+    Args:
+        directory (str): Directory of the store
+    """
+
+    def __init__(self, directory=EQUITY_DIR):
+        self.path = directory
+        self.levels = {resolution: EquityLevel(resolution, directory) for resolution in EQUITY_LEVELS}
+        self._write_lock = threading.Lock()
+
+    def _lock(self):
+        os.makedirs(self.path, exist_ok=True)
+        lock_file = open(os.path.join(self.path, '.lock'), 'w')
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def append(self, time_ms, equity, wallet):
+        """
+        Record a balance snapshot at every level
+
+        Args:
+            time_ms (int): Snapshot time in ms
+            equity (float): Margin balance (wallet balance plus unrealized PnL)
+            wallet (float): Wallet balance
+
+        Returns:
+            bool: False if the snapshot is older than what is stored
+        """
+        with self._write_lock, self._lock():
+            added = [level.add(int(time_ms), float(equity), float(wallet)) for level in self.levels.values()]
+        return all(added)
+
+    def record_account(self, account_info, time_ms=None):
+        """Record a snapshot from a futures_account() response"""
+        time_ms = time_ms if time_ms is not None else int(time.time() * 1000)
+        wallet = float(account_info['totalWalletBalance'])
+        equity = float(account_info.get('totalMarginBalance') or
+                       wallet + float(account_info.get('totalUnrealizedProfit', 0)))
+        return self.append(time_ms, equity, wallet)
+
+    def series(self, start_ms, end_ms, resolution='auto', max_points=EQUITY_MAX_POINTS):
+        """
+        Equity over [start_ms, end_ms] as columns at one resolution
+
+        Args:
+            resolution (str): One of EQUITY_RESOLUTIONS, or 'auto' for the finest one that
+                covers the range in at most `max_points` buckets
+
+        Raises:
+            ValueError: for an unsupported resolution or an end before the start
+        """
+        if end_ms < start_ms:
+            raise ValueError("end must not be before start")
+        if resolution == 'auto':
+            resolution = next((r for r in EQUITY_RESOLUTIONS
+                               if (end_ms - start_ms) // INTERVAL_MS[r] + 1 <= max_points), EQUITY_RESOLUTIONS[-1])
+        elif resolution not in EQUITY_RESOLUTIONS:
+            raise ValueError(f"resolution must be 'auto' or one of {', '.join(EQUITY_RESOLUTIONS)}")
+        bucket_ms = INTERVAL_MS[resolution]
+        source = max((level for level in self.levels.values() if bucket_ms % level.bucket_ms == 0),
+                     key=lambda level: level.bucket_ms)
+        # From the start of the first requested bucket, so it is not aggregated from a partial read
+        arrays = source.arrays(start_ms // bucket_ms * bucket_ms, end_ms)
+        if source.bucket_ms != bucket_ms:
+            arrays = _downsample(arrays, bucket_ms)
+        return {'resolution': resolution, 'start_time': start_ms, 'end_time': end_ms,
+                **{name: np.asarray(column).tolist() for name, column in arrays.items()}}
+
+
+_store = None
+_poll_thread = None
+
+
+def get_equity_store():
+    global _store
+    if _store is None:
+        _store = EquityStore()
+    return _store
+
+
+def start_equity_poll(interval=EQUITY_POLL_SECONDS):
+    """Snapshot the account balance into the equity store from a daemon thread (API process)"""
+    global _poll_thread
+    if _poll_thread is not None:
+        return _poll_thread
+
+    def run():
+        from utils.pnl_analyzer import get_shared_tracker
+        while True:
+            try:
+                get_equity_store().record_account(get_shared_tracker().get_account_info())
+            except Exception as e:
+                log_error(f"Equity snapshot failed: {e}")
+            time.sleep(interval)
+
+    _poll_thread = threading.Thread(target=run, name='equity-poll', daemon=True)
+    _poll_thread.start()
+    log_api(f"Equity snapshots every {interval}s into {EQUITY_DIR}")
+    return _poll_thread
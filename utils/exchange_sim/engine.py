@@ -0,0 +1,590 @@
+"""
+In-memory USD-M futures exchange: symbols, synthetic price feed, klines, STOP/LIMIT/MARKET
+order matching, hedge-mode positions, wallet and income history.
+
+Responses are shaped like the Binance Futures REST payloads the bot reads, so the
+same python-binance calls work against the simulator. The engine is synchronous and
+single-threaded; the server drives it from one asyncio loop.
+"""
+import itertools
+import math
+import random
+import secrets
+from collections import deque
+from utils.interval_calendar import align, step, INTERVAL_MS, MINUTE_MS
+from utils.symbol_filters import TickGrid
+
+DEFAULT_SYMBOLS = {
+    # symbol: (start price, tickSize, stepSize)
+    'BTCUSDT': (60000.0, '0.10', '0.001'),
+    'ETHUSDT': (3000.0, '0.01', '0.001'),
+    'BNBUSDT': (550.0, '0.010', '0.01'),
+    'SOLUSDT': (150.0, '0.0100', '1'),
+    'XRPUSDT': (0.6, '0.0001', '0.1'),
+}
+QUOTE_ASSET = 'USDT'
+DEFAULT_LEVERAGE = 20
+MAKER_FEE_RATE = 0.0002
+TAKER_FEE_RATE = 0.0005
+HISTORY_MINUTES = 1500  # 1m candles generated before start, so historical kline requests have data
+MAX_HISTORY_MINUTES = 7 * 24 * 60  # 1m candles kept per symbol
+MAX_INCOME_RECORDS = 100000
+VOLATILITY_PER_SQRT_SECOND = 0.0003  # Relative random-walk step size per sqrt(second)
+
+FINAL_STATUSES = ('FILLED', 'CANCELED', 'EXPIRED', 'REJECTED')
+
+
+class SimError(Exception):
+    """A Binance-style API error: {"code": code, "msg": msg} with an HTTP status"""
+
+    def __init__(self, code, msg, http_status=400):
+        super().__init__(msg)
+        self.code = code
+        self.msg = msg
+        self.http_status = http_status
+
+
+class SimSymbol:
+    """Market state of one simulated symbol"""
+
+    def __init__(self, symbol, price, tick_size, step_size):
+        self.symbol = symbol
+        self.price_grid = TickGrid(tick_size)
+        self.qty_grid = TickGrid(step_size)
+        self.tick_size = tick_size
+        self.step_size = step_size
+        self.price = float(self.price_grid.nearest(price))
+        self.minutes = deque(maxlen=MAX_HISTORY_MINUTES)  # Closed 1m candles: [t, o, h, l, c, v, n]
+        self.current = None  # Open 1m candle
+        self.leverage = DEFAULT_LEVERAGE
+
+    def info(self):
+        """exchangeInfo entry"""
+        price_decimals = self.price_grid.decimals
+        qty_decimals = self.qty_grid.decimals
+        return {
+            'symbol': self.symbol,
+            'pair': self.symbol,
+            'contractType': 'PERPETUAL',
+            'status': 'TRADING',
+            'baseAsset': self.symbol[:-len(QUOTE_ASSET)],
+            'quoteAsset': QUOTE_ASSET,
+            'marginAsset': QUOTE_ASSET,
+            'pricePrecision': price_decimals,
+            'quantityPrecision': qty_decimals,
+            'filters': [
+                {'filterType': 'PRICE_FILTER', 'tickSize': self.tick_size, 'minPrice': self.tick_size, 'maxPrice': '10000000'},
+                {'filterType': 'LOT_SIZE', 'stepSize': self.step_size, 'minQty': self.step_size, 'maxQty': '1000000'},
+                {'filterType': 'MARKET_LOT_SIZE', 'stepSize': self.step_size, 'minQty': self.step_size, 'maxQty': '100000'},
+                {'filterType': 'MAX_NUM_ORDERS', 'limit': 200},
+                {'filterType': 'MIN_NOTIONAL', 'notional': '5'},
+                {'filterType': 'PERCENT_PRICE', 'multiplierUp': '1.0500', 'multiplierDown': '0.9500', 'multiplierDecimal': '4'},
+            ],
+            'orderTypes': ['LIMIT', 'MARKET', 'STOP', 'STOP_MARKET'],
+            'timeInForce': ['GTC', 'IOC', 'FOK', 'GTX'],
+        }
+
+    def record_trade(self, price, qty, now_ms):
+        """Fold a trade into the 1m candles"""
+        minute = align(now_ms, '1m')
+        if self.current is not None and self.current[0] != minute:
+            self.minutes.append(self.current)
+            self.current = None
+        if self.current is None:
+            self.current = [minute, price, price, price, price, 0.0, 0]
+        candle = self.current
+        candle[2] = max(candle[2], price)
+        candle[3] = min(candle[3], price)
+        candle[4] = price
+        candle[5] += qty
+        candle[6] += 1
+        self.price = price
+
+
+class SimExchange:
+    """
+    Matching engine and account for the simulator
+
+    Args:
+        symbols (dict): symbol -> (start price, tickSize, stepSize)
+        extra_symbols (int): Additional synthetic symbols (SIM000USDT, ...) for load tests
+        balance (float): Starting USDT wallet balance
+        seed (int, optional): Random seed for a reproducible price feed
+    """
+
+    def __init__(self, symbols=None, extra_symbols=0, balance=10000.0, seed=None, now_ms=0):
+        self.random = random.Random(seed)
+        self.symbols = {}
+        for symbol, (price, tick, step_size) in (symbols or DEFAULT_SYMBOLS).items():
+            self.symbols[symbol] = SimSymbol(symbol, price, tick, step_size)
+        for i in range(extra_symbols):
+            symbol = f"SIM{i:03d}USDT"
+            self.symbols[symbol] = SimSymbol(symbol, self.random.uniform(1, 1000), '0.001', '0.01')
+        self.wallet = float(balance)
+        self.dual_side = True
+        self.orders = {}  # orderId -> order dict
+        self.open_orders = {}  # symbol -> {orderId: order}
+        self.client_ids = {}  # clientOrderId -> orderId (open and recent orders)
+        self.positions = {}  # (symbol, positionSide) -> {'amount', 'entry_price'}
+        self.income = deque(maxlen=MAX_INCOME_RECORDS)
+        self.listeners = []  # callables receiving user data events
+        self.trade_listeners = []  # callables receiving (symbol, price, qty, now_ms)
+        self._order_ids = itertools.count(10_000_000)
+        self._trade_ids = itertools.count(1)
+        self._tran_ids = itertools.count(1_000_000)
+        self.last_tick_ms = now_ms
+        if now_ms:
+            self.seed_history(now_ms)
+
+    # Market data
+
+    def seed_history(self, now_ms, minutes=HISTORY_MINUTES):
+        """Generate closed 1m candles before `now_ms` with the random walk"""
+        start = align(now_ms, '1m') - minutes * MINUTE_MS
+        for sim_symbol in self.symbols.values():
+            price = sim_symbol.price
+            for i in range(minutes):
+                open_ = price
+                path = [price]
+                for _ in range(4):
+                    price = self._walk(sim_symbol, price, 15)
+                    path.append(price)
+                sim_symbol.minutes.append([start + i * MINUTE_MS, open_, max(path), min(path), price,
+                                           round(self.random.uniform(1, 100), 3), 4])
+            sim_symbol.price = price
+        self.last_tick_ms = now_ms
+
+    def _walk(self, sim_symbol, price, seconds):
+        move = price * VOLATILITY_PER_SQRT_SECOND * math.sqrt(seconds) * self.random.gauss(0, 1)
+        return max(float(sim_symbol.price_grid.nearest(price + move)), sim_symbol.price_grid.increment)
+
+    def tick(self, now_ms):
+        """Advance every symbol's price by one random-walk trade at `now_ms` and match orders"""
+        seconds = max((now_ms - self.last_tick_ms) / 1000, 0.001)
+        self.last_tick_ms = now_ms
+        for sim_symbol in self.symbols.values():
+            price = self._walk(sim_symbol, sim_symbol.price, seconds)
+            self.trade(sim_symbol.symbol, price, round(self.random.uniform(0.001, 5), 3), now_ms)
+
+    def trade(self, symbol, price, qty, now_ms):
+        """Apply one market trade: update candles and match resting orders against it"""
+        sim_symbol = self.symbols[symbol]
+        sim_symbol.record_trade(price, qty, now_ms)
+        for listener in self.trade_listeners:
+            listener(symbol, price, qty, now_ms)
+        self._match(symbol, price, now_ms)
+
+    def klines(self, symbol, interval, start_time=None, end_time=None, limit=500, now_ms=None):
+        """Klines built from the 1m history (Binance row layout)"""
+        sim_symbol = self._symbol(symbol)
+        if interval not in INTERVAL_MS and interval != '1M':
+            raise SimError(-1120, 'Invalid interval.')
+        limit = min(int(limit or 500), 1500)
+        minutes = list(sim_symbol.minutes)
+        if sim_symbol.current is not None:
+            minutes.append(sim_symbol.current)
+        rows = []
+        for t, o, h, l, c, v, n in minutes:
+            if interval in INTERVAL_MS and INTERVAL_MS[interval] < MINUTE_MS:
+                open_time = t  # Sub-minute intervals are served at 1m resolution
+            else:
+                open_time = align(t, interval)
+            if rows and rows[-1][0] == open_time:
+                row = rows[-1]
+                row[2] = max(row[2], h)
+                row[3] = min(row[3], l)
+                row[4] = c
+                row[5] += v
+                row[8] += n
+            else:
+                rows.append([open_time, o, h, l, c, v, step(open_time, interval, 1) - 1, 0.0, n])
+        if start_time is not None:
+            rows = [row for row in rows if row[0] >= int(start_time)]
+        if end_time is not None:
+            rows = [row for row in rows if row[0] <= int(end_time)]
+        rows = rows[:limit] if start_time is not None else rows[-limit:]
+        grid = sim_symbol.price_grid
+        return [[row[0], grid.to_str(grid.nearest(row[1]).units), grid.to_str(grid.nearest(row[2]).units),
+                 grid.to_str(grid.nearest(row[3]).units), grid.to_str(grid.nearest(row[4]).units),
+                 f"{row[5]:.3f}", row[6], f"{row[5] * row[4]:.2f}", row[8], "0", "0", "0"] for row in rows]
+
+    def current_kline(self, symbol, interval, now_ms):
+        """The open candle of an interval (Binance row layout), for kline stream events"""
+        sim_symbol = self._symbol(symbol)
+        if sim_symbol.current is None:
+            return None
+        open_time = align(now_ms, '1m') if INTERVAL_MS.get(interval, MINUTE_MS) < MINUTE_MS else align(now_ms, interval)
+        # Walk back from the open 1m candle over the minutes that belong to this interval
+        parts = [sim_symbol.current]
+        for minute in reversed(sim_symbol.minutes):
+            if minute[0] < open_time:
+                break
+            parts.append(minute)
+        parts.reverse()
+        grid = sim_symbol.price_grid
+        high = max(p[2] for p in parts)
+        low = min(p[3] for p in parts)
+        volume = sum(p[5] for p in parts)
+        close = parts[-1][4]
+        prices = [grid.to_str(grid.nearest(value).units) for value in (parts[0][1], high, low, close)]
+        return [open_time, *prices, f"{volume:.3f}", step(open_time, interval, 1) - 1, f"{volume * close:.2f}",
+                sum(p[6] for p in parts), "0", "0", "0"]
+
+    def ticker_price(self, symbol=None, now_ms=0):
+        symbols = [self._symbol(symbol)] if symbol else self.symbols.values()
+        tickers = [{'symbol': s.symbol, 'price': s.price_grid.to_str(s.price_grid.nearest(s.price).units), 'time': now_ms}
+                   for s in symbols]
+        return tickers[0] if symbol else tickers
+
+    def exchange_info(self, now_ms=0):
+        return {
+            'timezone': 'UTC',
+            'serverTime': now_ms,
+            'rateLimits': [
+                {'rateLimitType': 'REQUEST_WEIGHT', 'interval': 'MINUTE', 'intervalNum': 1, 'limit': 2400},
+                {'rateLimitType': 'ORDERS', 'interval': 'MINUTE', 'intervalNum': 1, 'limit': 1200},
+            ],
+            'assets': [{'asset': QUOTE_ASSET, 'marginAvailable': True}],
+            'symbols': [s.info() for s in self.symbols.values()],
+        }
+
+    # Orders
+
+    def _symbol(self, symbol):
+        if not symbol or symbol.upper() not in self.symbols:
+            raise SimError(-1121, 'Invalid symbol.')
+        return self.symbols[symbol.upper()]
+
+    def _order_by(self, symbol, order_id=None, client_order_id=None):
+        if order_id is not None:
+            order = self.orders.get(int(order_id))
+        elif client_order_id is not None:
+            order = self.orders.get(self.client_ids.get(client_order_id))
+        else:
+            raise SimError(-1102, "Param 'orderId' or 'origClientOrderId' must be sent, but both were empty/null!")
+        if order is None or order['symbol'] != symbol.upper():
+            raise SimError(-2013, 'Order does not exist.')
+        return order
+
+    def create_order(self, params, now_ms):
+        """POST /fapi/v1/order"""
+        sim_symbol = self._symbol(params.get('symbol'))
+        side = params.get('side')
+        order_type = params.get('type')
+        position_side = params.get('positionSide', 'BOTH')
+        if side not in ('BUY', 'SELL'):
+            raise SimError(-1102, "Mandatory parameter 'side' was not sent, was empty/null, or malformed.")
+        if order_type not in ('LIMIT', 'MARKET', 'STOP', 'STOP_MARKET'):
+            raise SimError(-1116, 'Invalid orderType.')
+        if self.dual_side and position_side not in ('LONG', 'SHORT'):
+            raise SimError(-4061, "Order's position side does not match user's setting.")
+        client_order_id = params.get('newClientOrderId') or f"sim{secrets.token_hex(8)}"
+        existing = self.client_ids.get(client_order_id)
+        if existing is not None and self.orders[existing]['status'] not in FINAL_STATUSES:
+            raise SimError(-4116, 'ClientOrderId is duplicated.')
+
+        quantity = float(params.get('quantity', 0))
+        if quantity <= 0 or sim_symbol.qty_grid.floor(quantity).units != sim_symbol.qty_grid.ceil(quantity).units:
+            raise SimError(-1111, 'Precision is over the maximum defined for this asset.')
+        price = float(params.get('price', 0) or 0)
+        stop_price = float(params.get('stopPrice', 0) or 0)
+        if order_type in ('LIMIT', 'STOP') and price <= 0:
+            raise SimError(-1102, "Mandatory parameter 'price' was not sent, was empty/null, or malformed.")
+        if order_type in ('STOP', 'STOP_MARKET') and stop_price <= 0:
+            raise SimError(-1102, "Mandatory parameter 'stopPrice' was not sent, was empty/null, or malformed.")
+        for value in (price, stop_price):
+            if value and sim_symbol.price_grid.floor(value).units != sim_symbol.price_grid.ceil(value).units:
+                raise SimError(-1111, 'Precision is over the maximum defined for this asset.')
+
+        last = sim_symbol.price
+        if order_type in ('STOP', 'STOP_MARKET'):
+            if (side == 'BUY' and last >= stop_price) or (side == 'SELL' and last <= stop_price):
+                raise SimError(-2021, 'Order would immediately trigger.')
+
+        reduces = (side == 'SELL') == (position_side == 'LONG')
+        position = self.positions.get((sim_symbol.symbol, position_side), {'amount': 0.0})
+        if reduces and quantity > abs(position['amount']) + sim_symbol.qty_grid.increment / 2:
+            raise SimError(-2022, 'ReduceOnly Order is rejected.')
+        if not reduces:
+            notional = quantity * (price or last)
+            if notional < 5:
+                raise SimError(-4164, "Order's notional must be no smaller than 5 (unless you choose reduce only).")
+            if notional / sim_symbol.leverage > self.available_balance():
+                raise SimError(-2019, 'Margin is insufficient.')
+
+        order = {
+            'orderId': next(self._order_ids),
+            'symbol': sim_symbol.symbol,
+            'status': 'NEW',
+            'clientOrderId': client_order_id,
+            'price': sim_symbol.price_grid.to_str(sim_symbol.price_grid.nearest(price).units) if price else '0',
+            'avgPrice': '0.00',
+            'origQty': sim_symbol.qty_grid.to_str(sim_symbol.qty_grid.nearest(quantity).units),
+            'executedQty': '0',
+            'cumQty': '0',
+            'cumQuote': '0',
+            'timeInForce': params.get('timeInForce', 'GTC'),
+            'type': order_type,
+            'origType': order_type,
+            'reduceOnly': reduces,
+            'closePosition': False,
+            'side': side,
+            'positionSide': position_side,
+            'stopPrice': sim_symbol.price_grid.to_str(sim_symbol.price_grid.nearest(stop_price).units) if stop_price else '0',
+            'workingType': params.get('workingType', 'CONTRACT_PRICE'),
+            'priceProtect': False,
+            'time': now_ms,
+            'updateTime': now_ms,
+            '_triggered': order_type in ('LIMIT', 'MARKET'),
+        }
+        self.orders[order['orderId']] = order
+        self.client_ids[client_order_id] = order['orderId']
+        self.open_orders.setdefault(sim_symbol.symbol, {})[order['orderId']] = order
+        self._emit_order(order, 'NEW', now_ms)
+        if order_type == 'MARKET':
+            self._fill(order, last, now_ms, maker=False)
+        elif order_type == 'LIMIT':
+            self._match_order(order, last, now_ms, on_entry=True)
+        return self.public_order(order)
+
+    def get_order(self, symbol, order_id=None, client_order_id=None):
+        return self.public_order(self._order_by(symbol, order_id, client_order_id))
+
+    def cancel_order(self, symbol, order_id=None, client_order_id=None, now_ms=0):
+        order = self._order_by(symbol, order_id, client_order_id)
+        if order['status'] in FINAL_STATUSES:
+            raise SimError(-2011, 'Unknown order sent.')
+        order['status'] = 'CANCELED'
+        order['updateTime'] = now_ms
+        self.open_orders.get(order['symbol'], {}).pop(order['orderId'], None)
+        self._emit_order(order, 'CANCELED', now_ms)
+        return self.public_order(order)
+
+    def all_orders(self, symbol, limit=500):
+        symbol = self._symbol(symbol).symbol
+        orders = [self.public_order(o) for o in self.orders.values() if o['symbol'] == symbol]
+        return orders[-int(limit or 500):]
+
+    @staticmethod
+    def public_order(order):
+        return {key: value for key, value in order.items() if not key.startswith('_')}
+
+    def _match(self, symbol, price, now_ms):
+        for order in list(self.open_orders.get(symbol, {}).values()):
+            self._match_order(order, price, now_ms)
+
+    def _match_order(self, order, price, now_ms, on_entry=False):
+        side = order['side']
+        taker = on_entry  # A limit that is marketable as soon as it becomes active takes liquidity
+        if not order['_triggered']:
+            stop_price = float(order['stopPrice'])
+            if not ((side == 'BUY' and price >= stop_price) or (side == 'SELL' and price <= stop_price)):
+                return
+            order['_triggered'] = True
+            order['updateTime'] = now_ms
+            if order['type'] == 'STOP_MARKET':
+                self._fill(order, price, now_ms, maker=False)
+                return
+            taker = True
+        limit_price = float(order['price'])
+        if (side == 'BUY' and price <= limit_price) or (side == 'SELL' and price >= limit_price):
+            # Takers fill at the trade price, resting limits at their own price
+            self._fill(order, price if taker else limit_price, now_ms, maker=not taker)
+
+    def _fill(self, order, price, now_ms, maker):
+        sim_symbol = self.symbols[order['symbol']]
+        price = float(sim_symbol.price_grid.nearest(price))
+        qty = float(order['origQty'])
+        key = (order['symbol'], order['positionSide'])
+        position = self.positions.setdefault(key, {'amount': 0.0, 'entry_price': 0.0})
+        fee = qty * price * (MAKER_FEE_RATE if maker else TAKER_FEE_RATE)
+        realized = 0.0
+        sign = 1 if order['positionSide'] != 'SHORT' else -1
+        if order['reduceOnly']:
+            qty = min(qty, abs(position['amount']))
+            realized = sign * qty * (price - position['entry_price'])
+            position['amount'] -= sign * qty
+            if abs(position['amount']) < sim_symbol.qty_grid.increment / 2:
+                position['amount'] = 0.0
+                position['entry_price'] = 0.0
+        else:
+            total = abs(position['amount']) + qty
+            position['entry_price'] = (abs(position['amount']) * position['entry_price'] + qty * price) / total
+            position['amount'] += sign * qty
+        self.wallet += realized - fee
+        trade_id = next(self._trade_ids)
+        if realized:
+            self._add_income(order['symbol'], 'REALIZED_PNL', realized, now_ms, trade_id)
+        self._add_income(order['symbol'], 'COMMISSION', -fee, now_ms, trade_id)
+
+        order.update({
+            'status': 'FILLED',
+            'executedQty': sim_symbol.qty_grid.to_str(sim_symbol.qty_grid.nearest(qty).units),
+            'cumQty': sim_symbol.qty_grid.to_str(sim_symbol.qty_grid.nearest(qty).units),
+            'cumQuote': f"{qty * price:.8f}",
+            'avgPrice': sim_symbol.price_grid.to_str(sim_symbol.price_grid.nearest(price).units),
+            'updateTime': now_ms,
+        })
+        self.open_orders.get(order['symbol'], {}).pop(order['orderId'], None)
+        self._emit_order(order, 'TRADE', now_ms, last_price=price, last_qty=qty, fee=fee, realized=realized,
+                         trade_id=trade_id, maker=maker)
+        self._emit_account(order['symbol'], now_ms)
+
+    # Account
+
+    def _add_income(self, symbol, income_type, amount, now_ms, trade_id=''):
+        self.income.append({
+            'symbol': symbol,
+            'incomeType': income_type,
+            'income': f"{amount:.8f}",
+            'asset': QUOTE_ASSET,
+            'info': income_type,
+            'time': now_ms,
+            'tranId': next(self._tran_ids),
+            'tradeId': str(trade_id),
+        })
+
+    def income_history(self, symbol=None, income_type=None, start_time=None, end_time=None, limit=100):
+        limit = min(int(limit or 100), 1000)
+        records = [
+            r for r in self.income
+            if (symbol is None or r['symbol'] == symbol)
+            and (income_type is None or r['incomeType'] == income_type)
+            and (start_time is None or r['time'] >= int(start_time))
+            and (end_time is None or r['time'] <= int(end_time))
+        ]
+        return records[:limit]
+
+    def unrealized_pnl(self, symbol=None):
+        total = 0.0
+        for (pos_symbol, side), position in self.positions.items():
+            if symbol is not None and pos_symbol != symbol:
+                continue
+            total += position['amount'] * (self.symbols[pos_symbol].price - position['entry_price'])
+        return total
+
+    def initial_margin(self):
+        return sum(abs(p['amount']) * self.symbols[s].price / self.symbols[s].leverage
+                   for (s, _), p in self.positions.items())
+
+    def available_balance(self):
+        return self.wallet + self.unrealized_pnl() - self.initial_margin()
+
+    def position_risk(self, symbol=None):
+        rows = []
+        symbols = [self._symbol(symbol)] if symbol else self.symbols.values()
+        for sim_symbol in symbols:
+            for side in (('LONG', 'SHORT') if self.dual_side else ('BOTH',)):
+                position = self.positions.get((sim_symbol.symbol, side), {'amount': 0.0, 'entry_price': 0.0})
+                mark = sim_symbol.price
+                rows.append({
+                    'symbol': sim_symbol.symbol,
+                    'positionSide': side,
+                    'positionAmt': sim_symbol.qty_grid.to_str(sim_symbol.qty_grid.nearest(position['amount']).units),
+                    'entryPrice': f"{position['entry_price']:.8f}",
+                    'breakEvenPrice': f"{position['entry_price']:.8f}",
+                    'markPrice': f"{mark:.8f}",
+                    'unRealizedProfit': f"{position['amount'] * (mark - position['entry_price']):.8f}",
+                    'liquidationPrice': '0',
+                    'leverage': str(sim_symbol.leverage),
+                    'marginType': 'cross',
+                    'isolatedMargin': '0.00000000',
+                    'notional': f"{position['amount'] * mark:.8f}",
+                    'updateTime': self.last_tick_ms,
+                })
+        return rows
+
+    def account(self):
+        unrealized = self.unrealized_pnl()
+        available = self.available_balance()
+        asset = {
+            'asset': QUOTE_ASSET,
+            'walletBalance': f"{self.wallet:.8f}",
+            'unrealizedProfit': f"{unrealized:.8f}",
+            'marginBalance': f"{self.wallet + unrealized:.8f}",
+            'initialMargin': f"{self.initial_margin():.8f}",
+            'availableBalance': f"{available:.8f}",
+            'maxWithdrawAmount': f"{max(available, 0):.8f}",
+            'crossWalletBalance': f"{self.wallet:.8f}",
+            'updateTime': self.last_tick_ms,
+        }
+        return {
+            'totalWalletBalance': asset['walletBalance'],
+            'totalUnrealizedProfit': asset['unrealizedProfit'],
+            'totalMarginBalance': asset['marginBalance'],
+            'totalInitialMargin': asset['initialMargin'],
+            'availableBalance': asset['availableBalance'],
+            'maxWithdrawAmount': asset['maxWithdrawAmount'],
+            'assets': [asset],
+            'positions': [p for p in self.position_risk() if float(p['positionAmt']) != 0],
+        }
+
+    def balance(self):
+        account = self.account()['assets'][0]
+        return [{'accountAlias': 'sim', 'asset': QUOTE_ASSET, 'balance': account['walletBalance'],
+                 'crossWalletBalance': account['crossWalletBalance'], 'crossUnPnl': account['unrealizedProfit'],
+                 'availableBalance': account['availableBalance'], 'maxWithdrawAmount': account['maxWithdrawAmount'],
+                 'updateTime': self.last_tick_ms}]
+
+    def change_leverage(self, symbol, leverage):
+        sim_symbol = self._symbol(symbol)
+        leverage = int(leverage)
+        if not 1 <= leverage <= 125:
+            raise SimError(-4028, f'Leverage {leverage} is not valid')
+        sim_symbol.leverage = leverage
+        return {'symbol': sim_symbol.symbol, 'leverage': leverage, 'maxNotionalValue': '50000000'}
+
+    def leverage_bracket(self, symbol=None):
+        symbols = [self._symbol(symbol)] if symbol else self.symbols.values()
+        return [{'symbol': s.symbol, 'brackets': [{'bracket': 1, 'initialLeverage': 125, 'notionalCap': 50000,
+                                                   'notionalFloor': 0, 'maintMarginRatio': 0.004, 'cum': 0}]}
+                for s in symbols]
+
+    def set_position_mode(self, dual_side):
+        dual_side = str(dual_side).lower() == 'true'
+        if any(p['amount'] for p in self.positions.values()) and dual_side != self.dual_side:
+            raise SimError(-4068, 'Position side cannot be changed if there exists position.')
+        if dual_side == self.dual_side:
+            raise SimError(-4059, 'No need to change position side.')
+        self.dual_side = dual_side
+        return {'code': 200, 'msg': 'success'}
+
+    # User data events
+
+    def _emit(self, event):
+        for listener in list(self.listeners):
+            listener(event)
+
+    def _emit_order(self, order, execution_type, now_ms, last_price=0.0, last_qty=0.0, fee=0.0, realized=0.0,
+                    trade_id=0, maker=False):
+        if not self.listeners:
+            return
+        self._emit({
+            'e': 'ORDER_TRADE_UPDATE',
+            'E': now_ms,
+            'T': now_ms,
+            'o': {
+                's': order['symbol'], 'c': order['clientOrderId'], 'S': order['side'], 'o': order['type'],
+                'f': order['timeInForce'], 'q': order['origQty'], 'p': order['price'], 'ap': order['avgPrice'],
+                'sp': order['stopPrice'], 'x': execution_type, 'X': order['status'], 'i': order['orderId'],
+                'l': f"{last_qty}", 'z': order['executedQty'], 'L': f"{last_price}", 'N': QUOTE_ASSET,
+                'n': f"{fee:.8f}", 'T': now_ms, 't': trade_id, 'm': maker, 'R': order['reduceOnly'],
+                'ps': order['positionSide'], 'rp': f"{realized:.8f}", 'ot': order['origType'],
+            },
+        })
+
+    def _emit_account(self, symbol, now_ms):
+        if not self.listeners:
+            return
+        account = self.account()['assets'][0]
+        self._emit({
+            'e': 'ACCOUNT_UPDATE',
+            'E': now_ms,
+            'T': now_ms,
+            'a': {
+                'm': 'ORDER',
+                'B': [{'a': QUOTE_ASSET, 'wb': account['walletBalance'], 'cw': account['crossWalletBalance'], 'bc': '0'}],
+                'P': [{'s': p['symbol'], 'pa': p['positionAmt'], 'ep': p['entryPrice'], 'up': p['unRealizedProfit'],
+                       'mt': 'cross', 'iw': '0', 'ps': p['positionSide']} for p in self.position_risk(symbol)],
+            },
+        })
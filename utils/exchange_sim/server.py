@@ -0,0 +1,323 @@
+"""
+HTTP + websocket front end of the exchange simulator.
+
+Serves the Binance USD-M Futures REST paths the bot uses under /fapi/v{1,2,3}/...,
+kline streams and user data streams under /ws/<stream or listenKey> (with live
+SUBSCRIBE/UNSUBSCRIBE), and /sim/* endpoints to inspect and steer the simulation.
+Latency, errors, hung requests and websocket drops can be injected per request.
+"""
+import asyncio
+import json
+import os
+import random
+import secrets
+import sys
+import time
+from contextlib import asynccontextmanager
+from urllib.parse import parse_qsl
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse
+from utils.exchange_sim.engine import SimExchange, SimError
+from utils.interval_calendar import align, INTERVAL_MS, MINUTE_MS
+from utils.logger import log_api, log_error
+
+TICK_INTERVAL_SECONDS = 0.1  # One simulated trade per symbol per tick
+KLINE_PUSH_SECONDS = 0.25  # Kline stream update rate (Binance pushes every 250 ms)
+WEIGHT_WINDOW_MS = 60000
+
+# Request weights of the endpoints (same order of magnitude as Binance)
+ENDPOINT_WEIGHTS = {'exchangeInfo': 1, 'klines': 5, 'allOrders': 5, 'income': 30, 'account': 5,
+                    'balance': 5, 'positionRisk': 5, 'leverageBracket': 1}
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+class SimConfig:
+    """Fault and latency injection settings (changeable at runtime through /sim/config)"""
+
+    FIELDS = ('latency_ms', 'jitter_ms', 'error_rate', 'timeout_rate', 'timeout_seconds',
+              'ws_drop_rate', 'reject_rate', 'reject_code')
+
+    def __init__(self):
+        self.latency_ms = float(os.getenv('SIM_LATENCY_MS', '0'))  # Added to every REST response
+        self.jitter_ms = float(os.getenv('SIM_JITTER_MS', '0'))  # Uniform random extra latency
+        self.error_rate = float(os.getenv('SIM_ERROR_RATE', '0'))  # Share of requests answered with 503 / -1001
+        self.timeout_rate = float(os.getenv('SIM_TIMEOUT_RATE', '0'))  # Share of requests that hang
+        self.timeout_seconds = float(os.getenv('SIM_TIMEOUT_SECONDS', '30'))
+        self.ws_drop_rate = float(os.getenv('SIM_WS_DROP_RATE', '0'))  # Chance per push that a stream is dropped
+        self.reject_rate = float(os.getenv('SIM_REJECT_RATE', '0'))  # Share of new orders rejected with reject_code
+        self.reject_code = int(os.getenv('SIM_REJECT_CODE', '-2019'))
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    def update(self, values):
+        for name in self.FIELDS:
+            if name in values:
+                setattr(self, name, type(getattr(self, name))(values[name]))
+        return self.as_dict()
+
+
+def api_error(code, msg, status=400):
+    return JSONResponse({'code': code, 'msg': msg}, status_code=status)
+
+
+class StreamConnection:
+    """One websocket client: its subscribed kline streams or a user data queue"""
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.streams = set()
+        self.queue = asyncio.Queue()
+
+
+def create_app(exchange=None, config=None):
+    """Build the simulator app around an engine (a fresh one seeded with history by default)"""
+    exchange = exchange or SimExchange(extra_symbols=int(os.getenv('SIM_EXTRA_SYMBOLS', '0')),
+                                       balance=float(os.getenv('SIM_BALANCE', '10000')), now_ms=now_ms())
+    config = config or SimConfig()
+
+    @asynccontextmanager
+    async def lifespan(_app):
+        feed_task = asyncio.create_task(run_feed())
+        log_api(f"[SIM] Exchange simulator started with {len(exchange.symbols)} symbols")
+        yield
+        feed_task.cancel()
+
+    app = FastAPI(title="Binance Futures simulator", lifespan=lifespan)
+    app.state.exchange = exchange
+    app.state.config = config
+    connections = set()
+    listen_keys = {}  # listenKey -> set of StreamConnection
+    used_weight = {'window': 0, 'weight': 0}
+    last_open_times = {}  # (symbol, interval) -> open time of the last pushed candle
+
+    def user_event(event):
+        for key_connections in listen_keys.values():
+            for connection in key_connections:
+                connection.queue.put_nowait(event)
+    exchange.listeners.append(user_event)
+
+    def kline_event(symbol, interval, row, closed):
+        return {
+            'e': 'kline', 'E': now_ms(), 's': symbol,
+            'k': {'t': row[0], 'T': row[6], 's': symbol, 'i': interval, 'f': 0, 'L': 0,
+                  'o': row[1], 'c': row[4], 'h': row[2], 'l': row[3], 'v': row[5], 'n': row[8],
+                  'x': closed, 'q': row[7], 'V': '0', 'Q': '0', 'B': '0'},
+        }
+
+    async def run_feed():
+        next_push = time.monotonic()
+        while True:
+            await asyncio.sleep(TICK_INTERVAL_SECONDS)
+            try:
+                current = now_ms()
+                exchange.tick(current)
+                if time.monotonic() < next_push:
+                    continue
+                next_push = time.monotonic() + KLINE_PUSH_SECONDS
+                await push_klines(current)
+            except Exception as e:
+                log_error(f"[SIM] Feed error: {e}", exc_info=True)
+
+    async def push_klines(current):
+        subscribed = {}
+        for connection in connections:
+            for stream in connection.streams:
+                subscribed.setdefault(stream, []).append(connection)
+        for stream, stream_connections in subscribed.items():
+            symbol_part, _, interval = stream.partition('@kline_')
+            symbol = symbol_part.upper()
+            if symbol not in exchange.symbols or (interval not in INTERVAL_MS and interval != '1M'):
+                continue
+            open_time = align(current, '1m') if INTERVAL_MS.get(interval, MINUTE_MS) < MINUTE_MS else align(current, interval)
+            events = []
+            previous = last_open_times.get((symbol, interval))
+            if previous is not None and previous != open_time:
+                # The previous candle just closed: send its final state first
+                rows = exchange.klines(symbol, interval, start_time=previous, end_time=previous, limit=1)
+                if rows:
+                    events.append(kline_event(symbol, interval, rows[0], True))
+            last_open_times[(symbol, interval)] = open_time
+            row = exchange.current_kline(symbol, interval, current)
+            if row is not None:
+                events.append(kline_event(symbol, interval, row, False))
+            for connection in stream_connections:
+                for event in events:
+                    connection.queue.put_nowait(event)
+
+    @app.middleware("http")
+    async def inject_faults(request: Request, call_next):
+        if not request.url.path.startswith('/fapi'):
+            return await call_next(request)
+        delay = config.latency_ms + random.uniform(0, config.jitter_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+        if config.timeout_rate and random.random() < config.timeout_rate:
+            await asyncio.sleep(config.timeout_seconds)
+        if config.error_rate and random.random() < config.error_rate:
+            return api_error(-1001, 'Internal error; unable to process your request. Please try again.', 503)
+        response = await call_next(request)
+        current = now_ms()
+        window = current // WEIGHT_WINDOW_MS
+        if used_weight['window'] != window:
+            used_weight.update(window=window, weight=0)
+        used_weight['weight'] += ENDPOINT_WEIGHTS.get(request.url.path.rsplit('/', 1)[-1], 1)
+        response.headers['X-MBX-USED-WEIGHT-1M'] = str(used_weight['weight'])
+        return response
+
+    def dispatch(method, path, params):
+        current = now_ms()
+        symbol = params.get('symbol')
+        if method == 'GET' and path in ('ping',):
+            return {}
+        if method == 'GET' and path == 'time':
+            return {'serverTime': current}
+        if method == 'GET' and path == 'exchangeInfo':
+            return exchange.exchange_info(current)
+        if method == 'GET' and path == 'klines':
+            return exchange.klines(symbol, params.get('interval'), params.get('startTime'), params.get('endTime'),
+                                   params.get('limit', 500))
+        if method == 'GET' and path == 'ticker/price':
+            return exchange.ticker_price(symbol, current)
+        if path == 'order':
+            if method == 'POST':
+                if config.reject_rate and random.random() < config.reject_rate:
+                    raise SimError(config.reject_code, 'Order rejected by simulator fault injection.')
+                return exchange.create_order(params, current)
+            if method == 'GET':
+                return exchange.get_order(symbol, params.get('orderId'), params.get('origClientOrderId'))
+            if method == 'DELETE':
+                return exchange.cancel_order(symbol, params.get('orderId'), params.get('origClientOrderId'), current)
+        if method == 'GET' and path == 'allOrders':
+            return exchange.all_orders(symbol, params.get('limit', 500))
+        if method == 'GET' and path == 'openOrders':
+            return [exchange.public_order(o) for o in exchange.open_orders.get(symbol, {}).values()]
+        if method == 'GET' and path == 'positionRisk':
+            return exchange.position_risk(symbol)
+        if method == 'GET' and path == 'account':
+            return exchange.account()
+        if method == 'GET' and path == 'balance':
+            return exchange.balance()
+        if method == 'GET' and path == 'income':
+            return exchange.income_history(symbol, params.get('incomeType'), params.get('startTime'),
+                                           params.get('endTime'), params.get('limit', 100))
+        if method == 'POST' and path == 'leverage':
+            return exchange.change_leverage(symbol, params.get('leverage'))
+        if method == 'GET' and path == 'leverageBracket':
+            return exchange.leverage_bracket(symbol)
+        if path == 'positionSide/dual':
+            if method == 'POST':
+                return exchange.set_position_mode(params.get('dualSidePosition'))
+            return {'dualSidePosition': exchange.dual_side}
+        if path == 'listenKey':
+            if method == 'POST':
+                key = secrets.token_hex(32)
+                listen_keys[key] = set()
+                return {'listenKey': key}
+            return {}
+        raise SimError(-5000, f'Path {path} not supported by the simulator.', 404)
+
+    @app.api_route("/fapi/{version}/{path:path}", methods=["GET", "POST", "PUT", "DELETE"])
+    async def futures_api(version: str, path: str, request: Request):
+        params = dict(request.query_params)
+        body = await request.body()
+        if body:
+            params.update(parse_qsl(body.decode('utf-8')))
+        params.pop('signature', None)
+        try:
+            return JSONResponse(dispatch(request.method, path, params))
+        except SimError as e:
+            return api_error(e.code, e.msg, e.http_status)
+        except (TypeError, ValueError) as e:
+            return api_error(-1102, f"Mandatory parameter was not sent, was empty/null, or malformed: {e}")
+
+    @app.get("/sim/config")
+    async def get_config():
+        return config.as_dict()
+
+    @app.post("/sim/config")
+    async def update_config(request: Request):
+        return config.update(await request.json())
+
+    @app.post("/sim/price")
+    async def set_price(request: Request):
+        """Force a trade at a price, e.g. {"symbol": "ETHUSDT", "price": 2500.5}, to drive stops deterministically"""
+        values = await request.json()
+        try:
+            exchange.trade(values['symbol'].upper(), float(values['price']), float(values.get('qty', 1)), now_ms())
+        except (KeyError, SimError) as e:
+            return api_error(-1121, f"Invalid trade: {e}")
+        return exchange.ticker_price(values['symbol'].upper(), now_ms())
+
+    @app.get("/sim/state")
+    async def get_state():
+        return {'symbols': len(exchange.symbols), 'open_orders': sum(len(o) for o in exchange.open_orders.values()),
+                'orders': len(exchange.orders), 'connections': len(connections), 'account': exchange.account()}
+
+    async def serve_connection(connection):
+        websocket = connection.websocket
+
+        async def sender():
+            while True:
+                event = await connection.queue.get()
+                if connection.streams and config.ws_drop_rate and random.random() < config.ws_drop_rate:
+                    await websocket.close(code=1011)
+                    return
+                await websocket.send_text(json.dumps(event))
+
+        send_task = asyncio.create_task(sender())
+        try:
+            while True:
+                message = await websocket.receive_text()
+                try:
+                    request = json.loads(message)
+                except json.JSONDecodeError:
+                    continue
+                method = request.get('method')
+                streams = [s.lower() for s in request.get('params', [])]
+                if method == 'SUBSCRIBE':
+                    connection.streams.update(streams)
+                    result = None
+                elif method == 'UNSUBSCRIBE':
+                    connection.streams.difference_update(streams)
+                    result = None
+                elif method == 'LIST_SUBSCRIPTIONS':
+                    result = sorted(connection.streams)
+                else:
+                    continue
+                await websocket.send_text(json.dumps({'result': result, 'id': request.get('id')}))
+        except WebSocketDisconnect:
+            pass
+        finally:
+            send_task.cancel()
+
+    @app.websocket("/ws")
+    @app.websocket("/ws/{name}")
+    async def stream_socket(websocket: WebSocket, name: str = None):
+        await websocket.accept()
+        connection = StreamConnection(websocket)
+        user_connections = listen_keys.get(name) if name else None
+        if user_connections is not None:
+            user_connections.add(connection)
+        elif name:
+            connection.streams.add(name.lower())
+        connections.add(connection)
+        try:
+            await serve_connection(connection)
+        finally:
+            connections.discard(connection)
+            if user_connections is not None:
+                user_connections.discard(connection)
+
+    return app
+
+
+# Run the simulator: python -m utils.exchange_sim.server [port] (then start the bot with MODE=sim)
+if __name__ == "__main__":
+    import uvicorn
+    sim_port = int(sys.argv[1]) if len(sys.argv) > 1 else int(os.getenv('SIM_PORT', '8090'))
+    uvicorn.run(create_app(), host=os.getenv('SIM_HOST', '127.0.0.1'), port=sim_port, log_level='warning')
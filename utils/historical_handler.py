@@ -1,10 +1,13 @@
-from datetime import datetime, timedelta, timezone
+from datetime import datetime
 import time
 import os
 from binance.client import Client
 from binance.exceptions import BinanceAPIException
 from utils.config import MODE, BINANCE_API_KEY, BINANCE_API_SECRET
 from utils.logger import log_websocket, log_error
+from utils.binance_client import create_client
+from utils.interval_calendar import align, step, close_time
+from utils.kline_store import KlineStore
 
 def setup_binance_client():
     """
@@ -18,7 +21,7 @@ def setup_binance_client():
         log_websocket("Warning: API key and secret not found. Set BINANCE_API_KEY and BINANCE_API_SECRET environment variables.")
         log_websocket("You can create API keys at https://www.binance.com/en/my/settings/api-management")
     
-    return Client(api_key, api_secret, testnet=MODE)
+    return create_client(api_key, api_secret, testnet=MODE)
 
 def convert_to_heikin_ashi(candles):
     """
@@ -103,199 +106,96 @@ def format_to_two_decimals(number):
     
     return f"{integer_part}.{decimal_part}"
 
-def get_heikin_ashi_by_datetime(symbol, interval, target_datetime_str):
+HA_WARMUP_CANDLES = 10  # Candles fetched before the target so its HA open is seeded from history
+
+def get_klines(symbol, interval, start_time_ms, end_time_ms):
     """
-    Fetch Heikin Ashi candle for the exact datetime specified.
+    Kline rows with open times in [start_time_ms, end_time_ms], read from the local kline store first.
+
+    Closed candles come from the store (which downloads only what it is missing);
+    the still-open candle, if requested, is fetched from the API.
+    
+    Returns:
+        List of Binance kline rows, or None on error
+    """
+    end_open_ms = step(align(end_time_ms, interval), interval, 1)
+    try:
+        store = KlineStore(symbol, interval).sync(start_time_ms, end_open_ms)
+        klines = store.rows(align(start_time_ms, interval), end_open_ms)
+        last_open = klines[-1][0] if klines else None
+        if last_open is None or last_open < align(end_time_ms, interval):
+            # Not closed yet (or missing from the store): ask the API for the rest
+            client = setup_binance_client()
+            tail_start = step(last_open, interval, 1) if last_open is not None else start_time_ms
+            klines += client.futures_klines(symbol=symbol, interval=interval, startTime=tail_start, endTime=end_time_ms)
+        return klines
+    except BinanceAPIException as e:
+        log_error(f"Error fetching klines: {e}")
+    except OSError as e:
+        log_error(f"Kline store unavailable for {symbol} {interval}: {e}")
+        try:
+            client = setup_binance_client()
+            return client.futures_klines(symbol=symbol, interval=interval, startTime=start_time_ms, endTime=end_time_ms)
+        except BinanceAPIException as e:
+            log_error(f"Error fetching klines: {e}")
+    return None
+
+def get_heikin_ashi_by_timestamp(symbol, interval, target_time_ms):
+    """
+    Fetch the Heikin Ashi candle containing an epoch-ms timestamp.
     
     Args:
         symbol (str): Trading pair symbol, e.g. 'BTCUSDT'
-        interval (str): Kline interval, e.g. '1s', '1m', '3m', '5m', '15m', '30m', '1h', '2h', '6h', '8h', '12h', '1d', '3d', '1w', '1M'
-        target_datetime_str (str): Target datetime in 'dd-mm-YYYY HH:MM' (24h) format, local time
+        interval (str): Kline interval, e.g. '1s', '1m', '3m', '5m', '15m', '30m', '1h', '2h', '4h', '6h', '8h', '12h', '1d', '3d', '1w', '1M'
+        target_time_ms (int): Any UTC epoch-ms timestamp inside the wanted candle
     
     Returns:
         The Heikin Ashi candle data, or None if not found
     """
-    # Parse the target datetime string as local time and convert to UTC (timezone-aware)
-    target_dt_local = datetime.strptime(target_datetime_str, '%d-%m-%Y %H:%M')
+    # Align to the exact interval boundary (Binance open time)
+    target_open_ms = align(target_time_ms, interval)
     
-    # Align to exact interval boundary by truncating any seconds/microseconds
-    if interval == '1m':
-        target_dt_local = target_dt_local.replace(second=0, microsecond=0)
-    elif interval == '3m':
-        minutes = (target_dt_local.minute // 3) * 3
-        target_dt_local = target_dt_local.replace(minute=minutes, second=0, microsecond=0)
-    elif interval == '5m':
-        minutes = (target_dt_local.minute // 5) * 5
-        target_dt_local = target_dt_local.replace(minute=minutes, second=0, microsecond=0)
-    elif interval == '15m':
-        minutes = (target_dt_local.minute // 15) * 15
-        target_dt_local = target_dt_local.replace(minute=minutes, second=0, microsecond=0)
-    elif interval == '30m':
-        minutes = (target_dt_local.minute // 30) * 30
-        target_dt_local = target_dt_local.replace(minute=minutes, second=0, microsecond=0)
-    elif interval == '1h':
-        target_dt_local = target_dt_local.replace(minute=0, second=0, microsecond=0)
-    # Add more intervals as needed
-    
-    try:
-        from tzlocal import get_localzone
-        local_tz = get_localzone()
-        target_dt_local = target_dt_local.replace(tzinfo=local_tz)
-        target_dt_utc = target_dt_local.astimezone(timezone.utc)
-    except Exception:
-        offset = datetime.now() - datetime.utcnow()
-        target_dt_utc = (target_dt_local - offset).replace(tzinfo=timezone.utc)
-    
-    # Calculate the time range based on interval for proper Heikin Ashi calculation
-    if interval == '1s':
-        start_time_ms = int(target_dt_utc.timestamp() * 1000) - (10 * 1000)  # 10 seconds before
-        end_time_ms = int(target_dt_utc.timestamp() * 1000) + (1000)  # 1 second after
-    elif interval == '1m':
-        start_time_ms = int(target_dt_utc.timestamp() * 1000) - (10 * 60 * 1000)  # 10 minutes before
-        end_time_ms = int(target_dt_utc.timestamp() * 1000) + (60 * 1000)  # 1 minute after
-    elif interval == '3m':
-        start_time_ms = int(target_dt_utc.timestamp() * 1000) - (30 * 60 * 1000)  # 30 minutes before (10 * 3m)
-        end_time_ms = int(target_dt_utc.timestamp() * 1000) + (3 * 60 * 1000)  # 3 minutes after
-    elif interval == '5m':
-        start_time_ms = int(target_dt_utc.timestamp() * 1000) - (50 * 60 * 1000)  # 50 minutes before (10 * 5m)
-        end_time_ms = int(target_dt_utc.timestamp() * 1000) + (5 * 60 * 1000)  # 5 minutes after
-    elif interval == '15m':
-        start_time_ms = int(target_dt_utc.timestamp() * 1000) - (150 * 60 * 1000)  # 150 minutes before (10 * 15m)
-        end_time_ms = int(target_dt_utc.timestamp() * 1000) + (15 * 60 * 1000)  # 15 minutes after
-    elif interval == '30m':
-        start_time_ms = int(target_dt_utc.timestamp() * 1000) - (300 * 60 * 1000)  # 300 minutes before (10 * 30m)
-        end_time_ms = int(target_dt_utc.timestamp() * 1000) + (30 * 60 * 1000)  # 30 minutes after
-    elif interval == '1h':
-        start_time_ms = int(target_dt_utc.timestamp() * 1000) - (10 * 60 * 60 * 1000)  # 10 hours before
-        end_time_ms = int(target_dt_utc.timestamp() * 1000) + (60 * 60 * 1000)  # 1 hour after
-    elif interval == '2h':
-        start_time_ms = int(target_dt_utc.timestamp() * 1000) - (20 * 60 * 60 * 1000)  # 20 hours before (10 * 2h)
-        end_time_ms = int(target_dt_utc.timestamp() * 1000) + (2 * 60 * 60 * 1000)  # 2 hours after
-    elif interval == '6h':
-        start_time_ms = int(target_dt_utc.timestamp() * 1000) - (60 * 60 * 60 * 1000)  # 60 hours before (10 * 6h)
-        end_time_ms = int(target_dt_utc.timestamp() * 1000) + (6 * 60 * 60 * 1000)  # 6 hours after
-    elif interval == '8h':
-        start_time_ms = int(target_dt_utc.timestamp() * 1000) - (80 * 60 * 60 * 1000)  # 80 hours before (10 * 8h)
-        end_time_ms = int(target_dt_utc.timestamp() * 1000) + (8 * 60 * 60 * 1000)  # 8 hours after
-    elif interval == '12h':
-        start_time_ms = int(target_dt_utc.timestamp() * 1000) - (120 * 60 * 60 * 1000)  # 120 hours before (10 * 12h)
-        end_time_ms = int(target_dt_utc.timestamp() * 1000) + (12 * 60 * 60 * 1000)  # 12 hours after
-    elif interval == '1d':
-        start_time_ms = int(target_dt_utc.timestamp() * 1000) - (10 * 24 * 60 * 60 * 1000)  # 10 days before
-        end_time_ms = int(target_dt_utc.timestamp() * 1000) + (24 * 60 * 60 * 1000)  # 1 day after
-    elif interval == '3d':
-        start_time_ms = int(target_dt_utc.timestamp() * 1000) - (30 * 24 * 60 * 60 * 1000)  # 30 days before (10 * 3d)
-        end_time_ms = int(target_dt_utc.timestamp() * 1000) + (3 * 24 * 60 * 60 * 1000)  # 3 days after
-    elif interval == '1w':
-        start_time_ms = int(target_dt_utc.timestamp() * 1000) - (10 * 7 * 24 * 60 * 60 * 1000)  # 10 weeks before
-        end_time_ms = int(target_dt_utc.timestamp() * 1000) + (7 * 24 * 60 * 60 * 1000)  # 1 week after
-    elif interval == '1M':
-        start_time_ms = int(target_dt_utc.timestamp() * 1000) - (10 * 30 * 24 * 60 * 60 * 1000)  # ~10 months before
-        end_time_ms = int(target_dt_utc.timestamp() * 1000) + (30 * 24 * 60 * 60 * 1000)  # ~1 month after
-    else:
-        # Default fallback
-        start_time_ms = int(target_dt_utc.timestamp() * 1000) - (10 * 60 * 1000)
-        end_time_ms = int(target_dt_utc.timestamp() * 1000) + (60 * 1000)
+    # Fetch a few candles before the target for a proper Heikin Ashi calculation
+    start_time_ms = step(target_open_ms, interval, -HA_WARMUP_CANDLES)
+    end_time_ms = close_time(target_open_ms, interval)
 
-    client = setup_binance_client()
-    try:
-        klines = client.futures_klines(
-            symbol=symbol,
-            interval=interval,
-            start_time=start_time_ms,
-            end_time=end_time_ms
-        )
-    except BinanceAPIException as e:
-        log_error(f"Error fetching klines: {e}")
+    klines = get_klines(symbol, interval, start_time_ms, end_time_ms)
+    if klines is None:
         return None
 
     if not klines:
         log_websocket("No data received.")
         return None
     
-    # Find the exact candle for the target datetime with interval-specific matching
-    target_candle_index = -1
-    for i, kline in enumerate(klines):
-        kline_open_time_utc = datetime.fromtimestamp(kline[0] / 1000, tz=timezone.utc)
-        
-        # For all intervals, we want exact matching on interval boundaries
-        # Example: for 1m, we want an exact match on minutes with seconds=0
-        if interval == '1s':
-            if kline_open_time_utc.replace(microsecond=0) == target_dt_utc.replace(microsecond=0):
-                target_candle_index = i
-                break
-        elif interval == '1m':
-            if kline_open_time_utc.replace(second=0, microsecond=0) == target_dt_utc.replace(second=0, microsecond=0):
-                target_candle_index = i
-                break
-        elif interval in ['3m', '5m', '15m', '30m']:
-            # Extract interval value (e.g., 3 from '3m')
-            interval_minutes = int(interval[:-1])
-            # Check if both timestamps align to the same interval boundary
-            if (kline_open_time_utc.replace(second=0, microsecond=0).minute % interval_minutes == 0 and
-                target_dt_utc.replace(second=0, microsecond=0).minute % interval_minutes == 0 and
-                kline_open_time_utc.replace(second=0, microsecond=0) == target_dt_utc.replace(second=0, microsecond=0)):
-                target_candle_index = i
-                break
-        elif interval in ['1h', '2h', '6h', '8h', '12h']:
-            # For hourly intervals, ensure both timestamps align to the exact hour boundary
-            if interval == '1h':
-                if (kline_open_time_utc.replace(minute=0, second=0, microsecond=0) == 
-                    target_dt_utc.replace(minute=0, second=0, microsecond=0)):
-                    target_candle_index = i
-                    break
-            else:
-                # For multi-hour intervals, check if both timestamps align to the same interval boundary
-                interval_hours = int(interval[:-1])
-                if (kline_open_time_utc.hour % interval_hours == 0 and
-                    target_dt_utc.hour % interval_hours == 0 and
-                    kline_open_time_utc.replace(minute=0, second=0, microsecond=0) == 
-                    target_dt_utc.replace(minute=0, second=0, microsecond=0)):
-                    target_candle_index = i
-                    break
-        elif interval in ['1d', '3d']:
-            # For daily intervals, match on day boundaries
-            if interval == '1d':
-                if (kline_open_time_utc.replace(hour=0, minute=0, second=0, microsecond=0) == 
-                    target_dt_utc.replace(hour=0, minute=0, second=0, microsecond=0)):
-                    target_candle_index = i
-                    break
-            else:  # '3d'
-                # For 3-day intervals, calculate days from epoch and check if both align to the same 3-day boundary
-                days_since_epoch_kline = (kline_open_time_utc - datetime(1970, 1, 1, tzinfo=timezone.utc)).days
-                days_since_epoch_target = (target_dt_utc - datetime(1970, 1, 1, tzinfo=timezone.utc)).days
-                if (days_since_epoch_kline % 3 == 0 and
-                    days_since_epoch_target % 3 == 0 and
-                    days_since_epoch_kline == days_since_epoch_target):
-                    target_candle_index = i
-                    break
-        elif interval in ['1w', '1M']:
-            # For weekly intervals, ensure both timestamps align to the same week
-            if interval == '1w':
-                # Use isocalendar to get year and week number
-                kline_year, kline_week, _ = kline_open_time_utc.isocalendar()
-                target_year, target_week, _ = target_dt_utc.isocalendar()
-                
-                if kline_year == target_year and kline_week == target_week:
-                    target_candle_index = i
-                    break
-            else:  # '1M'
-                # For monthly intervals, ensure both timestamps are in the same month and year
-                if (kline_open_time_utc.year == target_dt_utc.year and 
-                    kline_open_time_utc.month == target_dt_utc.month):
-                    target_candle_index = i
-                    break
+    # Find the candle whose open time is exactly the target boundary
+    target_candle_index = next((i for i, kline in enumerate(klines) if int(kline[0]) == target_open_ms), -1)
     
     if target_candle_index == -1:
-        log_websocket(f"No {interval} candle found for the specified datetime: {target_datetime_str}")
+        log_websocket(f"No {interval} candle found for open time {target_open_ms}")
         return None
     
     # Convert all candles to Heikin Ashi (we need previous candles for proper calculation)
-    ha_candles = convert_to_heikin_ashi(klines)
+    ha_candles = convert_to_heikin_ashi(klines[:target_candle_index + 1])
     
     # Return the Heikin Ashi candle for the target datetime
     return ha_candles[target_candle_index]
 
+def get_heikin_ashi_by_datetime(symbol, interval, target_datetime_str):
+    """
+    Fetch Heikin Ashi candle for the exact datetime specified.
+    
+    Args:
+        symbol (str): Trading pair symbol, e.g. 'BTCUSDT'
+        interval (str): Kline interval, e.g. '1s', '1m', '3m', '5m', '15m', '30m', '1h', '2h', '4h', '6h', '8h', '12h', '1d', '3d', '1w', '1M'
+        target_datetime_str (str): Target datetime in 'dd-mm-YYYY HH:MM' (24h) format, local time
+    
+    Returns:
+        The Heikin Ashi candle data, or None if not found
+    """
+    # A naive datetime's timestamp() is interpreted in the system's local timezone
+    target_dt_local = datetime.strptime(target_datetime_str, '%d-%m-%Y %H:%M')
+    return get_heikin_ashi_by_timestamp(symbol, interval, int(target_dt_local.timestamp() * 1000))
+
 def print_heikin_ashi_candle(candle):
     """
     Print Heikin Ashi candle data in a formatted way.
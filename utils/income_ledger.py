@@ -0,0 +1,451 @@
+"""
+Persistent local ledger of futures income events (REALIZED_PNL, COMMISSION, FUNDING_FEE).
+
+Layout: data/income/gen-<n>/<column>.bin, raw little-endian arrays sorted by time (int64
+time and tran_id, float64 income, int8 income type, int16 symbol code), plus meta.json
+with the symbol table, the current generation n and the time range [synced_from,
+synced_until] known to be complete. Columns are read zero-copy through np.memmap, and a
+date range is two binary searches. New events after the last stored one are appended to
+the current generation; inserting older events writes the merged columns as the next
+generation and switches meta.json to it in one atomic replace.
+
+rollups.json holds daily totals by symbol and income type, for UTC and IST day
+boundaries. They are additive, so every write folds its new events in. A range query
+sums the rollup rows of its whole days and reads only the partial days at its edges.
+
+A background job in the API process syncs the ledger incrementally: everything after
+the last synced time (with a short overlap for records booked late, deduplicated by
+tranId and type) is fetched with the paginated income history download. Ranges before
+the ledger start are backfilled on first use. PnL queries then never touch the exchange.
+"""
+import copy
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from utils.logger import log_api, log_error
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, single writer assumed
+    fcntl = None
+
+INCOME_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'income')
+INCOME_TYPES = ('REALIZED_PNL', 'COMMISSION', 'FUNDING_FEE')
+INCOME_COLUMNS = (('time', np.int64), ('tran_id', np.int64), ('income', np.float64),
+                  ('income_type', np.int8), ('symbol', np.int16))
+INCOME_HISTORY_DAYS = int(os.getenv('INCOME_HISTORY_DAYS', '90'))  # Initial sync depth
+INCOME_SYNC_SECONDS = int(os.getenv('INCOME_SYNC_SECONDS', '60'))  # Background sync period
+SYNC_OVERLAP_MS = 60 * 1000  # Re-read window before the last sync, for records the exchange books late
+DAY_MS = 24 * 60 * 60 * 1000
+# Day boundaries PnL is rolled up on: offset from UTC in ms
+ROLLUP_TIMEZONES = {'UTC': 0, 'IST': (5 * 60 + 30) * 60 * 1000}
+
+
+def day_number(time_ms, tz='UTC'):
+    """Days since 1970-01-01 in `tz` of a ms timestamp"""
+    return (time_ms + ROLLUP_TIMEZONES[tz]) // DAY_MS
+
+
+def day_start_ms(day, tz='UTC'):
+    """UTC ms timestamp at which day number `day` starts in `tz`"""
+    return day * DAY_MS - ROLLUP_TIMEZONES[tz]
+
+
+def date_range_ms(days=30, start_date=None, end_date=None, tz='UTC', now_ms=None):
+    """
+    [start, end] in ms of whole days 'YYYY-MM-DD' in `tz` (end inclusive), else the last `days` days
+
+    Raises:
+        ValueError: for an unknown timezone or a malformed date
+    """
+    if tz not in ROLLUP_TIMEZONES:
+        raise ValueError(f"timezone must be one of {', '.join(ROLLUP_TIMEZONES)}")
+    if start_date and end_date:
+        epoch = datetime(1970, 1, 1)
+        start_day = (datetime.strptime(start_date, '%Y-%m-%d') - epoch).days
+        end_day = (datetime.strptime(end_date, '%Y-%m-%d') - epoch).days
+        return day_start_ms(start_day, tz), day_start_ms(end_day + 1, tz) - 1
+    end_ms = int(time.time() * 1000) if now_ms is None else now_ms
+    return end_ms - days * DAY_MS, end_ms
+
+
+def _add_rows(rollups, rows, timezones=ROLLUP_TIMEZONES):
+    """Fold a list of (time, tran_id, income, income_type, symbol) rows into the daily tables"""
+    for tz in timezones:
+        table = rollups[tz]
+        for time_ms, _, income, income_type, symbol in rows:
+            totals = table.setdefault(day_number(time_ms, tz), {}).setdefault(symbol, [0.0] * len(INCOME_TYPES))
+            totals[income_type] += income
+
+
+class IncomeLedger:
+    """
+    On-disk income events of the account
+
+    Args:
+        directory (str): Directory of the ledger
+    """
+
+    def __init__(self, directory=INCOME_DIR):
+        self.path = directory
+        self._columns = None
+        self._generation = None  # Generation the cached memmaps were opened from
+        self._rows = -1  # Row count the cached memmaps were opened with
+        self._write_lock = threading.Lock()
+        self._rollups = None
+
+    def _generation_dir(self, generation):
+        # Generation None is the original layout, columns directly in the ledger directory
+        return self.path if generation is None else os.path.join(self.path, f"gen-{generation}")
+
+    def _column_path(self, name, generation=None):
+        return os.path.join(self._generation_dir(generation), f"{name}.bin")
+
+    def _meta_path(self):
+        return os.path.join(self.path, 'meta.json')
+
+    def _row_count(self, generation=None):
+        sizes = []
+        for name, dtype in INCOME_COLUMNS:
+            path = self._column_path(name, generation)
+            sizes.append(os.path.getsize(path) // np.dtype(dtype).itemsize if os.path.exists(path) else 0)
+        # A crash between column appends leaves some columns longer; only complete rows count
+        return min(sizes)
+
+    def columns(self):
+        """Column name -> read-only memmap of the whole ledger (reopened after a write)"""
+        for attempt in range(3):
+            generation = self.load_meta().get('generation')
+            try:
+                rows = self._row_count(generation)
+                if self._columns is None or generation != self._generation or rows != self._rows:
+                    self._columns = {
+                        name: np.memmap(self._column_path(name, generation), dtype=dtype, mode='r', shape=(rows,))
+                        if rows else np.empty(0, dtype=dtype)
+                        for name, dtype in INCOME_COLUMNS
+                    }
+                    self._generation, self._rows = generation, rows
+                return self._columns
+            except FileNotFoundError:
+                if attempt == 2:
+                    raise
+                # A merge switched generations and removed the one just read from meta.json
+
+    def __len__(self):
+        return len(self.columns()['time'])
+
+    def load_meta(self):
+        try:
+            with open(self._meta_path(), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {'symbols': [], 'synced_from': None, 'synced_until': None, 'generation': None}
+
+    def _save_meta(self, meta):
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = self._meta_path() + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._meta_path())
+
+    def _lock(self):
+        os.makedirs(self.path, exist_ok=True)
+        lock_file = open(os.path.join(self.path, '.lock'), 'w')
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def _rollups_path(self):
+        return os.path.join(self.path, 'rollups.json')
+
+    def _build_rollups(self):
+        """Daily totals by symbol and income type for every timezone, from the columns"""
+        columns = self.columns()
+        rollups = {'rows': len(columns['time'])}
+        n_types = len(INCOME_TYPES)
+        for tz in ROLLUP_TIMEZONES:
+            days = day_number(np.asarray(columns['time']), tz)
+            keys = (days * 65536 + np.asarray(columns['symbol'], dtype=np.int64)) * n_types + columns['income_type']
+            unique, inverse = np.unique(keys, return_inverse=True)
+            sums = np.bincount(inverse, weights=columns['income'], minlength=len(unique))
+            table = {}
+            for key, total in zip(unique.tolist(), sums.tolist()):
+                day, rest = divmod(key, 65536 * n_types)
+                symbol, income_type = divmod(rest, n_types)
+                table.setdefault(day, {}).setdefault(symbol, [0.0] * n_types)[income_type] = total
+            rollups[tz] = table
+        return rollups
+
+    def _save_rollups(self, rollups):
+        try:
+            tmp_path = self._rollups_path() + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({key: value if key == 'rows' else
+                           {str(day): {str(symbol): totals for symbol, totals in symbols.items()}
+                            for day, symbols in value.items()}
+                           for key, value in rollups.items()}, f)
+            os.replace(tmp_path, self._rollups_path())
+        except OSError as e:
+            log_error(f"Could not save income rollups: {e}")
+
+    def _load_rollups(self):
+        try:
+            with open(self._rollups_path(), 'r') as f:
+                data = json.load(f)
+            return {key: value if key == 'rows' else
+                    {int(day): {int(symbol): totals for symbol, totals in symbols.items()}
+                     for day, symbols in value.items()}
+                    for key, value in data.items()}
+        except (FileNotFoundError, json.JSONDecodeError, ValueError, AttributeError):
+            return None
+
+    def rollups(self):
+        """
+        Daily tables {'rows': events covered, tz: {day: {symbol code: [total per income type]}}}
+
+        Rebuilt from the columns when they do not match the stored events (e.g. a crash
+        between a column write and the rollup save). Never modified in place.
+        """
+        rows = len(self)
+        if self._rollups is not None and self._rollups['rows'] == rows:
+            return self._rollups
+        with self._write_lock:
+            rollups = self._load_rollups()
+            if rollups is None or rollups.get('rows') != rows or set(ROLLUP_TIMEZONES) - set(rollups):
+                rollups = self._build_rollups()
+                self._save_rollups(rollups)
+            self._rollups = rollups
+        return rollups
+
+    def summary(self, start_ms, end_ms, tz='UTC'):
+        """
+        Income totals of [start_ms, end_ms] overall, by symbol and by day in `tz`
+
+        Returns:
+            dict: 'totals' and 'by_symbol' ({income type: amount}), and 'daily' rows
+            ({'date', income type: amount}) for the days that have income
+
+        Raises:
+            ValueError: if `tz` is not one of ROLLUP_TIMEZONES
+        """
+        if tz not in ROLLUP_TIMEZONES:
+            raise ValueError(f"timezone must be one of {', '.join(ROLLUP_TIMEZONES)}")
+        table = self.rollups()[tz]
+        symbols = self.load_meta()['symbols']
+        # Whole days inside the range come from the rollups
+        first_day = -(-(start_ms + ROLLUP_TIMEZONES[tz]) // DAY_MS)
+        end_day = day_number(end_ms + 1, tz)
+        daily = {day: table[day] for day in range(first_day, end_day) if day in table}
+        # Partial days at the edges come from the events
+        if first_day > end_day:
+            edges = [(start_ms, end_ms)]
+        else:
+            edges = [(start_ms, day_start_ms(first_day, tz) - 1), (day_start_ms(end_day, tz), end_ms)]
+        partial = {tz: {}}
+        for lo, hi in edges:
+            if lo > hi:
+                continue
+            arrays = self.arrays(lo, hi)
+            _add_rows(partial, list(zip(arrays['time'].tolist(), arrays['tran_id'].tolist(), arrays['income'].tolist(),
+                                        arrays['income_type'].tolist(), arrays['symbol'].tolist())), (tz,))
+        daily.update(partial[tz])
+
+        totals = dict.fromkeys(INCOME_TYPES, 0.0)
+        by_symbol = {}
+        daily_rows = []
+        for day in sorted(daily):
+            row = dict.fromkeys(INCOME_TYPES, 0.0)
+            for symbol, amounts in daily[day].items():
+                symbol_totals = by_symbol.setdefault(symbols[symbol], dict.fromkeys(INCOME_TYPES, 0.0))
+                for income_type, amount in zip(INCOME_TYPES, amounts):
+                    row[income_type] += amount
+                    symbol_totals[income_type] += amount
+            for income_type in INCOME_TYPES:
+                totals[income_type] += row[income_type]
+            row['date'] = (datetime(1970, 1, 1) + timedelta(days=day)).strftime('%Y-%m-%d')
+            daily_rows.append(row)
+        return {'timezone': tz, 'totals': totals, 'by_symbol': by_symbol, 'daily': daily_rows}
+
+    def covers(self, start_ms, end_ms, max_lag_ms=0):
+        """Whether [start_ms, end_ms] is synced, accepting the last `max_lag_ms` as not yet synced"""
+        meta = self.load_meta()
+        return (meta['synced_from'] is not None and meta['synced_from'] <= start_ms
+                and end_ms - max_lag_ms <= meta['synced_until'])
+
+    def arrays(self, start_ms=None, end_ms=None):
+        """Zero-copy column views of the events with start_ms <= time <= end_ms"""
+        columns = self.columns()
+        times = columns['time']
+        lo = int(np.searchsorted(times, start_ms, side='left')) if start_ms is not None else 0
+        hi = int(np.searchsorted(times, end_ms, side='right')) if end_ms is not None else len(times)
+        return {name: column[lo:hi] for name, column in columns.items()}
+
+    def records(self, start_ms=None, end_ms=None):
+        """Events in the futures_income_history record layout"""
+        arrays = self.arrays(start_ms, end_ms)
+        symbols = self.load_meta()['symbols']
+        return [{'symbol': symbols[symbol], 'incomeType': INCOME_TYPES[income_type], 'income': income,
+                 'time': t, 'tranId': tran_id}
+                for t, tran_id, income, income_type, symbol in zip(
+                    arrays['time'].tolist(), arrays['tran_id'].tolist(), arrays['income'].tolist(),
+                    arrays['income_type'].tolist(), arrays['symbol'].tolist())]
+
+    def write(self, records, synced_from, synced_until):
+        """
+        Store income records fetched for [synced_from, synced_until] and extend the synced range
+
+        Records of other types are ignored and records already stored (same tranId and type)
+        are skipped. New events after the last stored one are appended in place; anything
+        older is merged and the columns are rewritten atomically.
+
+        Returns:
+            int: number of events added
+        """
+        with self._write_lock, self._lock():
+            meta = self.load_meta()
+            symbol_codes = {symbol: code for code, symbol in enumerate(meta['symbols'])}
+            stored = self.columns()
+            count = len(stored['time'])
+            if self._rollups is None or self._rollups['rows'] != count:
+                self._rollups = self._load_rollups()
+            existing = self.arrays(synced_from, synced_until)
+            seen = set(zip(existing['tran_id'].tolist(), existing['income_type'].tolist()))
+            rows = []
+            for record in records:
+                income_type = record.get('incomeType')
+                if income_type not in INCOME_TYPES:
+                    continue
+                key = (int(record['tranId']), INCOME_TYPES.index(income_type))
+                if key in seen:
+                    continue
+                seen.add(key)
+                symbol = record.get('symbol') or ''
+                if symbol not in symbol_codes:
+                    symbol_codes[symbol] = len(meta['symbols'])
+                    meta['symbols'].append(symbol)
+                rows.append((int(record['time']), key[0], float(record['income']), key[1], symbol_codes[symbol]))
+            rows.sort()
+            if rows:
+                # The symbol table is saved first, so stored codes always resolve
+                self._save_meta(meta)
+                new = {name: np.array([row[i] for row in rows], dtype=dtype)
+                       for i, (name, dtype) in enumerate(INCOME_COLUMNS)}
+                generation = meta.get('generation')
+                if not count or new['time'][0] >= stored['time'][-1]:
+                    self._columns = None  # Drop the memmaps before writing
+                    for name, dtype in INCOME_COLUMNS:
+                        path = self._column_path(name, generation)
+                        with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+                            f.truncate(count * np.dtype(dtype).itemsize)  # Drop a torn row from an interrupted append
+                            f.seek(0, os.SEEK_END)
+                            new[name].tofile(f)
+                else:
+                    order = np.argsort(np.concatenate((stored['time'], new['time'])), kind='stable')
+                    merged = {name: np.concatenate((np.asarray(stored[name]), new[name]))[order]
+                              for name, _ in INCOME_COLUMNS}
+                    self._columns = None
+                    # The merged columns go into a new generation, switched to with one meta.json
+                    # replace: readers (and a restart after a crash) see all old or all new columns
+                    next_generation = (generation or 0) + 1
+                    os.makedirs(self._generation_dir(next_generation), exist_ok=True)
+                    for name, _ in INCOME_COLUMNS:
+                        with open(self._column_path(name, next_generation), 'wb') as f:
+                            merged[name].tofile(f)
+                            f.flush()
+                            os.fsync(f.fileno())
+                    meta['generation'] = next_generation
+                    self._save_meta(meta)
+                    self._remove_generation(generation)
+                # Rollups are additive: fold the new events into a copy (readers keep the old tables)
+                if self._rollups is not None and self._rollups.get('rows') == count \
+                        and not set(ROLLUP_TIMEZONES) - set(self._rollups):
+                    rollups = copy.deepcopy(self._rollups)
+                    _add_rows(rollups, rows)
+                    rollups['rows'] = count + len(rows)
+                else:
+                    rollups = self._build_rollups()
+                self._save_rollups(rollups)
+                self._rollups = rollups
+            if meta['synced_from'] is None or synced_from < meta['synced_from']:
+                meta['synced_from'] = synced_from
+            if meta['synced_until'] is None or synced_until > meta['synced_until']:
+                meta['synced_until'] = synced_until
+            self._save_meta(meta)
+            return len(rows)
+
+    def _remove_generation(self, generation):
+        """Delete the columns of a replaced generation (open memmaps of it stay readable)"""
+        try:
+            if generation is None:
+                for name, _ in INCOME_COLUMNS:
+                    if os.path.exists(self._column_path(name)):
+                        os.remove(self._column_path(name))
+            else:
+                shutil.rmtree(self._generation_dir(generation))
+        except OSError as e:
+            log_error(f"Could not remove income ledger generation {generation}: {e}")
+
+    def sync(self, tracker, start_ms=None, now_ms=None):
+        """
+        Fetch what the ledger is missing up to now, and back to `start_ms` if given
+
+        Args:
+            tracker (BinanceFuturesPnLTracker): Source of the paginated income history
+            start_ms (int, optional): Oldest time the caller needs; defaults to
+                INCOME_HISTORY_DAYS back on the first sync
+
+        Returns:
+            int: number of events added
+        """
+        now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+        meta = self.load_meta()
+        added = 0
+        if meta['synced_until'] is None:
+            if start_ms is None:
+                start_ms = now_ms - INCOME_HISTORY_DAYS * 24 * 60 * 60 * 1000
+            added += self.write(tracker.iter_income_history(start_ms, now_ms), start_ms, now_ms)
+            log_api(f"💾 Income ledger created: {len(self)} events since {start_ms}")
+            return added
+        if start_ms is not None and start_ms < meta['synced_from']:
+            added += self.write(tracker.iter_income_history(start_ms, meta['synced_from'] - 1), start_ms,
+                                meta['synced_from'] - 1)
+        fetch_from = max(meta['synced_until'] - SYNC_OVERLAP_MS, meta['synced_from'])
+        added += self.write(tracker.iter_income_history(fetch_from, now_ms), fetch_from, now_ms)
+        if added:
+            log_api(f"💾 Income ledger synced: {added} new event(s), {len(self)} stored")
+        return added
+
+
+_ledger = None
+_sync_thread = None
+
+
+def get_income_ledger():
+    global _ledger
+    if _ledger is None:
+        _ledger = IncomeLedger()
+    return _ledger
+
+
+def start_income_sync(interval=INCOME_SYNC_SECONDS):
+    """Keep the ledger current from a daemon thread (API process)"""
+    global _sync_thread
+    if _sync_thread is not None:
+        return _sync_thread
+
+    def run():
+        from utils.pnl_analyzer import get_shared_tracker
+        while True:
+            try:
+                get_income_ledger().sync(get_shared_tracker())
+            except Exception as e:
+                log_error(f"Income ledger sync failed: {e}")
+            time.sleep(interval)
+
+    _sync_thread = threading.Thread(target=run, name='income-ledger-sync', daemon=True)
+    _sync_thread.start()
+    return _sync_thread
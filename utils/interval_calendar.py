@@ -0,0 +1,157 @@
+"""
+Kline interval arithmetic on integer epoch milliseconds (UTC).
+
+Replaces the per-interval if/elif chains with a lookup table. Every function takes
+either a single int timestamp or a NumPy array of timestamps; scalar calls use plain
+integer arithmetic and never allocate datetime objects, array calls are vectorized.
+
+Binance aligns candles in UTC: fixed intervals (1s..3d) on multiples of their length
+since the epoch, weekly candles on Monday 00:00 and monthly candles on the 1st.
+"""
+import numpy as np
+
+SECOND_MS = 1000
+MINUTE_MS = 60 * SECOND_MS
+HOUR_MS = 60 * MINUTE_MS
+DAY_MS = 24 * HOUR_MS
+WEEK_MS = 7 * DAY_MS
+
+# Length of every fixed-size interval; '1M' varies and is handled separately
+INTERVAL_MS = {
+    '1s': SECOND_MS,
+    '1m': MINUTE_MS,
+    '3m': 3 * MINUTE_MS,
+    '5m': 5 * MINUTE_MS,
+    '15m': 15 * MINUTE_MS,
+    '30m': 30 * MINUTE_MS,
+    '1h': HOUR_MS,
+    '2h': 2 * HOUR_MS,
+    '4h': 4 * HOUR_MS,
+    '6h': 6 * HOUR_MS,
+    '8h': 8 * HOUR_MS,
+    '12h': 12 * HOUR_MS,
+    '1d': DAY_MS,
+    '3d': 3 * DAY_MS,
+    '1w': WEEK_MS,
+}
+
+# Offset of the alignment grid from the epoch: 1970-01-01 was a Thursday, weeks start on Monday
+INTERVAL_ORIGIN_MS = {'1w': 4 * DAY_MS}
+
+MONTH = '1M'
+SUPPORTED_INTERVALS = tuple(INTERVAL_MS) + (MONTH,)
+
+
+def _check(interval):
+    if interval not in INTERVAL_MS and interval != MONTH:
+        raise ValueError(f"Unsupported interval: {interval}")
+
+
+def interval_ms(interval):
+    """
+    Nominal length of an interval in milliseconds
+
+    Months are reported as 30 days; use step() for exact month arithmetic.
+    """
+    _check(interval)
+    return INTERVAL_MS.get(interval, 30 * DAY_MS)
+
+
+# Month arithmetic on days since the epoch (Howard Hinnant's civil calendar algorithms)
+
+def _civil_from_days(days):
+    z = days + 719468
+    era = z // 146097
+    doe = z - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    day = doy - (153 * mp + 2) // 5 + 1
+    month = mp + 3 - 12 * (mp >= 10)
+    year = yoe + era * 400 + (month <= 2)
+    return year, month, day
+
+
+def _days_from_civil(year, month, day):
+    year = year - (month <= 2)
+    era = year // 400
+    yoe = year - era * 400
+    mp = (month + 9) % 12
+    doy = (153 * mp + 2) // 5 + day - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+def _month_index(ts):
+    """Months since 1970-01 for an epoch-ms timestamp"""
+    year, month, _ = _civil_from_days(ts // DAY_MS)
+    return (year - 1970) * 12 + (month - 1)
+
+
+def _month_start(month_index):
+    """Epoch ms of the first day of a month given as months since 1970-01"""
+    year = 1970 + month_index // 12
+    month = month_index % 12 + 1
+    return _days_from_civil(year, month, 1) * DAY_MS
+
+
+def _as_int(ts):
+    if isinstance(ts, np.ndarray):
+        return ts.astype(np.int64, copy=False)
+    return int(ts)
+
+
+def align(ts, interval):
+    """Open time of the candle containing `ts` (int or array of epoch ms)"""
+    _check(interval)
+    ts = _as_int(ts)
+    if interval == MONTH:
+        return _month_start(_month_index(ts))
+    length = INTERVAL_MS[interval]
+    origin = INTERVAL_ORIGIN_MS.get(interval, 0)
+    return (ts - origin) // length * length + origin
+
+
+def is_aligned(ts, interval):
+    """Whether `ts` is exactly a candle open time"""
+    return align(ts, interval) == _as_int(ts)
+
+
+def step(ts, interval, n=1):
+    """Move aligned open time(s) `ts` by `n` candles (n may be negative or an array)"""
+    _check(interval)
+    ts = _as_int(ts)
+    if interval == MONTH:
+        return _month_start(_month_index(ts) + n)
+    return ts + n * INTERVAL_MS[interval]
+
+
+def close_time(open_ts, interval):
+    """Binance close time (last millisecond) of the candle(s) opening at `open_ts`"""
+    return step(open_ts, interval, 1) - 1
+
+
+def interval_range(start, end, interval):
+    """
+    Open times of every candle overlapping [start, end)
+
+    Returns:
+        np.ndarray of int64 epoch ms, starting at the candle containing `start`
+    """
+    _check(interval)
+    first = align(int(start), interval)
+    end = int(end)
+    if end <= first:
+        return np.empty(0, dtype=np.int64)
+    if interval == MONTH:
+        months = np.arange(_month_index(first), _month_index(end - 1) + 1, dtype=np.int64)
+        return _month_start(months)
+    return np.arange(first, end, INTERVAL_MS[interval], dtype=np.int64)
+
+
+def candles_between(start, end, interval):
+    """Number of candle boundaries crossed going from open time `start` to open time `end`"""
+    _check(interval)
+    if interval == MONTH:
+        return _month_index(_as_int(end)) - _month_index(_as_int(start))
+    return (_as_int(end) - _as_int(start)) // INTERVAL_MS[interval]
@@ -0,0 +1,400 @@
+"""
+Intrabar fill model for the strategy's stop-limit orders.
+
+The OHLC rules in `strategy_orders` only know that a candle traded through a
+price, not in which order. This module walks sub-bars inside every candle
+(1s bars built from futures aggTrades, or any coarser futures kline interval)
+to decide for each resting order whether it was triggered, filled, partially
+filled or missed:
+
+- BUY STOP (stop S, limit L >= S): triggered by the first sub-bar trading at or
+  above S. If that sub-bar opened at or below L the order fills at once at
+  min(max(open, S), L); if it gapped above L the limit rests at L and fills at
+  L in the first later sub-bar that trades down to it, otherwise it is missed.
+- SELL STOP (stop loss, limit == stop): mirrored, triggered at or below S and
+  missed if the price gaps under the limit and never trades back up to it.
+- With a participation rate the order can only take that share of the volume
+  traded at or through its limit from the fill onwards; the rest expires with
+  the candle (a partial fill). Less than one stepSize of capacity is a miss.
+
+Sub-bars live in a memory-mapped columnar store, and the first-touch search is
+vectorized over whole chunks of sub-bars, so months of 1s data stay fast.
+"""
+import json
+import os
+import numpy as np
+from utils.backtest import _next_true_index, load_klines, strategy_orders
+from utils.interval_calendar import SECOND_MS, HOUR_MS, align, interval_ms, step
+from utils.logger import log_websocket, log_error
+
+SUBBAR_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'subbars')
+SUBBAR_COLUMNS = (('open_time', np.int64), ('open', np.float64), ('high', np.float64),
+                  ('low', np.float64), ('close', np.float64), ('volume', np.float64))
+AGG_TRADES_LIMIT = 1000  # Maximum aggTrades per request
+AGG_TRADES_WINDOW_MS = HOUR_MS  # startTime/endTime of an aggTrades request must be less than an hour apart
+CHUNK_SUBBARS = 4_000_000  # Sub-bars processed per vectorized pass (bounds temporary memory)
+
+# Per-candle outcome of a resting order
+FILL_NONE = 0  # No order resting, or the stop was never reached
+FILL_MISSED = 1  # Triggered, but the limit was never reachable before the candle closed
+FILL_PARTIAL = 2  # Filled for less than the order quantity (participation limit)
+FILL_FULL = 3
+
+
+class SubBarStore:
+    """
+    Append-only, memory-mapped sub-bars for one symbol
+
+    Every column is a raw little-endian binary file (<dir>/<SYMBOL>_<bar>/<column>.bin)
+    read with np.memmap, so only the pages a backtest touches are loaded. meta.json
+    records the synced time range, because 1s bars only exist for seconds with trades.
+
+    Args:
+        symbol (str): Trading pair symbol
+        bar (str): '1s' (built from aggTrades) or a futures kline interval such as '1m'
+        directory (str): Root directory of the store
+    """
+
+    def __init__(self, symbol, bar='1s', directory=SUBBAR_DIR):
+        self.symbol = symbol.upper()
+        self.bar = bar
+        self.bar_ms = interval_ms(bar)
+        self.path = os.path.join(directory, f"{self.symbol}_{bar}")
+        self._columns = None
+
+    def _column_path(self, name):
+        return os.path.join(self.path, f"{name}.bin")
+
+    def _meta_path(self):
+        return os.path.join(self.path, 'meta.json')
+
+    def coverage(self):
+        """(start_ms, end_ms) of the synced range, or None if nothing is stored"""
+        try:
+            with open(self._meta_path(), 'r') as f:
+                meta = json.load(f)
+            return meta['start'], meta['end']
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            return None
+
+    def _save_coverage(self, start_ms, end_ms):
+        tmp_path = self._meta_path() + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'start': int(start_ms), 'end': int(end_ms)}, f)
+        os.replace(tmp_path, self._meta_path())
+
+    def columns(self):
+        """Column name -> read-only memmap (empty arrays if nothing is stored)"""
+        if self._columns is None:
+            sizes = {}
+            for name, dtype in SUBBAR_COLUMNS:
+                path = self._column_path(name)
+                sizes[name] = os.path.getsize(path) // np.dtype(dtype).itemsize if os.path.exists(path) else 0
+            # A crash between column writes leaves some columns longer; only complete rows count
+            rows = min(sizes.values())
+            self._columns = {
+                name: np.memmap(self._column_path(name), dtype=dtype, mode='r', shape=(rows,)) if rows
+                else np.empty(0, dtype=dtype)
+                for name, dtype in SUBBAR_COLUMNS
+            }
+        return self._columns
+
+    def __len__(self):
+        return len(self.columns()['open_time'])
+
+    def append(self, bars, covered_from, covered_to):
+        """
+        Append bars newer than the last stored one and extend the coverage to `covered_to`
+
+        Args:
+            bars (dict): Column arrays (see SUBBAR_COLUMNS), sorted by open_time
+            covered_from (int): Start of the synced range if the store is still empty
+            covered_to (int): Everything before this time (ms) has now been synced
+        """
+        os.makedirs(self.path, exist_ok=True)
+        stored = self.columns()['open_time']
+        rows = len(stored)
+        keep = slice(None)
+        if rows and len(bars['open_time']):
+            keep = slice(int(np.searchsorted(bars['open_time'], stored[-1], side='right')), None)
+        self._columns = None  # Drop the memmaps before writing
+        for name, dtype in SUBBAR_COLUMNS:
+            path = self._column_path(name)
+            with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+                f.truncate(rows * np.dtype(dtype).itemsize)  # Drop a torn row from an interrupted append
+                f.seek(0, os.SEEK_END)
+                np.ascontiguousarray(bars[name][keep], dtype=dtype).tofile(f)
+        coverage = self.coverage()
+        self._save_coverage(coverage[0] if coverage else covered_from, covered_to)
+
+    def window(self, start_ms, end_ms):
+        """Index range [lo, hi) of the sub-bars with start_ms <= open_time < end_ms"""
+        open_time = self.columns()['open_time']
+        return int(np.searchsorted(open_time, start_ms)), int(np.searchsorted(open_time, end_ms))
+
+    def sync(self, start_ms, end_ms, client=None):
+        """
+        Download sub-bars up to `end_ms`, continuing from the end of the synced range
+
+        The store only grows forwards; `start_ms` is used when it is still empty.
+        """
+        if client is None:
+            from utils.historical_handler import setup_binance_client
+            client = setup_binance_client()
+        coverage = self.coverage()
+        cursor = coverage[1] if coverage else align(int(start_ms), self.bar)
+        if coverage and start_ms < coverage[0]:
+            log_websocket(f"⚠️ {self.symbol} {self.bar} sub-bars start at {coverage[0]}; earlier history is not prepended")
+        while cursor < end_ms:
+            window_end = min(cursor + AGG_TRADES_WINDOW_MS, align(int(end_ms), self.bar))
+            if window_end <= cursor:
+                break
+            if self.bar == '1s':
+                bars = aggtrades_to_subbars(fetch_agg_trades(client, self.symbol, cursor, window_end))
+            else:
+                candles = load_klines(self.symbol, self.bar, cursor, window_end, client=client)
+                bars = {name: candles[name] for name, _ in SUBBAR_COLUMNS}
+            self.append(bars, cursor, window_end)
+            cursor = window_end
+        return self
+
+
+def fetch_agg_trades(client, symbol, start_ms, end_ms):
+    """
+    Futures aggTrades with start_ms <= T < end_ms (less than an hour apart), paging by trade id
+
+    Returns:
+        (times, prices, quantities) arrays
+    """
+    trades = []
+    page = client.futures_aggregate_trades(symbol=symbol, startTime=int(start_ms), endTime=int(end_ms) - 1,
+                                           limit=AGG_TRADES_LIMIT)
+    while page:
+        trades.extend(t for t in page if t['T'] < end_ms)
+        if len(page) < AGG_TRADES_LIMIT or page[-1]['T'] >= end_ms:
+            break
+        page = client.futures_aggregate_trades(symbol=symbol, fromId=page[-1]['a'] + 1, limit=AGG_TRADES_LIMIT)
+    return (np.array([t['T'] for t in trades], dtype=np.int64),
+            np.array([t['p'] for t in trades], dtype=np.float64),
+            np.array([t['q'] for t in trades], dtype=np.float64))
+
+
+def aggtrades_to_subbars(trades, bar_ms=SECOND_MS):
+    """Aggregate time-sorted (times, prices, quantities) into bars; bars without trades are omitted"""
+    times, prices, quantities = trades
+    if not len(times):
+        return {name: np.empty(0, dtype=dtype) for name, dtype in SUBBAR_COLUMNS}
+    buckets = times // bar_ms * bar_ms
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(times)]
+    return {
+        'open_time': buckets[starts],
+        'open': prices[starts],
+        'high': np.maximum.reduceat(prices, starts),
+        'low': np.minimum.reduceat(prices, starts),
+        'close': prices[ends - 1],
+        'volume': np.add.reduceat(quantities, starts),
+    }
+
+
+def _stop_limit_fills(is_buy, stop, limit, owner, seg_start, seg_end, bars, participation):
+    """
+    First-touch search for one chunk of sub-bars
+
+    Args:
+        is_buy (bool): BUY STOP (triggers upwards) or SELL STOP (triggers downwards)
+        stop, limit (ndarray): Per-candle order prices, NaN where no order rests
+        owner (ndarray): Candle index of every sub-bar (-1 outside every candle)
+        seg_start, seg_end (ndarray): Per-candle sub-bar range [start, end) within the chunk
+        bars (dict): Sub-bar column arrays of the chunk
+
+    Returns:
+        (outcome, price, capacity, fill_time) per candle
+    """
+    n_sub = len(owner)
+    if not n_sub:
+        empty = np.zeros(len(stop))
+        return np.full(len(stop), FILL_NONE), empty, empty, np.zeros(len(stop), dtype=np.int64)
+    valid = owner >= 0
+    safe_owner = np.where(valid, owner, 0)
+    sub_stop = np.where(valid, stop[safe_owner], np.nan)
+    sub_limit = np.where(valid, limit[safe_owner], np.nan)
+    sub_open, sub_high, sub_low = bars['open'], bars['high'], bars['low']
+    if is_buy:
+        touched = sub_high >= sub_stop
+        gapped = sub_open > sub_limit
+        reach = sub_low <= sub_limit
+    else:
+        touched = sub_low <= sub_stop
+        gapped = sub_open < sub_limit
+        reach = sub_high >= sub_limit
+
+    next_touch = np.append(_next_true_index(touched), n_sub)
+    next_reach = np.append(_next_true_index(reach), n_sub)
+    trigger = next_touch[seg_start]
+    triggered = trigger < seg_end
+    trigger_at = np.minimum(trigger, n_sub - 1)
+    # Fill in the trigger sub-bar unless it gapped past the limit; then wait for the price to come back
+    immediate = triggered & ~gapped[trigger_at]
+    later = next_reach[np.minimum(trigger + 1, n_sub)]
+    fill = np.where(immediate, trigger, later)
+    filled = triggered & (fill < seg_end)
+    fill_at = np.minimum(fill, n_sub - 1)
+
+    if is_buy:
+        taker_price = np.minimum(np.maximum(sub_open[trigger_at], stop), limit)
+    else:
+        taker_price = np.maximum(np.minimum(sub_open[trigger_at], stop), limit)
+    price = np.where(immediate, taker_price, limit)
+
+    if participation is None:
+        capacity = np.full(len(stop), np.inf)
+    else:
+        traded = np.concatenate(([0.0], np.cumsum(np.where(reach, bars['volume'], 0.0))))
+        capacity = (traded[seg_end] - traded[fill_at]) * participation
+
+    outcome = np.where(filled, FILL_FULL, np.where(triggered, FILL_MISSED, FILL_NONE))
+    return outcome, np.where(filled, price, 0.0), np.where(filled, capacity, 0.0), \
+        np.where(filled, bars['open_time'][fill_at], 0)
+
+
+def apply_intrabar_fills(candles, interval, orders, store, participation=None, quantity=None, step_size=None):
+    """
+    Replace the OHLC fill decisions of `strategy_orders` with sub-bar walks
+
+    Candles outside the store's synced range keep their OHLC decisions.
+
+    Args:
+        candles (dict): Candle arrays (see klines_to_arrays)
+        interval (str): Candle interval
+        orders (dict): strategy_orders() output for these candles
+        store (SubBarStore): Sub-bars covering (part of) the candles
+        participation (float, optional): Max share of the volume traded at/through the limit an order can take
+        quantity (float, optional): Order quantity used to label partial fills
+        step_size (float|str, optional): Symbol stepSize; a fill with less capacity than one step
+            is missed (without it, only a fill with no capacity at all is)
+
+    Returns:
+        dict: A copy of `orders` with 'entry_hit', 'entry_price', 'exit_hit', 'exit_price' replaced,
+        plus per-candle 'entry_outcome'/'exit_outcome' (FILL_*), 'entry_capacity'/'exit_capacity'
+        (base quantity fillable, inf without a participation limit), 'entry_fill_time'/'exit_fill_time'
+        and 'intrabar' (whether the candle was decided from sub-bars)
+    """
+    result = dict(orders)
+    n = len(candles['close'])
+    open_time = candles['open_time']
+    close = candles['close']
+    for side in ('entry', 'exit'):
+        result[f'{side}_hit'] = orders[f'{side}_hit'].copy()
+        result[f'{side}_price'] = orders[f'{side}_price'].copy()
+        result[f'{side}_outcome'] = np.where(orders[f'{side}_hit'], FILL_FULL, FILL_NONE)
+        result[f'{side}_capacity'] = np.full(n, np.inf)
+        result[f'{side}_fill_time'] = np.zeros(n, dtype=np.int64)
+    result['intrabar'] = np.zeros(n, dtype=bool)
+    min_fill = float(step_size) if step_size is not None else 0.0
+    coverage = store.coverage()
+    if n < 2 or coverage is None:
+        return result
+
+    # The order resting during candle i was placed at the close of candle i-1
+    resting = {
+        'entry': (True, close[:-1] < orders['buy_stop'][:-1], orders['buy_stop'][:-1], orders['buy_limit'][:-1]),
+        'exit': (False, close[:-1] > orders['sell_stop'][:-1], orders['sell_stop'][:-1], orders['sell_stop'][:-1]),
+    }
+    candle_end = step(open_time, interval, 1)
+    covered = np.zeros(n, dtype=bool)
+    covered[1:] = (open_time[1:] >= coverage[0]) & (candle_end[1:] <= coverage[1])
+    indices = np.flatnonzero(covered)
+    if not len(indices):
+        return result
+    sub_time = store.columns()['open_time']
+    sub_start = np.searchsorted(sub_time, open_time[indices])
+    sub_end = np.searchsorted(sub_time, candle_end[indices])
+
+    # Chunks of consecutive covered candles holding at most CHUNK_SUBBARS sub-bars
+    a = 0
+    while a < len(indices):
+        b = a + max(int(np.searchsorted(sub_end[a:], sub_start[a] + CHUNK_SUBBARS, side='right')), 1)
+        chunk = indices[a:b]
+        lo, hi = int(sub_start[a]), int(sub_end[b - 1])
+        bars = {name: np.asarray(column[lo:hi]) for name, column in store.columns().items()}
+        seg_start, seg_end = sub_start[a:b] - lo, sub_end[a:b] - lo
+        # Sub-bars between candles (missing candles) belong to no candle
+        positions = np.arange(hi - lo)
+        owner = np.searchsorted(seg_start, positions, side='right') - 1
+        owner[(owner < 0) | (positions >= seg_end[np.maximum(owner, 0)])] = -1
+        for side, (is_buy, placed, stop, limit) in resting.items():
+            mask = placed[chunk - 1]
+            outcome, price, capacity, fill_time = _stop_limit_fills(
+                is_buy, np.where(mask, stop[chunk - 1], np.nan), np.where(mask, limit[chunk - 1], np.nan),
+                owner, seg_start, seg_end, bars, participation)
+            if quantity is not None:
+                outcome = np.where((outcome == FILL_FULL) & (capacity < quantity), FILL_PARTIAL, outcome)
+            # Reached the limit, but the volume there allows less than one tradable step: nothing filled
+            unfillable = (outcome >= FILL_PARTIAL) & ((capacity < min_fill) | (capacity <= 0))
+            outcome = np.where(unfillable, FILL_MISSED, outcome)
+            capacity = np.where(unfillable, 0.0, capacity)
+            fill_time = np.where(unfillable, 0, fill_time)
+            result[f'{side}_outcome'][chunk] = outcome
+            result[f'{side}_hit'][chunk] = outcome >= FILL_PARTIAL
+            result[f'{side}_price'][chunk] = np.where(outcome >= FILL_PARTIAL, price, orders[f'{side}_price'][chunk])
+            result[f'{side}_capacity'][chunk] = capacity
+            result[f'{side}_fill_time'][chunk] = fill_time
+        result['intrabar'][chunk] = True
+        a = b
+    return result
+
+
+def intrabar_strategy_orders(candles, interval, buy_offset, sell_offset, tick_size, store,
+                             participation=None, quantity=None, step_size=None):
+    """strategy_orders() with fills decided from the sub-bars in `store`"""
+    orders = strategy_orders(candles, buy_offset, sell_offset, tick_size)
+    return apply_intrabar_fills(candles, interval, orders, store, participation, quantity, step_size)
+
+
+def fill_summary(orders):
+    """Counts of trigger/fill outcomes per side over the intrabar candles"""
+    intrabar = orders['intrabar']
+    return {
+        side: {label: int(np.count_nonzero(orders[f'{side}_outcome'][intrabar] == code))
+               for label, code in (('missed', FILL_MISSED), ('partial', FILL_PARTIAL), ('filled', FILL_FULL))}
+        for side in ('entry', 'exit')
+    }
+
+
+# Compare OHLC and intrabar fills from the command line
+if __name__ == "__main__":
+    import sys
+    from datetime import datetime
+    from utils.backtest import run_backtest
+    from utils.config import get_buy_offset, get_sell_offset
+    from utils.symbol_filters import get_symbol_filters
+
+    if len(sys.argv) < 5:
+        log_websocket("Usage: python -m utils.intrabar_fills <symbol> <interval> <start dd-mm-YYYY> <end dd-mm-YYYY> [buy_offset] [sell_offset] [sub-bar] [participation]")
+        log_websocket("Example: python -m utils.intrabar_fills ETHUSDT 15m 01-06-2024 01-07-2024 1 1 1s 0.1")
+        sys.exit(1)
+
+    symbol = sys.argv[1].upper()
+    interval = sys.argv[2]
+    start_ms = int(datetime.strptime(sys.argv[3], '%d-%m-%Y').timestamp() * 1000)
+    end_ms = int(datetime.strptime(sys.argv[4], '%d-%m-%Y').timestamp() * 1000)
+    buy_offset = float(sys.argv[5]) if len(sys.argv) > 5 else get_buy_offset()
+    sell_offset = float(sys.argv[6]) if len(sys.argv) > 6 else get_sell_offset()
+    sub_bar = sys.argv[7] if len(sys.argv) > 7 else '1s'
+    participation = float(sys.argv[8]) if len(sys.argv) > 8 else None
+
+    filters = get_symbol_filters(symbol)
+    candles = load_klines(symbol, interval, start_ms, end_ms)
+    try:
+        subbar_store = SubBarStore(symbol, sub_bar).sync(start_ms, end_ms)
+    except Exception as e:
+        log_error(f"Error syncing {symbol} {sub_bar} sub-bars: {e}", exc_info=True)
+        sys.exit(1)
+    ohlc = run_backtest(candles, buy_offset, sell_offset, filters.tick_size, filters.step_size)
+    intrabar_orders = intrabar_strategy_orders(candles, interval, buy_offset, sell_offset, filters.tick_size,
+                                               subbar_store, participation, step_size=filters.step_size)
+    intrabar = run_backtest(candles, buy_offset, sell_offset, filters.tick_size, filters.step_size, orders=intrabar_orders)
+    log_websocket(f"Sub-bars: {len(subbar_store)} ({sub_bar}), fills: {fill_summary(intrabar_orders)}")
+    for key in ('trades', 'win_rate', 'net_pnl', 'return_pct', 'max_drawdown_pct'):
+        log_websocket(f"{key}: OHLC {ohlc.stats[key]} | intrabar {intrabar.stats[key]}")
@@ -0,0 +1,293 @@
+"""
+Persistent columnar kline store, one directory per (symbol, interval).
+
+Layout: data/klines/<SYMBOL>_<interval>/<column>.bin, raw little-endian arrays
+(int64 open_time, float64 open/high/low/close/volume) sorted by open time, plus
+meta.json with the ranges the exchange returned no candles for. Columns are read
+zero-copy through np.memmap.
+
+Only closed candles are stored. `sync` appends everything after the last
+stored candle and backfills holes inside the requested range, so history is
+downloaded once and later reads (HA seeding, backtests, sweeps) hit the disk.
+"""
+import json
+import os
+import numpy as np
+from utils.interval_calendar import align, step
+from utils.logger import log_websocket, log_error
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, single writer assumed
+    fcntl = None
+
+KLINE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'klines')
+KLINE_COLUMNS = (('open_time', np.int64), ('open', np.float64), ('high', np.float64),
+                 ('low', np.float64), ('close', np.float64), ('volume', np.float64))
+KLINES_PAGE_LIMIT = 1500  # Maximum klines per futures_klines request
+
+
+def klines_to_arrays(klines):
+    """
+    Convert Binance kline rows into column arrays
+
+    Returns:
+        dict with int64 'open_time' and float64 'open', 'high', 'low', 'close', 'volume'
+    """
+    if not klines:
+        return {name: np.empty(0, dtype=dtype) for name, dtype in KLINE_COLUMNS}
+    values = np.array([row[1:6] for row in klines], dtype=np.float64)
+    return {
+        'open_time': np.array([row[0] for row in klines], dtype=np.int64),
+        'open': values[:, 0],
+        'high': values[:, 1],
+        'low': values[:, 2],
+        'close': values[:, 3],
+        'volume': values[:, 4],
+    }
+
+
+def fetch_klines(client, symbol, interval, start_ms, end_ms):
+    """Download futures klines with start_ms <= open_time < end_ms as column arrays (one ranged request per 1500)"""
+    rows = []
+    cursor = align(int(start_ms), interval)
+    while cursor < end_ms:
+        page = client.futures_klines(symbol=symbol, interval=interval, startTime=int(cursor),
+                                     endTime=int(end_ms) - 1, limit=KLINES_PAGE_LIMIT)
+        if not page:
+            break
+        rows.extend(page)
+        cursor = step(int(page[-1][0]), interval, 1)
+        if len(page) < KLINES_PAGE_LIMIT:
+            break
+    return klines_to_arrays([row for row in rows if start_ms <= row[0] < end_ms])
+
+
+class KlineStore:
+    """
+    On-disk klines of one symbol and interval
+
+    Args:
+        symbol (str): Trading pair symbol
+        interval (str): Kline interval
+        directory (str): Root directory of the store
+    """
+
+    def __init__(self, symbol, interval, directory=KLINE_DIR):
+        self.symbol = symbol.upper()
+        self.interval = interval
+        self.path = os.path.join(directory, f"{self.symbol}_{interval}")
+        self._columns = None
+        self._rows = -1  # Row count the cached memmaps were opened with
+
+    def _column_path(self, name):
+        return os.path.join(self.path, f"{name}.bin")
+
+    def _meta_path(self):
+        return os.path.join(self.path, 'meta.json')
+
+    def _row_count(self):
+        sizes = []
+        for name, dtype in KLINE_COLUMNS:
+            path = self._column_path(name)
+            sizes.append(os.path.getsize(path) // np.dtype(dtype).itemsize if os.path.exists(path) else 0)
+        # A crash between column writes leaves some columns longer; only complete rows count
+        return min(sizes)
+
+    def columns(self):
+        """Column name -> read-only memmap of the whole store (reopened if another process appended)"""
+        rows = self._row_count()
+        if self._columns is None or rows != self._rows:
+            self._columns = {
+                name: np.memmap(self._column_path(name), dtype=dtype, mode='r', shape=(rows,)) if rows
+                else np.empty(0, dtype=dtype)
+                for name, dtype in KLINE_COLUMNS
+            }
+            self._rows = rows
+        return self._columns
+
+    def __len__(self):
+        return len(self.columns()['open_time'])
+
+    def first_open_time(self):
+        open_time = self.columns()['open_time']
+        return int(open_time[0]) if len(open_time) else None
+
+    def last_open_time(self):
+        open_time = self.columns()['open_time']
+        return int(open_time[-1]) if len(open_time) else None
+
+    def arrays(self, start_ms=None, end_ms=None):
+        """Zero-copy column views of the candles with start_ms <= open_time < end_ms"""
+        columns = self.columns()
+        open_time = columns['open_time']
+        lo = int(np.searchsorted(open_time, start_ms)) if start_ms is not None else 0
+        hi = int(np.searchsorted(open_time, end_ms)) if end_ms is not None else len(open_time)
+        return {name: column[lo:hi] for name, column in columns.items()}
+
+    def rows(self, start_ms=None, end_ms=None):
+        """Candles in the Binance kline row layout (trade count and taker volumes are not stored)"""
+        arrays = self.arrays(start_ms, end_ms)
+        close_times = step(arrays['open_time'], self.interval, 1) - 1
+        return [[t, str(o), str(h), str(l), str(c), str(v), ct, '0', 0, '0', '0', '0']
+                for t, o, h, l, c, v, ct in zip(arrays['open_time'].tolist(), arrays['open'].tolist(),
+                                                 arrays['high'].tolist(), arrays['low'].tolist(),
+                                                 arrays['close'].tolist(), arrays['volume'].tolist(),
+                                                 close_times.tolist())]
+
+    def _load_meta(self):
+        try:
+            with open(self._meta_path(), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {'empty': []}
+
+    def _save_meta(self, meta):
+        tmp_path = self._meta_path() + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._meta_path())
+
+    def _lock(self):
+        os.makedirs(self.path, exist_ok=True)
+        lock_file = open(os.path.join(self.path, '.lock'), 'w')
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def write(self, bars):
+        """
+        Store candles (column arrays sorted by open_time)
+
+        Candles after the last stored one are appended in place; candles inside the
+        stored range (gap fills) are merged and the columns are rewritten atomically.
+        """
+        if not len(bars['open_time']):
+            return
+        with self._lock():
+            stored = self.columns()
+            rows = len(stored['open_time'])
+            if not rows or bars['open_time'][0] > stored['open_time'][-1]:
+                self._columns = None  # Drop the memmaps before writing
+                for name, dtype in KLINE_COLUMNS:
+                    path = self._column_path(name)
+                    with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+                        f.truncate(rows * np.dtype(dtype).itemsize)  # Drop a torn row from an interrupted append
+                        f.seek(0, os.SEEK_END)
+                        np.ascontiguousarray(bars[name], dtype=dtype).tofile(f)
+                return
+            open_time = np.concatenate((bars['open_time'], stored['open_time']))
+            # Stable sort with the new candles first, then keep the first of every open time
+            order = np.argsort(open_time, kind='stable')
+            keep = order[np.r_[True, open_time[order][1:] != open_time[order][:-1]]]
+            merged = {name: np.concatenate((np.asarray(bars[name], dtype=dtype), stored[name]))[keep]
+                      for name, dtype in KLINE_COLUMNS}
+            self._columns = None
+            for name, _ in KLINE_COLUMNS:
+                merged[name].tofile(self._column_path(name) + '.tmp')
+            for name, _ in KLINE_COLUMNS:
+                os.replace(self._column_path(name) + '.tmp', self._column_path(name))
+
+    def gaps(self, start_ms, end_ms):
+        """
+        Missing candle ranges [from_open, to_open) within [start_ms, end_ms)
+
+        Ranges the exchange already returned nothing for (maintenance, pre-listing) are excluded.
+        """
+        start_ms = align(int(start_ms), self.interval)
+        open_time = np.asarray(self.arrays(start_ms, end_ms)['open_time'])
+        if not len(open_time):
+            holes = [(start_ms, int(end_ms))] if start_ms < end_ms else []
+        else:
+            expected_next = step(open_time[:-1], self.interval, 1)
+            breaks = np.flatnonzero(open_time[1:] != expected_next)
+            holes = [(int(expected_next[i]), int(open_time[i + 1])) for i in breaks]
+            if open_time[0] > start_ms:
+                holes.insert(0, (start_ms, int(open_time[0])))
+            last_next = int(step(open_time[-1], self.interval, 1))
+            if last_next < end_ms:
+                holes.append((last_next, int(end_ms)))
+        empty = self._load_meta()['empty']
+        return [(lo, hi) for lo, hi in holes
+                if not any(e_lo <= lo and hi <= e_hi for e_lo, e_hi in empty)]
+
+    def sync(self, start_ms, end_ms=None, client=None):
+        """
+        Make the store complete over [start_ms, end_ms), fetching only what is missing
+
+        Args:
+            start_ms (int): Oldest open time needed
+            end_ms (int, optional): End of the range; capped at the open time of the current
+                (unclosed) candle on the exchange clock
+            client: python-binance client (created on demand)
+
+        Returns:
+            self
+        """
+        from utils.time_sync import server_now_ms
+        current_open = align(server_now_ms(), self.interval)
+        end_ms = current_open if end_ms is None else min(int(end_ms), current_open)
+        holes = self.gaps(start_ms, end_ms)
+        if not holes:
+            return self
+        if client is None:
+            from utils.historical_handler import setup_binance_client
+            client = setup_binance_client()
+        meta = self._load_meta()
+        # The latest closed candles can lag on REST; never remember them as empty
+        settled = int(step(current_open, self.interval, -2))
+        for lo, hi in holes:
+            bars = fetch_klines(client, self.symbol, self.interval, lo, hi)
+            self.write(bars)
+            fetched = np.asarray(bars['open_time'])
+            # Parts of the hole the exchange has no candles for: before, between and after the fetched ones
+            if not len(fetched):
+                missing = [(lo, hi)]
+            else:
+                expected_next = step(fetched, self.interval, 1)
+                breaks = np.flatnonzero(fetched[1:] != expected_next[:-1])
+                missing = ([(lo, int(fetched[0]))]
+                           + [(int(expected_next[i]), int(fetched[i + 1])) for i in breaks]
+                           + [(int(expected_next[-1]), hi)])
+            meta['empty'].extend([a, b] for a, b in missing if a < b <= settled)
+        if len(meta['empty']) != len(self._load_meta()['empty']):
+            self._save_meta(meta)
+        log_websocket(f"💾 Synced {self.symbol} {self.interval} klines: {len(holes)} range(s) fetched, {len(self)} stored")
+        return self
+
+
+def load_klines(symbol, interval, start_ms, end_ms, client=None, directory=KLINE_DIR):
+    """
+    Closed klines for [start_ms, end_ms) as column arrays, read from the store after syncing it
+
+    Falls back to a direct download if the store cannot be used (e.g. read-only disk).
+    """
+    try:
+        store = KlineStore(symbol, interval, directory).sync(start_ms, end_ms, client=client)
+        return store.arrays(align(int(start_ms), interval), end_ms)
+    except OSError as e:
+        log_error(f"Kline store unavailable for {symbol} {interval} ({e}); downloading directly")
+        if client is None:
+            from utils.historical_handler import setup_binance_client
+            client = setup_binance_client()
+        return fetch_klines(client, symbol, interval, start_ms, end_ms)
+
+
+# Sync a store from the command line
+if __name__ == "__main__":
+    import sys
+    from datetime import datetime
+
+    if len(sys.argv) < 4:
+        log_websocket("Usage: python -m utils.kline_store <symbol> <interval> <start dd-mm-YYYY> [end dd-mm-YYYY]")
+        log_websocket("Example: python -m utils.kline_store ETHUSDT 1m 01-01-2024")
+        sys.exit(1)
+
+    sync_symbol = sys.argv[1].upper()
+    sync_interval = sys.argv[2]
+    sync_start = int(datetime.strptime(sys.argv[3], '%d-%m-%Y').timestamp() * 1000)
+    sync_end = int(datetime.strptime(sys.argv[4], '%d-%m-%Y').timestamp() * 1000) if len(sys.argv) > 4 else None
+    kline_store = KlineStore(sync_symbol, sync_interval).sync(sync_start, sync_end)
+    log_websocket(f"{sync_symbol} {sync_interval}: {len(kline_store)} candles, "
+                  f"{kline_store.first_open_time()} .. {kline_store.last_open_time()}, "
+                  f"{len(kline_store.gaps(sync_start, sync_end or step(kline_store.last_open_time(), sync_interval, 1)))} gap(s) left")
@@ -0,0 +1,340 @@
+"""
+Candle-to-order latency tracing.
+
+Every closed candle the websocket delivers gets a trace of monotonic timestamps:
+frame received, JSON decoded, Heikin Ashi computed, each REST call made while
+processing it (endpoint, duration and request weight) and the first order ack.
+Stage durations are aggregated into HDR-style log-linear histograms and summarised
+in the websocket log every LATENCY_SUMMARY_EVERY candles. The bot publishes the
+snapshot on its metrics socket (utils/metrics.py), and the API reads it from there
+for /metrics/latency, so nothing is written to disk per candle. Every REST call also
+feeds the binance_rest_* metrics.
+
+Stages (milliseconds):
+    exchange       kline close time (T) -> exchange event time (E), exchange clock
+    network        event time -> frame received, by the synced server clock
+    decode         frame received -> JSON decoded
+    ha             decoded -> Heikin Ashi of the live candle computed
+    order_ack      frame received -> first order placement acknowledged
+    total          frame received -> candle fully processed
+    rest <endpoint> one REST call made on the candle's critical path
+"""
+import contextvars
+import os
+import threading
+import time
+from urllib.parse import urlparse
+from utils.config import LATENCY_TRACE, LATENCY_SUMMARY_EVERY
+from utils.logger import log_websocket, log_verbose
+from utils import metrics
+from utils.rate_limiter import scheduler as weight_scheduler
+
+HISTOGRAM_SIGNIFICANT_BITS = 5  # Bucket width is at most 1/16 of its value (~3% precision)
+HISTOGRAM_MAX_US = 3600 * 1000000  # Values above one hour are clamped
+SUMMARY_PERCENTILES = (50, 90, 99, 99.9)
+LAST_TRACES = 5  # Most recent traces kept in the snapshot
+
+REST_DURATION = metrics.histogram('binance_rest_request_duration_seconds', 'Binance REST request latency', ('endpoint',))
+REST_REQUESTS = metrics.counter('binance_rest_requests_total', 'Binance REST requests by HTTP status', ('endpoint', 'status'))
+REST_WEIGHT = metrics.counter('binance_rest_request_weight_total', 'Request weight consumed (from X-MBX-USED-WEIGHT-1M)', ('endpoint',))
+REST_USED_WEIGHT = metrics.gauge('binance_used_weight_1m', 'Request weight used in the current exchange minute')
+
+# Trace of the candle being processed; asyncio.to_thread copies it, background threads don't see it
+_active_trace = contextvars.ContextVar('latency_trace', default=None)
+
+
+class LatencyHistogram:
+    """
+    Log-linear histogram of durations in microseconds (HDR histogram layout)
+
+    Values below 2**HISTOGRAM_SIGNIFICANT_BITS get their own bucket; above that every
+    power of two is split into 2**(HISTOGRAM_SIGNIFICANT_BITS - 1) equal buckets, so
+    recording is O(1), memory is fixed and percentiles keep a bounded relative error.
+    """
+
+    def __init__(self):
+        self.sub_buckets = 1 << (HISTOGRAM_SIGNIFICANT_BITS - 1)
+        self.counts = [0] * (self._index(HISTOGRAM_MAX_US) + 1)
+        self.total = 0
+        self.sum_us = 0
+        self.min_us = None
+        self.max_us = 0
+
+    def _index(self, value):
+        shift = value.bit_length() - HISTOGRAM_SIGNIFICANT_BITS
+        if shift <= 0:
+            return value
+        return shift * self.sub_buckets + (value >> shift)
+
+    def _highest_in_bucket(self, index):
+        if index < 2 * self.sub_buckets:
+            return index
+        shift = index // self.sub_buckets - 1
+        return ((index - shift * self.sub_buckets + 1) << shift) - 1
+
+    def record(self, value_us):
+        value = min(max(int(value_us), 0), HISTOGRAM_MAX_US)
+        self.counts[self._index(value)] += 1
+        self.total += 1
+        self.sum_us += value
+        self.min_us = value if self.min_us is None else min(self.min_us, value)
+        self.max_us = max(self.max_us, value)
+
+    def percentile(self, percent):
+        """Highest value equivalent to the given percentile (µs), like HdrHistogram"""
+        if not self.total:
+            return None
+        rank = max(1, int(-(-self.total * percent // 100)))  # ceil
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self._highest_in_bucket(index), self.max_us)
+        return self.max_us
+
+    def summary(self):
+        """Count, min/mean/max and percentiles in milliseconds"""
+        if not self.total:
+            return {'count': 0}
+        summary = {
+            'count': self.total,
+            'min_ms': self.min_us / 1000,
+            'mean_ms': round(self.sum_us / self.total / 1000, 3),
+            'max_ms': self.max_us / 1000,
+            'total_ms': self.sum_us / 1000,
+        }
+        for percent in SUMMARY_PERCENTILES:
+            summary[f"p{percent:g}_ms"] = self.percentile(percent) / 1000
+        return summary
+
+
+class CandleTrace:
+    """Monotonic timestamps (ns) of one closed candle on its way from the socket to the order ack"""
+
+    __slots__ = ('open_time', 'close_time', 'event_time', 'received_ns', 'received_server_ms', 'marks', 'rest')
+
+    def __init__(self, kline, received_ns, received_server_ms=None, event_time=None):
+        self.open_time = int(kline.get('t', 0))
+        self.close_time = int(kline['T']) if kline.get('T') is not None else None
+        self.event_time = int(event_time) if event_time is not None else None
+        self.received_ns = received_ns
+        self.received_server_ms = received_server_ms
+        self.marks = {}  # stage -> monotonic ns
+        self.rest = []  # (endpoint, duration ns, weight or None)
+
+    def mark(self, stage, first=False):
+        if first and stage in self.marks:
+            return
+        self.marks[stage] = time.monotonic_ns()
+
+    def stages_ms(self, finished_ns):
+        """Stage durations of this trace in milliseconds"""
+        stages = {}
+        if self.event_time is not None and self.close_time is not None:
+            stages['exchange'] = max(self.event_time - self.close_time, 0)
+        if self.received_server_ms is not None:
+            published = self.event_time if self.event_time is not None else self.close_time
+            if published is not None:
+                stages['network'] = max(self.received_server_ms - published, 0)
+        decoded = self.marks.get('decode', self.received_ns)
+        stages['decode'] = (decoded - self.received_ns) / 1e6
+        if 'ha' in self.marks:
+            stages['ha'] = (self.marks['ha'] - decoded) / 1e6
+        if 'order_ack' in self.marks:
+            stages['order_ack'] = (self.marks['order_ack'] - self.received_ns) / 1e6
+        stages['total'] = (finished_ns - self.received_ns) / 1e6
+        return stages
+
+
+class LatencyRecorder:
+    """Cumulative and rolling-window histograms per stage and REST endpoint"""
+
+    def __init__(self, summary_every=LATENCY_SUMMARY_EVERY):
+        self.summary_every = summary_every
+        self.stages = {}
+        self.window = {}
+        self.last_window = {}
+        self.endpoints = {}  # endpoint -> {'calls', 'critical_calls', 'critical_ns', 'weight', 'used_weight_1m'}
+        self.traces = 0
+        self.last_traces = []
+        self._weight_minute = None
+        self._used_weight = 0
+        self._lock = threading.Lock()  # REST calls are also made from background threads (time sync)
+
+    def _record(self, name, value_ms):
+        for histograms in (self.stages, self.window):
+            histogram = histograms.get(name)
+            if histogram is None:
+                histogram = histograms[name] = LatencyHistogram()
+            histogram.record(value_ms * 1000)
+
+    def _request_weight(self, used_weight, server_minute):
+        """Weight of one request from consecutive X-MBX-USED-WEIGHT-1M headers"""
+        if used_weight is None:
+            return None
+        if server_minute == self._weight_minute and used_weight >= self._used_weight:
+            weight = used_weight - self._used_weight
+        else:
+            weight = used_weight  # First request of a new rate limit minute
+        self._weight_minute = server_minute
+        self._used_weight = used_weight
+        return weight
+
+    def record_rest(self, endpoint, duration_ns, used_weight=None, server_minute=None, trace=None):
+        with self._lock:
+            return self._record_rest(endpoint, duration_ns, used_weight, server_minute, trace)
+
+    def _record_rest(self, endpoint, duration_ns, used_weight, server_minute, trace):
+        weight = self._request_weight(used_weight, server_minute)
+        stats = self.endpoints.setdefault(endpoint, {'calls': 0, 'critical_calls': 0, 'critical_ns': 0,
+                                                     'weight': 0, 'used_weight_1m': None})
+        stats['calls'] += 1
+        stats['weight'] += weight or 0
+        if used_weight is not None:
+            stats['used_weight_1m'] = used_weight
+        self._record(f"rest {endpoint}", duration_ns / 1e6)
+        if trace is not None:
+            stats['critical_calls'] += 1
+            stats['critical_ns'] += duration_ns
+            trace.rest.append((endpoint, duration_ns, weight))
+        return weight
+
+    def record_trace(self, trace, finished_ns):
+        with self._lock:
+            self._record_trace(trace, finished_ns)
+
+    def _record_trace(self, trace, finished_ns):
+        stages = trace.stages_ms(finished_ns)
+        for stage, value in stages.items():
+            self._record(stage, value)
+        self.traces += 1
+        rest = [{'endpoint': endpoint, 'ms': duration / 1e6, 'weight': weight} for endpoint, duration, weight in trace.rest]
+        self.last_traces = (self.last_traces + [{'open_time': trace.open_time, 'stages_ms': stages, 'rest': rest}])[-LAST_TRACES:]
+        log_verbose("[LATENCY] Candle %s: %s, REST %s", trace.open_time, stages, rest)
+        if self.summary_every > 0 and self.traces % self.summary_every == 0:
+            log_websocket(self.format_summary(self.window))
+            self.last_window = self.window
+            self.window = {}
+
+    def critical_path(self):
+        """REST endpoints by the time they added to candle processing, slowest first"""
+        ranked = sorted(self.endpoints.items(), key=lambda item: item[1]['critical_ns'], reverse=True)
+        return [{'endpoint': endpoint, 'calls': stats['critical_calls'],
+                 'total_ms': stats['critical_ns'] / 1e6,
+                 'mean_ms': round(stats['critical_ns'] / stats['critical_calls'] / 1e6, 3)}
+                for endpoint, stats in ranked if stats['critical_calls']]
+
+    def format_summary(self, histograms):
+        parts = []
+        for name in ('network', 'decode', 'ha', 'order_ack', 'total'):
+            histogram = histograms.get(name)
+            if histogram is not None and histogram.total:
+                parts.append(f"{name} p50={histogram.percentile(50) / 1000:.1f} "
+                             f"p99={histogram.percentile(99) / 1000:.1f} max={histogram.max_us / 1000:.1f}")
+        rest = [(name[5:], histogram) for name, histogram in histograms.items() if name.startswith('rest ')]
+        if rest:
+            endpoint, histogram = max(rest, key=lambda item: item[1].sum_us)
+            parts.append(f"slowest REST {endpoint} x{histogram.total} p99={histogram.percentile(99) / 1000:.1f}")
+        return f"⏱️ Latency over last {self.summary_every} candles (ms): " + " | ".join(parts)
+
+    def snapshot(self):
+        return {
+            'updated_at': int(time.time() * 1000),
+            'pid': os.getpid(),
+            'candles': self.traces,
+            'stages': {name: histogram.summary() for name, histogram in self.stages.items()},
+            'window': {name: histogram.summary() for name, histogram in self.last_window.items()},
+            'endpoints': {endpoint: dict(stats) for endpoint, stats in self.endpoints.items()},
+            'critical_path': self.critical_path(),
+            'last_traces': self.last_traces,
+        }
+
+    def published_snapshot(self):
+        """Snapshot served on the metrics socket, None before the first traced candle"""
+        with self._lock:
+            return self.snapshot() if self.traces else None
+
+
+recorder = LatencyRecorder()
+metrics.publish('latency', recorder.published_snapshot)
+
+
+def begin_trace(kline, received_ns, event_time=None):
+    """Start the trace of a closed candle whose frame arrived at `received_ns` (time.monotonic_ns)"""
+    if not LATENCY_TRACE:
+        return None
+    try:
+        from utils.time_sync import server_now_ms
+        received_server_ms = server_now_ms() - (time.monotonic_ns() - received_ns) // 1000000
+    except Exception:
+        received_server_ms = None
+    trace = CandleTrace(kline, received_ns, received_server_ms, event_time)
+    _active_trace.set(trace)
+    return trace
+
+
+def mark(stage, first=False):
+    """Stamp a stage on the active candle trace (no-op outside one)"""
+    trace = _active_trace.get()
+    if trace is not None:
+        trace.mark(stage, first)
+
+
+def end_trace():
+    """Finish the active trace; candles that never reached the strategy (duplicates, skips) are dropped"""
+    trace = _active_trace.get()
+    if trace is None:
+        return
+    _active_trace.set(None)
+    if 'ha' in trace.marks:
+        recorder.record_trace(trace, time.monotonic_ns())
+
+
+def record_rest_call(method, uri, duration_ns, response=None, succeeded=True):
+    """Account one REST call; calls made while a candle is processed count towards its critical path"""
+    endpoint = f"{method.upper()} {urlparse(uri).path}"
+    trace = _active_trace.get()
+    used_weight = server_minute = None
+    if response is not None:
+        headers = getattr(response, 'headers', {}) or {}
+        weight_header = headers.get('X-MBX-USED-WEIGHT-1M') or headers.get('x-mbx-used-weight-1m')
+        if weight_header is not None:
+            from utils.time_sync import server_now_ms
+            used_weight = int(weight_header)
+            server_minute = server_now_ms() // 60000  # The weight limit resets every exchange minute
+    if trace is not None and succeeded and method.upper() == 'POST' and endpoint.endswith(('/order', '/batchOrders')):
+        trace.mark('order_ack', first=True)
+    weight = recorder.record_rest(endpoint, duration_ns, used_weight, server_minute, trace)
+    REST_DURATION.labels(endpoint=endpoint).observe(duration_ns / 1e9)
+    REST_REQUESTS.labels(endpoint=endpoint, status=getattr(response, 'status_code', None) or 'error').inc()
+    if weight:
+        REST_WEIGHT.labels(endpoint=endpoint).inc(weight)
+    if used_weight is not None:
+        REST_USED_WEIGHT.set(used_weight)
+        weight_scheduler.observe(used_weight, server_minute)
+
+
+def instrument_client(client):
+    """Time every request of a python-binance client (endpoint, duration, X-MBX-USED-WEIGHT-1M)"""
+    request = client._request
+
+    def timed_request(method, uri, signed, force_params=False, **kwargs):
+        previous_response = getattr(client, 'response', None)
+        started = time.monotonic_ns()
+        succeeded = False
+        try:
+            result = request(method, uri, signed, force_params, **kwargs)
+            succeeded = True
+            return result
+        finally:
+            response = getattr(client, 'response', None)
+            record_rest_call(method, uri, time.monotonic_ns() - started,
+                             response if response is not previous_response else None, succeeded)
+
+    client._request = timed_request
+    return client
+
+
+def load_latency_metrics():
+    """Current snapshot of the bot process, or None if it is not running or has traced nothing"""
+    return metrics.fetch_bot_document('latency')
@@ -1,8 +1,11 @@
+import atexit
 import logging
+import multiprocessing.util
 import os
+import queue
 import sys
 import re
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 # Create logs directory if it doesn't exist
 logs_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'logs')
@@ -17,23 +20,75 @@ RESET = '\033[0m'    # Reset color
 # Pattern to remove ANSI color codes
 ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
 
+# Verbose records (order dumps) sit between DEBUG and INFO and are sampled
+VERBOSE = 15
+logging.addLevelName(VERBOSE, 'VERBOSE')
+# Keep 1 of every N verbose records per message template (1 = all, 0 = none)
+VERBOSE_SAMPLE_EVERY = int(os.getenv('LOG_VERBOSE_SAMPLE_EVERY', '10'))
+
 # Custom formatter to strip ANSI codes for log files
 class ANSIStrippingFormatter(logging.Formatter):
     def format(self, record):
-        if isinstance(record.msg, str):
-            record.msg = ansi_escape.sub('', record.msg)
-        return super().format(record)
+        # Strip the formatted line, not record.msg: the same record also reaches the colored console
+        text = super().format(record)
+        return ansi_escape.sub('', text) if '\x1b' in text else text
+
+
+class LazyQueueHandler(QueueHandler):
+    """Enqueues records as they are; `msg % args` is only rendered by the writer thread"""
+
+    def prepare(self, record):
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """Passes every non-VERBOSE record and one of every `every` VERBOSE records per message template"""
+
+    def __init__(self, every=VERBOSE_SAMPLE_EVERY):
+        super().__init__()
+        self.every = every
+        self.counts = {}
+
+    def filter(self, record):
+        if record.levelno != VERBOSE:
+            return True
+        if self.every <= 0:
+            return False
+        count = self.counts.get(record.msg, 0)
+        self.counts[record.msg] = count + 1
+        return count % self.every == 0
+
+
+class SinkRouter(logging.Handler):
+    """Writer-thread side of the queue: hands each record to the sinks of the logger that produced it"""
+
+    def __init__(self, routes, default):
+        super().__init__()
+        self.routes = routes
+        self.default = default
+
+    def handle(self, record):
+        # Render `msg % args` once here rather than once per sink
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        for handler in self.routes.get(record.name, self.default):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def emit(self, record):
+        self.handle(record)
+
 
 # Configure the root logger
 root_logger = logging.getLogger()
 root_logger.setLevel(logging.INFO)
 
-# Console handler for regular output
+# Console handler for regular output (colors kept)
 console_handler = logging.StreamHandler(sys.stdout)
 console_handler.setLevel(logging.INFO)
 console_formatter = logging.Formatter('%(message)s')
 console_handler.setFormatter(console_formatter)
-root_logger.addHandler(console_handler)
 
 # Error log file handler
 error_handler = RotatingFileHandler(
@@ -44,11 +99,10 @@ error_handler = RotatingFileHandler(
 error_handler.setLevel(logging.ERROR)
 error_formatter = ANSIStrippingFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 error_handler.setFormatter(error_formatter)
-root_logger.addHandler(error_handler)
 
 # WebSocket log file handler
 websocket_logger = logging.getLogger('websocket')
-websocket_logger.setLevel(logging.INFO)
+websocket_logger.setLevel(VERBOSE)
 websocket_handler = RotatingFileHandler(
     os.path.join(logs_dir, 'websocket.log'),
     maxBytes=10*1024*1024,  # 10MB
@@ -56,7 +110,6 @@ websocket_handler = RotatingFileHandler(
 )
 websocket_formatter = ANSIStrippingFormatter('%(message)s')
 websocket_handler.setFormatter(websocket_formatter)
-websocket_logger.addHandler(websocket_handler)
 
 # API log file handler
 api_logger = logging.getLogger('api')
@@ -68,7 +121,22 @@ api_handler = RotatingFileHandler(
 )
 api_formatter = ANSIStrippingFormatter('%(asctime)s - %(levelname)s - %(message)s')
 api_handler.setFormatter(api_formatter)
-api_logger.addHandler(api_handler)
+
+# All loggers only enqueue; one background thread formats and writes to the sinks,
+# so callers (the event loop included) never block on disk or terminal I/O
+log_queue = queue.SimpleQueue()
+queue_handler = LazyQueueHandler(log_queue)
+queue_handler.addFilter(SamplingFilter())
+root_logger.addHandler(queue_handler)
+websocket_logger.addHandler(queue_handler)
+api_logger.addHandler(queue_handler)
+log_listener = QueueListener(log_queue, SinkRouter(
+    routes={
+        'websocket': [websocket_handler, console_handler],  # File plus the console echo
+        'api': [api_handler],
+    },
+    default=[console_handler, error_handler],
+))
 
 # This ensures websocket logger doesn't propagate to root logger
 websocket_logger.propagate = False
@@ -77,20 +145,81 @@ websocket_logger.propagate = False
 api_logger.propagate = False
 
 
+def start_logging():
+    """Start the background log writer (idempotent)"""
+    if log_listener._thread is None:
+        log_listener.start()
+
+
+def stop_logging():
+    """Write out everything still queued and stop the writer thread"""
+    if log_listener._thread is not None:
+        log_listener.stop()
+
+
+SINK_HANDLERS = (console_handler, error_handler, websocket_handler, api_handler)
+
+
+def _hold_sinks_for_fork():
+    # Wait until the writer thread is between records, so no stream is mid-write when forking
+    for handler in SINK_HANDLERS:
+        handler.acquire()
+        handler.flush()  # Otherwise buffered output would be written again by the child
+
+
+def _release_sinks_after_fork():
+    for handler in reversed(SINK_HANDLERS):
+        handler.release()
+
+
+def _restart_logging_in_child():
+    # A forked child inherits the listener object but not its thread
+    # (the sink locks were already re-initialised by logging's own fork hook).
+    # Records still queued belong to the parent, which writes them itself
+    child_queue = queue.SimpleQueue()
+    queue_handler.queue = child_queue
+    log_listener.queue = child_queue
+    log_listener._thread = None
+    start_logging()
+
+
+def _drain_logging_at_process_exit(_listener):
+    # multiprocessing children leave through os._exit, so atexit never runs in them.
+    # Finalizers do, but the registry is cleared after the fork hooks, hence registering here
+    multiprocessing.util.Finalize(None, stop_logging, exitpriority=10)
+
+
+start_logging()
+atexit.register(stop_logging)
+multiprocessing.util.register_after_fork(log_listener, _drain_logging_at_process_exit)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(before=_hold_sinks_for_fork, after_in_parent=_release_sinks_after_fork,
+                        after_in_child=_restart_logging_in_child)
+
+
 def strip_ansi_codes(text):
     """Remove ANSI color codes from a string"""
     return ansi_escape.sub('', text)
 
 
-def log_websocket(message):
+def log_websocket(message, *args):
     """
     Log a message to the websocket log file.
     This captures all terminal output from websocket operations.
     ANSI color codes will be displayed in the console but stripped in the log file.
+    With `args`, `message % args` is formatted lazily by the writer thread.
+    """
+    websocket_logger.info(message, *args)
+
+
+def log_verbose(message, *args):
+    """
+    Log a verbose message (e.g. a full order dump) to the websocket log, sampled.
+
+    Only one of every LOG_VERBOSE_SAMPLE_EVERY records per message template is kept, and
+    the arguments are only converted to text for the records that are kept.
     """
-    websocket_logger.info(message)
-    # Also print to console
-    print(message)
+    websocket_logger.log(VERBOSE, message, *args)
 
 
 def log_error(message, exc_info=None):
@@ -101,11 +230,11 @@ def log_error(message, exc_info=None):
     root_logger.error(message, exc_info=exc_info)
 
 
-def log_api(message):
+def log_api(message, *args):
     """
     Log a message to the API log file.
     """
-    api_logger.info(message)
+    api_logger.info(message, *args)
 
 
 def get_websocket_logger():
@@ -0,0 +1,94 @@
+"""
+In-memory market and account state shared across the bot process.
+
+Holds the live price cache (fed by the kline websocket) and a mirror of the
+account (positions, balance and leverage) updated from REST responses the bot
+already receives, so hot-path checks never need an extra request.
+"""
+import time
+
+# Live price cache: symbol -> (price, exchange event time ms, local receive time s)
+last_prices = {}
+
+# Account mirror
+positions = {}  # (symbol, position_side) -> position amount
+available_balances = {}  # asset -> available balance
+leverages = {}  # symbol -> leverage
+account_updated_at = None  # Local time of the last mirror update
+
+
+def update_last_price(symbol, price, event_time=None):
+    """Record the latest traded/close price for a symbol"""
+    last_prices[symbol.upper()] = (float(price), event_time, time.time())
+
+
+def get_last_price(symbol, max_age=None):
+    """
+    Get the latest cached price for a symbol
+
+    Args:
+        symbol (str): Trading pair symbol
+        max_age (float, optional): Maximum age in seconds; older prices are ignored
+
+    Returns:
+        float or None if no (fresh enough) price is cached
+    """
+    entry = last_prices.get(symbol.upper())
+    if entry is None:
+        return None
+    if max_age is not None and time.time() - entry[2] > max_age:
+        return None
+    return entry[0]
+
+
+def update_positions(symbol, position_information):
+    """Mirror the result of futures_position_information for a symbol"""
+    global account_updated_at
+    symbol = symbol.upper()
+    for pos in position_information:
+        if pos.get('symbol') == symbol:
+            positions[(symbol, pos.get('positionSide', 'BOTH'))] = float(pos.get('positionAmt', 0))
+            if 'leverage' in pos:
+                leverages[symbol] = int(pos['leverage'])
+    account_updated_at = time.time()
+
+
+def set_position_amount(symbol, position_side, amount):
+    """Set a mirrored position amount after a fill the bot observed itself"""
+    global account_updated_at
+    positions[(symbol.upper(), position_side)] = float(amount)
+    account_updated_at = time.time()
+
+
+def get_position_amount(symbol, position_side='LONG'):
+    """Get the mirrored position amount, or None if unknown"""
+    return positions.get((symbol.upper(), position_side))
+
+
+def update_available_balance(asset, balance):
+    global account_updated_at
+    available_balances[asset] = float(balance)
+    account_updated_at = time.time()
+
+
+def get_available_balance(asset='USDT'):
+    return available_balances.get(asset)
+
+
+def update_leverage(symbol, leverage):
+    leverages[symbol.upper()] = int(leverage)
+
+
+def get_leverage(symbol):
+    return leverages.get(symbol.upper())
+
+
+def reset_market_state():
+    """Clear all cached market and account state"""
+    global account_updated_at
+    last_prices.clear()
+    positions.clear()
+    available_balances.clear()
+    leverages.clear()
+    account_updated_at = None
+    return True
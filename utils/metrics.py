@@ -0,0 +1,396 @@
+"""
+Prometheus-style metrics shared by the bot, API and Telegram services.
+
+Each process keeps its own registry of counters, gauges and histograms. The API
+process serves /metrics in the Prometheus text format and merges in:
+
+    bot        the websocket subprocess, pulled on every scrape over a local socket
+               (data/bot_metrics.sock, or 127.0.0.1:BOT_METRICS_PORT without AF_UNIX),
+               which also serves other documents the bot publishes (latency traces)
+    telegram   the Telegram service, which pushes its samples to POST /metrics/push
+
+Every sample gets a `service` label naming the process it came from. Only the
+standard library is used so the Telegram container can import this module as is.
+"""
+import json
+import os
+import socket
+import threading
+import time
+
+BOT_METRICS_SOCKET = os.getenv('BOT_METRICS_SOCKET', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'bot_metrics.sock'))
+BOT_METRICS_PORT = int(os.getenv('BOT_METRICS_PORT', '8092'))  # Used where AF_UNIX is unavailable (Windows)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PUSHED_METRICS_TTL_SECONDS = 300  # Pushed samples older than this are dropped from /metrics
+
+
+class _Metric:
+    """A metric family; `labels()` selects one child time series"""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def labels(self, **labels):
+        return _Child(self, tuple(str(labels[name]) for name in self.labelnames))
+
+    def clear(self):
+        with self._lock:
+            self._values = {}
+
+    def _labels_dict(self, key):
+        return dict(zip(self.labelnames, key))
+
+
+class _Child:
+    """One label combination of a metric"""
+
+    __slots__ = ('metric', 'key')
+
+    def __init__(self, metric, key):
+        self.metric = metric
+        self.key = key
+
+    def inc(self, amount=1):
+        self.metric._inc(self.key, amount)
+
+    def dec(self, amount=1):
+        self.metric._inc(self.key, -amount)
+
+    def set(self, value):
+        self.metric._set(self.key, value)
+
+    def observe(self, value):
+        self.metric._observe(self.key, value)
+
+    def time(self):
+        return _Timer(self.metric, self.key)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _inc(self, key, amount):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def inc(self, amount=1):
+        self._inc((), amount)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, self._labels_dict(key), value) for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def _set(self, key, value):
+        with self._lock:
+            self._values[key] = value
+
+    def set(self, value):
+        self._set((), value)
+
+    def dec(self, amount=1):
+        self._inc((), -amount)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _observe(self, key, value):
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0, 0.0]  # bucket counts, count, sum
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += 1
+            state[2] += value
+
+    def observe(self, value):
+        self._observe((), value)
+
+    def time(self):
+        """Context manager observing the duration of the block in seconds"""
+        return _Timer(self, ())
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(state[0]), state[1], state[2]) for key, state in self._values.items()]
+        samples = []
+        for key, counts, count, total in values:
+            labels = self._labels_dict(key)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append((f"{self.name}_bucket", dict(labels, le=_format_value(bound)), cumulative))
+            samples.append((f"{self.name}_bucket", dict(labels, le='+Inf'), count))
+            samples.append((f"{self.name}_count", labels, count))
+            samples.append((f"{self.name}_sum", labels, total))
+        return samples
+
+
+class _Timer:
+    __slots__ = ('histogram', 'key', 'started')
+
+    def __init__(self, histogram, key):
+        self.histogram = histogram
+        self.key = key
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram._observe(self.key, time.perf_counter() - self.started)
+
+
+class Registry:
+    """The metric families of one process"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif type(metric) is not cls or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"Metric {name} is already registered with a different type or labels")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def collect(self):
+        """Families as JSON-serialisable dicts: name, type, help and (name, labels, value) samples"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return [{'name': metric.name, 'type': metric.kind, 'help': metric.documentation, 'samples': metric.samples()}
+                for metric in metrics]
+
+    def clear(self):
+        """Zero every metric"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric.clear()
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+
+
+def _reset_after_fork():
+    """A forked child (the bot subprocess) starts from zero; locks held by other parent threads are replaced"""
+    REGISTRY._lock = threading.Lock()
+    for metric in REGISTRY._metrics.values():
+        metric._lock = threading.Lock()
+        metric._values = {}
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if value == float('inf'):
+            return '+Inf'
+        if value.is_integer() and abs(value) < 1e15:
+            return str(int(value))
+        return repr(value)
+    return str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def render(families_by_service):
+    """
+    Prometheus text exposition (format 0.0.4) of several services' families
+
+    Families that are not well formed are skipped, so one bad source can't break the scrape.
+
+    Args:
+        families_by_service (dict): service name -> list of families from Registry.collect()
+    """
+    merged = {}
+    for service, families in families_by_service.items():
+        for family in families:
+            try:
+                samples = [(name, dict(labels, service=service), float(value)) for name, labels, value in family['samples']]
+                entry = merged.setdefault(family['name'], {'type': family['type'], 'help': family.get('help', ''), 'samples': []})
+            except (KeyError, TypeError, ValueError, AttributeError):
+                continue  # A malformed family must not break the whole scrape
+            entry['samples'].extend(samples)
+    lines = []
+    for name, family in merged.items():
+        if not family['samples']:
+            continue
+        lines.append(f"# HELP {name} {_escape(family['help'])}")
+        lines.append(f"# TYPE {name} {family['type']}")
+        for sample_name, labels, value in family['samples']:
+            label_text = ','.join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+            lines.append(f"{sample_name}{{{label_text}}} {_format_value(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+# Bot subprocess -> API process
+
+documents = {}  # name -> callable returning a JSON-serialisable document, served next to the families
+
+
+def publish(name, provide):
+    """Serve `provide()` as document `name` on this process's metrics socket"""
+    documents[name] = provide
+
+
+class MetricsServer:
+    """
+    Serves this process's registry and published documents on a local socket
+
+    A client sends the name of one document and a newline ('families' for the
+    collected metric families), receives it as JSON (null if unknown) and the
+    connection is closed, so the API reads current values at request time
+    without any shared state.
+    """
+
+    def __init__(self, registry=REGISTRY, path=BOT_METRICS_SOCKET, port=BOT_METRICS_PORT):
+        self.registry = registry
+        self.path = path
+        self.port = port
+        self._socket = None
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return self
+        if hasattr(socket, 'AF_UNIX'):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            if os.path.exists(self.path):
+                os.unlink(self.path)  # Left behind by a bot process that was killed
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.bind(self.path)
+        else:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._socket.bind(('127.0.0.1', self.port))
+        self._socket.listen(4)
+        self._thread = threading.Thread(target=self._serve, name='metrics-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def _serve(self):
+        while True:
+            try:
+                connection, _ = self._socket.accept()
+            except OSError:
+                return  # Socket closed by stop()
+            with connection:
+                try:
+                    connection.settimeout(1.0)
+                    name = connection.makefile('rb').readline(256).strip().decode('utf-8', 'replace')
+                    provide = self.registry.collect if name == 'families' else documents.get(name)
+                    try:
+                        document = provide() if provide is not None else None
+                    except Exception:
+                        document = None  # A failing provider must not stop the server thread
+                    connection.sendall(json.dumps(document).encode('utf-8'))
+                except OSError:
+                    pass
+
+    def stop(self):
+        if self._socket is None:
+            return
+        self._socket.close()
+        self._socket = None
+        self._thread = None
+        if hasattr(socket, 'AF_UNIX') and os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def fetch_bot_document(name, path=BOT_METRICS_SOCKET, port=BOT_METRICS_PORT, timeout=1.0):
+    """Document `name` served by the bot subprocess, or None if it is not running"""
+    try:
+        if hasattr(socket, 'AF_UNIX'):
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            address = path
+        else:
+            connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            address = ('127.0.0.1', port)
+        with connection:
+            connection.settimeout(timeout)
+            connection.connect(address)
+            connection.sendall(f"{name}\n".encode('utf-8'))
+            chunks = []
+            while True:
+                chunk = connection.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        return json.loads(b''.join(chunks))
+    except (OSError, ValueError):
+        return None
+
+
+def fetch_bot_metrics(path=BOT_METRICS_SOCKET, port=BOT_METRICS_PORT, timeout=1.0):
+    """Families published by the bot subprocess, or None if it is not running"""
+    return fetch_bot_document('families', path, port, timeout)
+
+
+# Services pushing to the API (Telegram)
+
+pushed_metrics = {}  # service -> (received at, families)
+
+
+def store_pushed_metrics(service, families):
+    pushed_metrics[service] = (time.time(), families)
+
+
+def get_pushed_metrics(max_age=PUSHED_METRICS_TTL_SECONDS):
+    now = time.time()
+    return {service: families for service, (received_at, families) in pushed_metrics.items()
+            if now - received_at <= max_age}
+
+
+def start_metrics_pusher(url, service, interval=15, registry=REGISTRY):
+    """Push this process's families to the API's /metrics/push every `interval` seconds (daemon thread)"""
+    import requests
+
+    def push():
+        while True:
+            try:
+                requests.post(url, json={'service': service, 'families': registry.collect()}, timeout=5)
+            except Exception:
+                pass  # The API may be restarting; the next push catches up
+            time.sleep(interval)
+
+    thread = threading.Thread(target=push, name='metrics-pusher', daemon=True)
+    thread.start()
+    return thread
@@ -2,11 +2,14 @@ import os
 import json
 import datetime
 from typing import Dict, List, Any, Optional
+from utils import metrics
 
 # Define paths for JSON files
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
 ORDER_BOOK_FILE = os.path.join(DATA_DIR, 'order_book.json')
 
+WRITE_LATENCY = metrics.histogram('order_storage_write_seconds', 'Time to write an order storage JSON file', ('file',))
+
 def ensure_data_dir_exists():
     """Ensure the data directory exists"""
     if not os.path.exists(DATA_DIR):
@@ -29,8 +32,9 @@ def save_json_file(file_path: str, data: List[Dict[str, Any]]):
     """Save data to a JSON file"""
     ensure_data_dir_exists()
     
-    with open(file_path, 'w') as f:
-        json.dump(data, f, indent=2)
+    with WRITE_LATENCY.labels(file=os.path.basename(file_path)).time():
+        with open(file_path, 'w') as f:
+            json.dump(data, f, indent=2)
 
 
 def load_filled_orders() -> List[Dict[str, Any]]:
@@ -1,11 +1,11 @@
 from binance.client import Client
-from config import BINANCE_API_KEY, BINANCE_API_SECRET, MODE
+from utils.binance_client import create_client
 import time
 from rich import print as rich_print
 from rich.pretty import Pretty
 from utils.logger import log_websocket, log_error
 
-client = Client(BINANCE_API_KEY, BINANCE_API_SECRET, testnet=MODE)
+client = create_client()
 
 def get_order_status(symbol, order_id):
     """
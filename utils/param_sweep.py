@@ -0,0 +1,304 @@
+"""
+Parallel parameter sweep over the backtest (offsets, intervals, symbols, leverage).
+
+Kline arrays are loaded once by the parent and published in shared memory blocks;
+pool workers attach to them by name and build NumPy views, so no candle data is
+pickled or copied per worker. Configurations that only differ in leverage share
+one task, so their strategy orders are computed once. Results stream back into a
+ranked table and are appended to a JSONL checkpoint, from which an interrupted
+sweep resumes without re-running finished configurations.
+"""
+import itertools
+import json
+import os
+import random
+from bisect import insort
+from multiprocessing import Pool, shared_memory
+import numpy as np
+from utils.backtest import run_backtest, strategy_orders
+from utils.logger import log_websocket, log_error
+
+SWEEP_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'sweeps')
+
+# Candle columns stored in a shared block; open_time is kept as int64 bits in a float64 row
+SHARED_COLUMNS = ('open_time', 'open', 'high', 'low', 'close')
+
+# Stats copied from each backtest into the result table
+RESULT_STATS = ('trades', 'win_rate', 'net_pnl', 'return_pct', 'max_drawdown_pct', 'profit_factor', 'total_fees', 'final_equity')
+
+CONFIG_FIELDS = ('symbol', 'interval', 'buy_offset', 'sell_offset', 'leverage')
+
+
+class SharedCandles:
+    """One (symbol, interval) candle set in a shared memory block"""
+
+    def __init__(self, shm, length, owner):
+        self.shm = shm
+        self.length = length
+        self.owner = owner
+        block = np.ndarray((len(SHARED_COLUMNS), length), dtype=np.float64, buffer=shm.buf)
+        self.candles = {name: block[i] for i, name in enumerate(SHARED_COLUMNS)}
+        self.candles['open_time'] = block[0].view(np.int64)
+
+    @classmethod
+    def create(cls, candles):
+        """Copy candle arrays into a new shared block (parent side)"""
+        length = len(candles['close'])
+        shm = shared_memory.SharedMemory(create=True, size=max(1, len(SHARED_COLUMNS) * length * 8))
+        shared = cls(shm, length, owner=True)
+        for name in SHARED_COLUMNS:
+            shared.candles[name][:] = candles[name]
+        return shared
+
+    @classmethod
+    def attach(cls, descriptor):
+        """Map an existing block by name (worker side)"""
+        return cls(shared_memory.SharedMemory(name=descriptor['name']), descriptor['length'], owner=False)
+
+    def descriptor(self):
+        return {'name': self.shm.name, 'length': self.length}
+
+    def release(self):
+        self.candles = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def grid_configs(symbols, intervals, buy_offsets, sell_offsets, leverages=(1,)):
+    """Every combination of the given parameter values"""
+    return [dict(zip(CONFIG_FIELDS, values))
+            for values in itertools.product(symbols, intervals, buy_offsets, sell_offsets, leverages)]
+
+
+def random_configs(count, symbols, intervals, buy_offset_range, sell_offset_range, leverages=(1,), tick_size=None, seed=None):
+    """
+    Random search: `count` configurations with offsets drawn uniformly from (low, high) ranges
+
+    Offsets are rounded to `tick_size` when given, so near-identical configurations collapse.
+    """
+    rng = random.Random(seed)
+    seen = set()
+    configs = []
+    for _ in range(count * 10):
+        if len(configs) >= count:
+            break
+        buy_offset = rng.uniform(*buy_offset_range)
+        sell_offset = rng.uniform(*sell_offset_range)
+        if tick_size:
+            buy_offset = round(round(buy_offset / tick_size) * tick_size, 10)
+            sell_offset = round(round(sell_offset / tick_size) * tick_size, 10)
+        config = {
+            'symbol': rng.choice(symbols),
+            'interval': rng.choice(intervals),
+            'buy_offset': buy_offset,
+            'sell_offset': sell_offset,
+            'leverage': rng.choice(leverages),
+        }
+        key = config_key(config)
+        if key not in seen:
+            seen.add(key)
+            configs.append(config)
+    return configs
+
+
+def config_key(config):
+    return tuple(config[name] for name in CONFIG_FIELDS)
+
+
+class RankedTable:
+    """Sweep results kept sorted by one stat (best first)"""
+
+    def __init__(self, rank_by='return_pct', descending=True):
+        self.rank_by = rank_by
+        self.descending = descending
+        self._rows = []  # (sort key, insertion counter, row)
+        self._counter = 0
+
+    def _sort_key(self, row):
+        value = row.get(self.rank_by)
+        if value is None or value != value:  # None / NaN rank last
+            return float('inf')
+        return -value if self.descending else value
+
+    def add(self, row):
+        self._counter += 1
+        insort(self._rows, (self._sort_key(row), self._counter, row))
+
+    def __len__(self):
+        return len(self._rows)
+
+    def top(self, count=None):
+        rows = [row for _, _, row in self._rows]
+        return rows if count is None else rows[:count]
+
+    def format(self, count=20):
+        """Plain-text table of the best `count` rows"""
+        lines = [f"{'#':>4} {'Symbol':<10} {'Int':<4} {'BuyOff':>9} {'SellOff':>9} {'Lev':>4} {'Trades':>7} {'Win%':>6} {'Return%':>9} {'MaxDD%':>7} {'PF':>6}"]
+        for rank, row in enumerate(self.top(count), start=1):
+            lines.append(
+                f"{rank:>4} {row['symbol']:<10} {row['interval']:<4} {row['buy_offset']:>9.4f} {row['sell_offset']:>9.4f} "
+                f"{row['leverage']:>4} {row['trades']:>7} {row['win_rate']:>6.1f} {row['return_pct']:>9.2f} "
+                f"{row['max_drawdown_pct']:>7.2f} {min(row['profit_factor'], 999.99):>6.2f}"
+            )
+        return "\n".join(lines)
+
+
+def load_checkpoint(path):
+    """Result rows already written to a checkpoint file"""
+    rows = []
+    if not path or not os.path.exists(path):
+        return rows
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rows.append(json.loads(line))
+            except json.JSONDecodeError:
+                # A torn last line from an interrupted run
+                log_error(f"Skipping unreadable checkpoint line in {path}")
+    return rows
+
+
+# Worker process state, set by _init_worker
+_worker_datasets = {}
+_worker_settings = {}
+
+
+def _init_worker(descriptors, settings):
+    global _worker_datasets, _worker_settings
+    _worker_datasets = {key: SharedCandles.attach(descriptor) for key, descriptor in descriptors.items()}
+    _worker_settings = settings
+
+
+def _run_group(group):
+    """Backtest every leverage of one (symbol, interval, buy_offset, sell_offset) group"""
+    symbol, interval, buy_offset, sell_offset, leverages = group
+    candles = _worker_datasets[(symbol, interval)].candles
+    tick_size, step_size = _worker_settings['filters'][symbol]
+    backtest_kwargs = _worker_settings['backtest_kwargs']
+    orders = strategy_orders(candles, buy_offset, sell_offset, tick_size)
+    rows = []
+    for leverage in leverages:
+        result = run_backtest(candles, buy_offset, sell_offset, tick_size, step_size,
+                              leverage=leverage, orders=orders, **backtest_kwargs)
+        row = {'symbol': symbol, 'interval': interval, 'buy_offset': buy_offset,
+               'sell_offset': sell_offset, 'leverage': leverage}
+        row.update({name: result.stats[name] for name in RESULT_STATS})
+        rows.append(row)
+    return rows
+
+
+def _group_configs(configs):
+    groups = {}
+    for config in configs:
+        key = (config['symbol'], config['interval'], config['buy_offset'], config['sell_offset'])
+        groups.setdefault(key, []).append(config['leverage'])
+    return [key + (tuple(leverages),) for key, leverages in groups.items()]
+
+
+def run_sweep(configs, candles_by_key, filters_by_symbol, workers=None, checkpoint_path=None,
+              rank_by='return_pct', on_result=None, **backtest_kwargs):
+    """
+    Backtest many configurations in a process pool
+
+    Args:
+        configs (list): Dicts with symbol, interval, buy_offset, sell_offset, leverage
+        candles_by_key (dict): (symbol, interval) -> candle arrays (see utils.backtest.load_klines)
+        filters_by_symbol (dict): symbol -> (tick_size, step_size)
+        workers (int, optional): Pool size (defaults to the CPU count)
+        checkpoint_path (str, optional): JSONL file results are appended to and resumed from
+        rank_by (str): Stat the table is sorted by (highest first)
+        on_result (callable, optional): Called with the table after every finished group
+        **backtest_kwargs: Passed to run_backtest (quantity_type, quantity, fee_rate, ...)
+
+    Returns:
+        RankedTable with a row per configuration
+    """
+    table = RankedTable(rank_by)
+    done = set()
+    for row in load_checkpoint(checkpoint_path):
+        table.add(row)
+        done.add(config_key(row))
+    pending = [config for config in configs if config_key(config) not in done]
+    if done:
+        log_websocket(f"[SWEEP] Resuming: {len(done)} results from checkpoint, {len(pending)} configurations left")
+    if not pending:
+        return table
+
+    groups = _group_configs(pending)
+    needed = {(group[0], group[1]) for group in groups}
+    shared = {key: SharedCandles.create(candles_by_key[key]) for key in needed}
+    settings = {'filters': filters_by_symbol, 'backtest_kwargs': backtest_kwargs}
+    workers = workers or os.cpu_count() or 1
+    checkpoint = None
+    try:
+        if checkpoint_path:
+            os.makedirs(os.path.dirname(os.path.abspath(checkpoint_path)), exist_ok=True)
+            checkpoint = open(checkpoint_path, 'a')
+        descriptors = {key: block.descriptor() for key, block in shared.items()}
+        # Small chunks keep workers evenly loaded; more than one per task amortises IPC
+        chunksize = max(1, len(groups) // (workers * 16))
+        with Pool(workers, initializer=_init_worker, initargs=(descriptors, settings)) as pool:
+            for rows in pool.imap_unordered(_run_group, groups, chunksize=chunksize):
+                for row in rows:
+                    table.add(row)
+                    if checkpoint is not None:
+                        checkpoint.write(json.dumps(row) + "\n")
+                if checkpoint is not None:
+                    checkpoint.flush()
+                if on_result is not None:
+                    on_result(table)
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+        for block in shared.values():
+            block.release()
+    return table
+
+
+# Run a sweep from the command line
+if __name__ == "__main__":
+    import argparse
+    from datetime import datetime
+    from utils.backtest import load_klines
+    from utils.symbol_filters import get_symbol_filters
+
+    parser = argparse.ArgumentParser(description="Backtest a grid or random sample of strategy parameters")
+    parser.add_argument('--symbols', nargs='+', required=True)
+    parser.add_argument('--intervals', nargs='+', default=['1m'])
+    parser.add_argument('--start', required=True, help="dd-mm-YYYY")
+    parser.add_argument('--end', required=True, help="dd-mm-YYYY")
+    parser.add_argument('--buy-offsets', nargs='+', type=float, default=[0.0, 0.5, 1.0, 2.0])
+    parser.add_argument('--sell-offsets', nargs='+', type=float, default=[0.0, 0.5, 1.0, 2.0])
+    parser.add_argument('--leverages', nargs='+', type=int, default=[1])
+    parser.add_argument('--random', type=int, default=0, help="Sample N configurations between the min and max offsets instead of the full grid")
+    parser.add_argument('--quantity-percentage', type=float, default=100.0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--name', default='sweep', help="Checkpoint name under data/sweeps")
+    parser.add_argument('--rank-by', default='return_pct')
+    parser.add_argument('--top', type=int, default=20)
+    args = parser.parse_args()
+
+    start_ms = int(datetime.strptime(args.start, '%d-%m-%Y').timestamp() * 1000)
+    end_ms = int(datetime.strptime(args.end, '%d-%m-%Y').timestamp() * 1000)
+    symbols = [symbol.upper() for symbol in args.symbols]
+    filters = {symbol: (get_symbol_filters(symbol).tick_size, get_symbol_filters(symbol).step_size) for symbol in symbols}
+    candles = {(symbol, interval): load_klines(symbol, interval, start_ms, end_ms)
+               for symbol in symbols for interval in args.intervals}
+
+    if args.random:
+        configs = random_configs(args.random, symbols, args.intervals,
+                                 (min(args.buy_offsets), max(args.buy_offsets)),
+                                 (min(args.sell_offsets), max(args.sell_offsets)), args.leverages)
+    else:
+        configs = grid_configs(symbols, args.intervals, args.buy_offsets, args.sell_offsets, args.leverages)
+
+    log_websocket(f"[SWEEP] Running {len(configs)} configurations")
+    table = run_sweep(configs, candles, filters, workers=args.workers,
+                      checkpoint_path=os.path.join(SWEEP_DIR, f"{args.name}.jsonl"),
+                      rank_by=args.rank_by, quantity_type='percentage',
+                      quantity_percentage=args.quantity_percentage)
+    log_websocket(table.format(args.top))
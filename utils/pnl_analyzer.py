@@ -1,10 +1,34 @@
 from binance.client import Client
 from binance.exceptions import BinanceAPIException
-import pandas as pd
 from datetime import datetime, timedelta
 import json
 import os
-from typing import Dict, List, Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional
+from utils.binance_client import create_client
+from utils.rate_limiter import scheduler
+from utils.income_ledger import get_income_ledger, date_range_ms, INCOME_SYNC_SECONDS
+
+INCOME_PAGE_LIMIT = 1000  # Maximum records per futures_income_history request
+INCOME_REQUEST_WEIGHT = 30  # Request weight of GET /fapi/v1/income
+INCOME_WINDOW_MS = 7 * 24 * 60 * 60 * 1000  # Date range split into windows fetched concurrently
+INCOME_FETCH_WORKERS = 4
+INCOME_FETCH_RETRIES = 3  # Attempts per page after a 429 (the scheduler waits for the next minute)
+
+def summarize_income(income_history: List[Dict]) -> Dict:
+    """Totals and per-symbol totals by income type of raw income records (the shape of IncomeLedger.summary)"""
+    totals = {}
+    by_symbol = {}
+    for income in income_history:
+        amount = float(income['income'])
+        income_type = income['incomeType']
+        totals[income_type] = totals.get(income_type, 0.0) + amount
+        symbol_totals = by_symbol.setdefault(income['symbol'], {})
+        symbol_totals[income_type] = symbol_totals.get(income_type, 0.0) + amount
+    return {'totals': totals, 'by_symbol': by_symbol}
+
 
 class BinanceFuturesPnLTracker:
     def __init__(self, api_key: str, api_secret: str, testnet: bool = False):
@@ -20,15 +44,32 @@ class BinanceFuturesPnLTracker:
         self.api_secret = api_secret
         self.testnet = testnet
         
-        # Initialize Binance client
-        self.client = Client(
+        # One Binance client per thread (signing follows the server clock); this thread's is created now
+        self._local = threading.local()
+        self._local.client = create_client(
             api_key=api_key,
             api_secret=api_secret,
             testnet=testnet
         )
+        # Income pages are fetched by long-lived workers, so their clients are reused across fetches
+        self._fetch_executor = ThreadPoolExecutor(max_workers=INCOME_FETCH_WORKERS, thread_name_prefix='income-fetch')
         
         print(f"Connected to Binance {'Testnet' if testnet else 'Mainnet'} Futures")
     
+    @property
+    def client(self) -> Client:
+        """
+        The calling thread's client
+        
+        python-binance stores each response on the client before parsing it, so threads
+        sharing one client (fetch workers, API requests, background syncs) could read each
+        other's responses; every thread gets its own.
+        """
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = create_client(self.api_key, self.api_secret, self.testnet, ping=False)
+        return client
+    
     def get_account_info(self) -> Dict:
         """Get futures account information"""
         try:
@@ -55,6 +96,79 @@ class BinanceFuturesPnLTracker:
         except BinanceAPIException as e:
             raise Exception(f"Failed to get positions: {e}")
     
+    def get_account_snapshot(self):
+        """(account info, open positions), fetched together"""
+        return self.get_account_info(), self.get_positions()
+    
+    def _income_range(self, days: int = 30, start_date: Optional[str] = None,
+                      end_date: Optional[str] = None):
+        """(start_time, end_time) in ms for a number of days back or an inclusive date range"""
+        if start_date and end_date:
+            # Parse provided date strings to datetime objects - force UTC timezone
+            start_datetime = datetime.strptime(start_date, '%Y-%m-%d')
+            # Set start time to beginning of day (00:00:00) UTC
+            start_time = int(start_datetime.timestamp() * 1000)
+            
+            # Set end_date to end of day (23:59:59) UTC
+            end_datetime = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1) - timedelta(seconds=1)
+            end_time = int(end_datetime.timestamp() * 1000)
+            
+            print(f"Fetching data from {start_datetime} to {end_datetime} (UTC)")
+        else:
+            # Use the days parameter as fallback
+            end_time = int(datetime.now().timestamp() * 1000)
+            start_time = int((datetime.now() - timedelta(days=days)).timestamp() * 1000)
+        return start_time, end_time
+    
+    def _fetch_income_page(self, params: Dict) -> List[Dict]:
+        for attempt in range(INCOME_FETCH_RETRIES):
+            scheduler.acquire(INCOME_REQUEST_WEIGHT)
+            try:
+                return self.client.futures_income_history(**params)
+            except BinanceAPIException as e:
+                if e.status_code not in (418, 429) or attempt == INCOME_FETCH_RETRIES - 1:
+                    raise
+                scheduler.exhaust()
+        return []
+    
+    def _fetch_income_window(self, start_time: int, end_time: int, income_type: str = None) -> List[Dict]:
+        """All records of one window, page by page (the exchange returns them oldest first)"""
+        records = []
+        cursor = start_time
+        while cursor <= end_time:
+            params = {'startTime': cursor, 'endTime': end_time, 'limit': INCOME_PAGE_LIMIT}
+            if income_type:
+                params['incomeType'] = income_type
+            page = self._fetch_income_page(params)
+            records.extend(page)
+            if len(page) < INCOME_PAGE_LIMIT:
+                break
+            last_time = max(int(record['time']) for record in page)
+            # Records sharing the last page's final millisecond are read again and deduplicated
+            cursor = last_time if last_time > cursor else last_time + 1
+        return records
+    
+    def iter_income_history(self, start_time: int, end_time: int, income_type: str = None) -> Iterator[Dict]:
+        """
+        Stream income records between two ms timestamps, oldest window first
+        
+        The range is split into INCOME_WINDOW_MS windows that are paginated concurrently
+        under the request weight scheduler; each window's records are yielded as soon as
+        it and every earlier window are complete. Records are deduplicated by tranId.
+        """
+        windows = [(start, min(start + INCOME_WINDOW_MS - 1, end_time))
+                   for start in range(start_time, end_time + 1, INCOME_WINDOW_MS)]
+        seen = set()
+        results = self._fetch_executor.map(lambda window: self._fetch_income_window(*window, income_type), windows)
+        for records in results:
+            for record in records:
+                # One trade books REALIZED_PNL and COMMISSION under the same tranId
+                key = (record.get('tranId'), record.get('incomeType'))
+                if key in seen:
+                    continue
+                seen.add(key)
+                yield record
+    
     def get_income_history(self, days: int = 30, income_type: str = None, 
                           start_date: Optional[str] = None, end_date: Optional[str] = None) -> List[Dict]:
         """
@@ -67,38 +181,57 @@ class BinanceFuturesPnLTracker:
             end_date (str, optional): End date in 'YYYY-MM-DD' format
         """
         try:
-            if start_date and end_date:
-                # Parse provided date strings to datetime objects - force UTC timezone
-                start_datetime = datetime.strptime(start_date, '%Y-%m-%d')
-                # Set start time to beginning of day (00:00:00) UTC
-                start_time = int(start_datetime.timestamp() * 1000)
-                
-                # Set end_date to end of day (23:59:59) UTC
-                end_datetime = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1) - timedelta(seconds=1)
-                end_time = int(end_datetime.timestamp() * 1000)
-                
-                print(f"Fetching data from {start_datetime} to {end_datetime} (UTC)")
-            else:
-                # Use the days parameter as fallback
-                end_time = int(datetime.now().timestamp() * 1000)
-                start_time = int((datetime.now() - timedelta(days=days)).timestamp() * 1000)
-            
-            params = {
-                'startTime': start_time,
-                'endTime': end_time,
-                'limit': 1000
-            }
-            
-            if income_type:
-                params['incomeType'] = income_type
-            
-            income_history = self.client.futures_income_history(**params)
+            start_time, end_time = self._income_range(days, start_date, end_date)
+            started = time.perf_counter()
+            income_history = list(self.iter_income_history(start_time, end_time, income_type))
+            print(f"Fetched {len(income_history)} income records in {time.perf_counter() - started:.2f}s")
             return income_history
         except BinanceAPIException as e:
             raise Exception(f"Failed to get income history: {e}")
     
+    def get_local_income_history(self, days: int = 30, start_date: Optional[str] = None,
+                                 end_date: Optional[str] = None) -> List[Dict]:
+        """
+        Income history from the local ledger (REALIZED_PNL, COMMISSION and FUNDING_FEE only)
+        
+        The ledger is kept current by a background sync; it is only synced here when the
+        range starts before it or reaches past what that sync has covered.
+        
+        Args:
+            days (int): Number of days to look back (ignored if start_date and end_date are provided)
+            start_date (str, optional): Start date in 'YYYY-MM-DD' format
+            end_date (str, optional): End date in 'YYYY-MM-DD' format
+        """
+        start_time, end_time = self._income_range(days, start_date, end_date)
+        return self._synced_ledger(start_time, end_time).records(start_time, end_time)
+    
+    def _synced_ledger(self, start_time: int, end_time: int):
+        ledger = get_income_ledger()
+        if not ledger.covers(start_time, end_time, max_lag_ms=2 * INCOME_SYNC_SECONDS * 1000):
+            ledger.sync(self, start_ms=start_time)
+        return ledger
+    
+    def get_income_summary(self, days: int = 30, start_date: Optional[str] = None,
+                           end_date: Optional[str] = None, tz: str = 'UTC') -> Dict:
+        """
+        Income totals overall, by symbol and by day from the ledger's daily rollups
+        
+        Args:
+            days (int): Number of days to look back (ignored if start_date and end_date are provided)
+            start_date (str, optional): Start date in 'YYYY-MM-DD' format
+            end_date (str, optional): End date in 'YYYY-MM-DD' format
+            tz (str): Day boundaries for dates and the daily breakdown ('UTC' or 'IST')
+        
+        Raises:
+            ValueError: for an unknown timezone or a malformed date
+        """
+        start_time, end_time = date_range_ms(days, start_date, end_date, tz)
+        return self._synced_ledger(start_time, end_time).summary(start_time, end_time, tz)
+    
     def get_trading_stats(self, days: int = 30, start_date: Optional[str] = None, 
-                        end_date: Optional[str] = None) -> Dict:
+                        end_date: Optional[str] = None, income_history: Optional[List[Dict]] = None,
+                        income_summary: Optional[Dict] = None,
+                        account_snapshot: Optional[tuple] = None) -> Dict:
         """
         Get comprehensive trading statistics
         
@@ -106,42 +239,34 @@ class BinanceFuturesPnLTracker:
             days (int): Number of days to look back (ignored if start_date and end_date are provided)
             start_date (str, optional): Start date in 'YYYY-MM-DD' format
             end_date (str, optional): End date in 'YYYY-MM-DD' format
+            income_history (list, optional): Records already fetched for this period
+            income_summary (dict, optional): Totals from get_income_summary, used instead of records
+            account_snapshot (tuple, optional): (account info, positions) already fetched
         """
         try:
-            # Get account info
-            account_info = self.get_account_info()
-            
-            # Get positions
-            positions = self.get_positions()
+            if account_snapshot is None:
+                account_snapshot = self.get_account_snapshot()
+            account_info, positions = account_snapshot
             
-            # Get income history
-            income_history = self.get_income_history(days, start_date=start_date, end_date=end_date)
+            # Income totals by type and symbol
+            if income_summary is None:
+                if income_history is None:
+                    income_history = self.get_income_history(days, start_date=start_date, end_date=end_date)
+                income_summary = summarize_income(income_history)
             
             # Calculate P&L metrics
             total_wallet_balance = float(account_info['totalWalletBalance'])
             total_unrealized_pnl = float(account_info['totalUnrealizedProfit'])
             total_margin_balance = float(account_info['totalMarginBalance'])
             
-            # Calculate realized P&L from income history
-            realized_pnl = 0
-            funding_fees = 0
-            commission_fees = 0
-            pnl_by_symbol = {}
-            
-            for income in income_history:
-                amount = float(income['income'])
-                symbol = income['symbol']
-                income_type = income['incomeType']
-                
-                if income_type == 'REALIZED_PNL':
-                    realized_pnl += amount
-                    if symbol not in pnl_by_symbol:
-                        pnl_by_symbol[symbol] = 0
-                    pnl_by_symbol[symbol] += amount
-                elif income_type == 'FUNDING_FEE':
-                    funding_fees += amount
-                elif income_type == 'COMMISSION':
-                    commission_fees += amount
+            # Realized P&L, funding and commission from the income totals
+            totals = income_summary['totals']
+            realized_pnl = totals.get('REALIZED_PNL', 0)
+            funding_fees = totals.get('FUNDING_FEE', 0)
+            commission_fees = totals.get('COMMISSION', 0)
+            pnl_by_symbol = {symbol: symbol_totals['REALIZED_PNL']
+                             for symbol, symbol_totals in income_summary['by_symbol'].items()
+                             if symbol_totals.get('REALIZED_PNL')}
             
             # Position details
             position_details = []
@@ -198,7 +323,7 @@ class BinanceFuturesPnLTracker:
             raise Exception(f"Failed to get trading stats: {e}")
     
     def get_daily_pnl(self, days: int = 7, start_date: Optional[str] = None, 
-                      end_date: Optional[str] = None) -> pd.DataFrame:
+                      end_date: Optional[str] = None, income_history: Optional[List[Dict]] = None) -> 'pd.DataFrame':
         """
         Get daily P&L breakdown
         
@@ -206,9 +331,12 @@ class BinanceFuturesPnLTracker:
             days (int): Number of days to look back (ignored if start_date and end_date are provided)
             start_date (str, optional): Start date in 'YYYY-MM-DD' format
             end_date (str, optional): End date in 'YYYY-MM-DD' format
+            income_history (list, optional): Records already fetched for this period
         """
+        import pandas as pd  # Command line report only; the API answers from the ledger rollups
         try:
-            income_history = self.get_income_history(days, start_date=start_date, end_date=end_date)
+            if income_history is None:
+                income_history = self.get_income_history(days, start_date=start_date, end_date=end_date)
             
             # Convert to DataFrame for easier analysis
             df = pd.DataFrame(income_history)
@@ -360,6 +488,20 @@ class BinanceFuturesPnLTracker:
             print(f"Error saving data: {e}")
 
 
+_shared_tracker = None
+_shared_tracker_lock = threading.Lock()
+
+
+def get_shared_tracker() -> BinanceFuturesPnLTracker:
+    """One tracker (and client) per process, shared by API requests and the income ledger sync"""
+    global _shared_tracker
+    with _shared_tracker_lock:
+        if _shared_tracker is None:
+            from utils.config import BINANCE_API_KEY, BINANCE_API_SECRET, TEST
+            _shared_tracker = BinanceFuturesPnLTracker(BINANCE_API_KEY, BINANCE_API_SECRET, testnet=TEST)
+        return _shared_tracker
+
+
 def main():
     """Example usage"""
     import argparse
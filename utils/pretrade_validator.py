@@ -0,0 +1,114 @@
+"""
+Local pre-trade validation.
+
+Checks an order against the cached symbol filters, the live price cache (or the REST
+ticker when the cache is stale) and the account mirror before it is signed and sent, so orders the exchange would reject
+are dropped in memory instead of costing a REST round-trip and a candle.
+"""
+from typing import NamedTuple, Optional
+from utils.symbol_filters import get_symbol_filters
+from utils.logger import log_error
+from utils import market_state
+
+# Prices older than this are not trusted for trigger / PERCENT_PRICE checks
+PRICE_MAX_AGE_SECONDS = 5.0
+
+
+class PreTradeRejection(NamedTuple):
+    """Structured reason for a locally rejected order"""
+    rule: str  # e.g. 'WOULD_TRIGGER', 'MIN_NOTIONAL', 'LOT_SIZE', 'PRICE_FILTER', 'PERCENT_PRICE', 'MAX_POSITION', 'MARGIN'
+    message: str
+    limit: Optional[float] = None  # The bound that was violated
+    value: Optional[float] = None  # The offending value
+
+    def __str__(self):
+        return f"{self.rule}: {self.message}"
+
+
+def validate_order(symbol, side, price, stop_price, quantity, position_side='LONG', last_price=None, client=None):
+    """
+    Validate a STOP (stop-limit) order locally.
+
+    Args:
+        symbol (str): Trading pair symbol (e.g., 'ETHUSDT')
+        side (str): 'BUY' or 'SELL'
+        price (float): Limit price
+        stop_price (float): Stop trigger price
+        quantity (float): Order quantity
+        position_side (str): 'LONG' or 'SHORT' (hedge mode)
+        last_price (float, optional): Current price; taken from the live price cache if omitted
+        client: python-binance client, used to fetch the price when the cache is stale
+
+    Returns:
+        PreTradeRejection if the order would be rejected, None if it passes every check
+    """
+    filters = get_symbol_filters(symbol)
+    price = float(price)
+    stop_price = float(stop_price)
+    quantity = float(quantity)
+    # In hedge mode BUY opens/increases a LONG and SELL reduces it (the reverse for SHORT)
+    opening = (side == 'BUY') == (position_side == 'LONG')
+
+    # LOT_SIZE
+    if quantity <= 0:
+        return PreTradeRejection('LOT_SIZE', f"Quantity {quantity} must be positive", 0, quantity)
+    if filters.min_qty is not None and quantity < filters.min_qty:
+        return PreTradeRejection('LOT_SIZE', f"Quantity {quantity} is below minQty {filters.min_qty}", filters.min_qty, quantity)
+    if filters.max_qty is not None and quantity > filters.max_qty:
+        return PreTradeRejection('LOT_SIZE', f"Quantity {quantity} is above maxQty {filters.max_qty}", filters.max_qty, quantity)
+    if filters.qty.floor(quantity).units != filters.qty.ceil(quantity).units:
+        return PreTradeRejection('LOT_SIZE', f"Quantity {quantity} is not a multiple of stepSize {filters.step_size}", filters.step_size, quantity)
+
+    # PRICE_FILTER
+    for label, value in (('price', price), ('stopPrice', stop_price)):
+        if value <= 0:
+            return PreTradeRejection('PRICE_FILTER', f"{label} {value} must be positive", 0, value)
+        if filters.min_price is not None and value < filters.min_price:
+            return PreTradeRejection('PRICE_FILTER', f"{label} {value} is below minPrice {filters.min_price}", filters.min_price, value)
+        if filters.max_price is not None and value > filters.max_price:
+            return PreTradeRejection('PRICE_FILTER', f"{label} {value} is above maxPrice {filters.max_price}", filters.max_price, value)
+        if filters.price.floor(value).units != filters.price.ceil(value).units:
+            return PreTradeRejection('PRICE_FILTER', f"{label} {value} is not a multiple of tickSize {filters.tick_size}", filters.tick_size, value)
+
+    # MIN_NOTIONAL only applies to orders that open or increase a position
+    notional = price * quantity
+    if opening and notional < filters.min_notional:
+        return PreTradeRejection('MIN_NOTIONAL', f"Order value {notional:.4f} is below minimum notional {filters.min_notional}", filters.min_notional, notional)
+
+    if last_price is None:
+        last_price = market_state.get_last_price(symbol, max_age=PRICE_MAX_AGE_SECONDS)
+    if last_price is None and client is not None:
+        # Stalled price feed: the trigger checks matter most exactly then, so ask the exchange
+        try:
+            last_price = float(client.futures_symbol_ticker(symbol=symbol)['price'])
+        except Exception as e:
+            log_error(f"Could not fetch the {symbol} price for pre-trade validation: {e}")
+    if last_price is not None:
+        # A stop order whose trigger is already crossed is rejected with "would immediately trigger"
+        if side == 'BUY' and last_price >= stop_price:
+            return PreTradeRejection('WOULD_TRIGGER', f"Current price {last_price} is already at or above stop {stop_price}", stop_price, last_price)
+        if side == 'SELL' and last_price <= stop_price:
+            return PreTradeRejection('WOULD_TRIGGER', f"Current price {last_price} is already at or below stop {stop_price}", stop_price, last_price)
+
+        # PERCENT_PRICE, using the last price as a stand-in for the mark price
+        if filters.multiplier_up is not None and price > last_price * filters.multiplier_up:
+            return PreTradeRejection('PERCENT_PRICE', f"Price {price} is above {filters.multiplier_up}x the current price {last_price}", last_price * filters.multiplier_up, price)
+        if filters.multiplier_down is not None and price < last_price * filters.multiplier_down:
+            return PreTradeRejection('PERCENT_PRICE', f"Price {price} is below {filters.multiplier_down}x the current price {last_price}", last_price * filters.multiplier_down, price)
+
+    position_amt = market_state.get_position_amount(symbol, position_side)
+    if opening:
+        # Max position: the resulting position must still fit the lot size limit
+        if position_amt is not None and filters.max_qty is not None and abs(position_amt) + quantity > filters.max_qty:
+            return PreTradeRejection('MAX_POSITION', f"Position {abs(position_amt)} + {quantity} would exceed max quantity {filters.max_qty}", filters.max_qty, abs(position_amt) + quantity)
+        # Margin: the initial margin must be covered by the mirrored available balance
+        available = market_state.get_available_balance()
+        leverage = market_state.get_leverage(symbol)
+        if available is not None and leverage:
+            required_margin = notional / leverage
+            if required_margin > available:
+                return PreTradeRejection('MARGIN', f"Required margin {required_margin:.4f} exceeds available balance {available:.4f}", available, required_margin)
+    elif position_amt is not None and quantity > abs(position_amt) + filters.step_size / 2:
+        return PreTradeRejection('MAX_POSITION', f"Closing quantity {quantity} exceeds open position {abs(position_amt)}", abs(position_amt), quantity)
+
+    return None
@@ -2,8 +2,12 @@ from binance.client import Client
 import math
 from utils.config import BINANCE_API_KEY, BINANCE_API_SECRET, MODE, get_trading_symbol, get_leverage
 from utils.logger import log_websocket, log_error
+from utils.symbol_filters import TickGrid, get_symbol_filters
+from utils.pretrade_validator import PRICE_MAX_AGE_SECONDS
+from utils import market_state
+from utils.binance_client import create_client
 
-client = Client(BINANCE_API_KEY, BINANCE_API_SECRET, testnet=MODE)
+client = create_client()
 
 def get_available_balance(asset='USDT'):
     """
@@ -13,6 +17,7 @@ def get_available_balance(asset='USDT'):
         account_info = client.futures_account()
         for balance in account_info['assets']:
             if balance['asset'] == asset:
+                market_state.update_available_balance(asset, balance['availableBalance'])
                 return float(balance['availableBalance'])
         return 0
     except Exception as e:
@@ -24,18 +29,9 @@ def get_asset_precision(symbol):
     Get the quantity precision for a specific symbol
     """
     try:
-        exchange_info = client.futures_exchange_info()
-        for symbol_info in exchange_info['symbols']:
-            if symbol_info['symbol'] == symbol:
-                for filter_item in symbol_info['filters']:
-                    if filter_item['filterType'] == 'LOT_SIZE':
-                        # Calculate precision from stepSize
-                        step_size = float(filter_item['stepSize'])
-                        precision = 0
-                        if step_size < 1:
-                            precision = len(str(step_size).split('.')[-1].rstrip('0'))
-                        return precision, step_size
-        return 8, 0.00000001  # Default precision if not found
+        # Precision and stepSize come from the cached LOT_SIZE filter
+        qty_grid = get_symbol_filters(symbol).qty
+        return qty_grid.decimals, qty_grid.increment
     except Exception as e:
         log_error(f"Error getting asset precision: {e}", exc_info=True)
         return 8, 0.00000001  # Default precision
@@ -50,6 +46,7 @@ def get_leverage(symbol):
         
         # If position info exists and has leverage information
         if position_info and len(position_info) > 0 and 'leverage' in position_info[0]:
+            market_state.update_leverage(symbol, position_info[0]['leverage'])
             return int(position_info[0]['leverage'])
         
         # If we can't get leverage from position info, try leverage brackets
@@ -102,8 +99,11 @@ def calculate_quantity(fixed_quantity, percentage, quantity_type='fixed', price_
     """
     try:
         # Get current price of the trading symbol
-        ticker = client.futures_symbol_ticker(symbol=get_trading_symbol())
-        current_price = float(ticker['price'])
+        # Prefer the live price cache fed by the websocket over a REST ticker request
+        current_price = market_state.get_last_price(get_trading_symbol(), max_age=PRICE_MAX_AGE_SECONDS)
+        if current_price is None:
+            ticker = client.futures_symbol_ticker(symbol=get_trading_symbol())
+            current_price = float(ticker['price'])
         
         # Get precision and step size for the symbol
         precision, step_size = get_asset_precision(get_trading_symbol())
@@ -151,16 +151,11 @@ def calculate_quantity(fixed_quantity, percentage, quantity_type='fixed', price_
         notional_value = quantity * current_price
         if notional_value < min_notional:
             log_websocket(f"⚠️ Calculated notional value ({notional_value:.2f} USDT) is below minimum ({min_notional} USDT). Adjusting quantity.")
-            # Adjust quantity to meet minimum notional
-            min_quantity = min_notional / current_price
-            quantity = min_quantity
-        
-        # Round to step size (avoid "invalid lot size" errors)
-        if step_size > 0:
-            quantity = math.floor(quantity / step_size) * step_size
-        
-        # Round to the appropriate precision for display
-        quantity = round(quantity, precision)
+            # Adjust quantity to meet minimum notional, rounding up on the step grid so it stays above the minimum
+            quantity = float(TickGrid(step_size).ceil(min_notional / current_price))
+        else:
+            # Floor onto the integer step grid (avoid "invalid lot size" errors)
+            quantity = float(TickGrid(step_size).floor(quantity))
         
         # Log the calculation details
         if quantity_type.lower() == 'percentage':
@@ -192,14 +187,7 @@ def get_min_notional(symbol):
         float: The minimum notional value required for orders
     """
     try:
-        exchange_info = client.futures_exchange_info()
-        for symbol_info in exchange_info['symbols']:
-            if symbol_info['symbol'] == symbol:
-                for filter_item in symbol_info['filters']:
-                    if filter_item['filterType'] == 'MIN_NOTIONAL':
-                        return float(filter_item['notional'])
-        # Default to 20 USDT if not found (Binance's typical minimum)
-        return 20.0
+        return get_symbol_filters(symbol).min_notional
     except Exception as e:
         log_error(f"Error getting minimum notional: {e}", exc_info=True)
         # Default to 20 USDT
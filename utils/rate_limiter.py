@@ -0,0 +1,82 @@
+"""
+Client-side scheduler for the Binance REST request weight limit.
+
+Binance counts request weight per IP and exchange minute (reported back in
+X-MBX-USED-WEIGHT-1M) and answers 429, then bans the IP, when a minute goes over
+the limit. Code that fans out many requests (paginated history downloads) calls
+acquire(weight) before each one; it blocks until the current minute has room.
+The count follows the exchange's own figure whenever a response reports it, so
+requests made elsewhere in the process (the trading path) are accounted too.
+"""
+import os
+import threading
+import time
+
+REST_WEIGHT_LIMIT_1M = int(os.getenv('REST_WEIGHT_LIMIT_1M', '2400'))  # Futures IP limit per minute
+REST_WEIGHT_SHARE = 0.8  # Part of the limit handed out to bulk fetches; the rest stays free for orders
+
+
+def _server_now_ms():
+    try:
+        from utils.time_sync import server_now_ms
+        return server_now_ms()
+    except Exception:
+        return int(time.time() * 1000)
+
+
+class WeightScheduler:
+    """
+    Request weight budget of one exchange minute, shared by all threads
+
+    Args:
+        limit (int): Weight that may be used per minute
+        clock (callable, optional): Current server time in ms
+    """
+
+    def __init__(self, limit=int(REST_WEIGHT_LIMIT_1M * REST_WEIGHT_SHARE), clock=None):
+        self.limit = limit
+        self.clock = clock or _server_now_ms
+        self.waited_seconds = 0.0
+        self._minute = None
+        self._used = 0
+        self._condition = threading.Condition()
+
+    def _roll(self, minute):
+        if self._minute is None or minute > self._minute:
+            self._minute = minute
+            self._used = 0
+
+    def acquire(self, weight):
+        """Block until `weight` fits into the current minute, then reserve it"""
+        with self._condition:
+            while True:
+                now = self.clock()
+                self._roll(now // 60000)
+                # A single request heavier than the whole budget still runs, alone, in a fresh minute
+                if self._used + weight <= self.limit or self._used == 0:
+                    self._used += weight
+                    return
+                wait = ((self._minute + 1) * 60000 - now) / 1000 + 0.05
+                self.waited_seconds += wait
+                self._condition.wait(wait)
+
+    def observe(self, used_weight, server_minute):
+        """Adopt the exchange's X-MBX-USED-WEIGHT-1M count for `server_minute`"""
+        with self._condition:
+            self._roll(server_minute)
+            if server_minute == self._minute and used_weight > self._used:
+                self._used = used_weight
+
+    def exhaust(self):
+        """The exchange answered 429: nothing more this minute"""
+        with self._condition:
+            self._roll(self.clock() // 60000)
+            self._used = max(self._used, self.limit)
+
+    def used(self):
+        with self._condition:
+            self._roll(self.clock() // 60000)
+            return self._used
+
+
+scheduler = WeightScheduler()
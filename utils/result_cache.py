@@ -0,0 +1,87 @@
+"""
+In-process cache for expensive, read-only API results.
+
+Entries are fresh for `ttl` seconds. After that, and for up to `max_stale` seconds,
+they are still served while one background refresh recomputes them
+(stale-while-revalidate). Concurrent requests for a key that has to be computed
+share one computation (single flight). Each entry records the generation of the
+data it was computed from, e.g. the number of events in the income ledger, and
+an entry of an older generation is never served.
+
+submit() returns a concurrent.futures.Future, so async endpoints can await a
+computation without holding a worker thread while they wait.
+"""
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class ResultCache:
+    """
+    Args:
+        ttl (float): Seconds an entry is served without recomputing it
+        max_stale (float): Seconds after which an entry is no longer served at all
+        max_entries (int): Entries kept; the least recently computed are dropped first
+        workers (int): Threads computing results
+        name (str): Thread name prefix
+    """
+
+    def __init__(self, ttl, max_stale, max_entries=256, workers=2, name='result-cache'):
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.max_entries = max_entries
+        self.hits = self.stale_hits = self.misses = 0
+        self._entries = {}  # key -> (value, computed at (monotonic), generation)
+        self._in_flight = {}  # (key, generation) -> Future of the running computation
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+
+    def _run(self, key, compute, generation):
+        try:
+            value = compute()
+            with self._lock:
+                self._entries.pop(key, None)
+                self._entries[key] = (value, time.monotonic(), generation)
+                while len(self._entries) > self.max_entries:
+                    del self._entries[next(iter(self._entries))]
+            return value
+        finally:
+            with self._lock:
+                self._in_flight.pop((key, generation), None)
+
+    def _start(self, key, compute, generation):
+        future = self._in_flight.get((key, generation))
+        if future is None:
+            future = self._in_flight[key, generation] = self._executor.submit(self._run, key, compute, generation)
+        return future
+
+    def submit(self, key, compute, generation=None):
+        """
+        Future of the result for `key`, computing it with `compute()` only when needed
+
+        Errors are not cached: the callers waiting on a failed computation get the exception.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] == generation:
+                value, computed_at, _ = entry
+                age = time.monotonic() - computed_at
+                if age < self.max_stale:
+                    if age < self.ttl:
+                        self.hits += 1
+                    else:
+                        self.stale_hits += 1
+                        self._start(key, compute, generation)
+                    done = Future()
+                    done.set_result(value)
+                    return done
+            self.misses += 1
+            return self._start(key, compute, generation)
+
+    def get(self, key, compute, generation=None):
+        """Blocking submit()"""
+        return self.submit(key, compute, generation).result()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,245 @@
+"""
+Live bot state shared between the bot subprocess and the API process.
+
+The bot process is the only writer of a fixed-layout block in shared memory
+(multiprocessing.shared_memory). It rewrites the block once per candle and on
+every position or order change. Readers in the API process copy it out without
+locks, IPC round-trips or file I/O.
+
+Consistency uses a seqlock. The first 8 bytes are a sequence number that the
+writer makes odd before changing the payload and even again afterwards. A
+reader copies the payload between two reads of the sequence number and retries
+if they differ or are odd, so it never returns a torn snapshot.
+"""
+import atexit
+import math
+import multiprocessing
+import os
+import struct
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+BOT_STATE_NAME = os.getenv('BOT_STATE_SHM', 'ha_bot_state')
+READ_RETRIES = 1000  # Attempts before a reader gives up on a block that keeps changing
+
+_SEQ = struct.Struct('<Q')
+# (field, struct code); strings are NUL-padded ASCII, missing numbers are NaN / 0
+STATE_FIELDS = (
+    ('updated_at', 'q'), ('pid', 'q'), ('candles', 'q'),
+    ('symbol', '16s'), ('interval', '8s'), ('position', '16s'),
+    ('candle_time', 'q'), ('open', 'd'), ('high', 'd'), ('low', 'd'), ('close', 'd'),
+    ('ha_open', 'd'), ('ha_high', 'd'), ('ha_low', 'd'), ('ha_close', 'd'),
+    ('signal', '8s'), ('entry', 'd'), ('stop_loss', 'd'),
+    ('buy_order_id', 'q'), ('buy_price', 'd'), ('buy_stop_price', 'd'), ('buy_quantity', 'd'), ('buy_status', '24s'),
+    ('sell_order_id', 'q'), ('sell_price', 'd'), ('sell_stop_price', 'd'), ('sell_quantity', 'd'), ('sell_status', '24s'),
+    ('buy_filled_price', 'd'), ('candle_order_created_at', 'q'),
+)
+_PAYLOAD = struct.Struct('<' + ''.join(code for _, code in STATE_FIELDS))
+STATE_BLOCK_SIZE = _SEQ.size + _PAYLOAD.size
+
+
+def _encode(name, code, value):
+    if code.endswith('s'):
+        return str(value or '').encode('ascii', 'replace')[:int(code[:-1])]
+    if code == 'd':
+        return float('nan') if value is None else float(value)
+    return int(value or 0)
+
+
+def _decode(name, code, value):
+    if code.endswith('s'):
+        return value.rstrip(b'\0').decode('ascii') or None
+    if code == 'd':
+        return None if math.isnan(value) else value
+    return value if value or name in ('candles', 'pid') else None
+
+
+class SharedStateBlock:
+    """
+    Seqlock-protected state block in shared memory
+
+    Args:
+        name (str): Shared memory name
+        create (bool): Create the block (the API process, or a standalone bot) instead of attaching
+    """
+
+    def __init__(self, name=BOT_STATE_NAME, create=False):
+        if create:
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=STATE_BLOCK_SIZE)
+            except FileExistsError:
+                # Left behind by a process that was killed; reuse it unless the layout grew
+                self.shm = shared_memory.SharedMemory(name=name)
+                if self.shm.size < STATE_BLOCK_SIZE:
+                    self.shm.close()
+                    self.shm.unlink()
+                    self.shm = shared_memory.SharedMemory(name=name, create=True, size=STATE_BLOCK_SIZE)
+            _SEQ.pack_into(self.shm.buf, 0, 0)
+            _PAYLOAD.pack_into(self.shm.buf, _SEQ.size, *(_encode(n, c, None) for n, c in STATE_FIELDS))
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            if multiprocessing.parent_process() is None:
+                # Attaching registers the block with this process's resource tracker, which would
+                # unlink it at exit; the block belongs to the (separately started) process that created it
+                resource_tracker.unregister(self.shm._name, 'shared_memory')
+        self.owner = create
+        self._seq = _SEQ.unpack_from(self.shm.buf, 0)[0] & ~1
+
+    def write(self, values):
+        """Replace the whole payload (single writer)"""
+        payload = _PAYLOAD.pack(*(_encode(n, c, values.get(n)) for n, c in STATE_FIELDS))
+        buf = self.shm.buf
+        self._seq += 1
+        _SEQ.pack_into(buf, 0, self._seq)  # Odd: write in progress
+        buf[_SEQ.size:STATE_BLOCK_SIZE] = payload
+        self._seq += 1
+        _SEQ.pack_into(buf, 0, self._seq)  # Even: consistent
+
+    def read(self):
+        """Consistent copy of the payload as a dict, or None if the writer never let go"""
+        buf = self.shm.buf
+        for attempt in range(READ_RETRIES):
+            before = _SEQ.unpack_from(buf, 0)[0]
+            if not before & 1:
+                payload = bytes(buf[_SEQ.size:STATE_BLOCK_SIZE])
+                if _SEQ.unpack_from(buf, 0)[0] == before:
+                    values = _PAYLOAD.unpack(payload)
+                    return {n: _decode(n, c, v) for (n, c), v in zip(STATE_FIELDS, values)}
+            if attempt % 64 == 63:
+                time.sleep(0)  # Let a descheduled writer finish
+        return None
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+# Writer side (bot process)
+
+_writer = None
+_state = {}
+
+
+def attach_writer(name=BOT_STATE_NAME, symbol=None, interval=None):
+    """Publish this process's state to the block `name`, creating it if the API did not"""
+    global _writer
+    try:
+        _writer = SharedStateBlock(name)
+    except FileNotFoundError:
+        _writer = SharedStateBlock(name, create=True)
+    _state.clear()
+    _state.update(pid=os.getpid(), symbol=symbol and symbol.upper(), interval=interval, candles=0)
+    _flush()
+    return _writer
+
+
+def detach_writer():
+    global _writer
+    if _writer is not None:
+        _writer.close()
+        _writer = None
+
+
+def _flush():
+    if _writer is not None:
+        _state['updated_at'] = int(time.time() * 1000)
+        _writer.write(_state)
+
+
+def _order_fields(prefix, order):
+    order = order or {}
+    return {
+        f'{prefix}_order_id': order.get('orderId'),
+        f'{prefix}_price': order.get('price'),
+        f'{prefix}_stop_price': order.get('stopPrice'),
+        f'{prefix}_quantity': order.get('origQty'),
+        f'{prefix}_status': order.get('status') if order else None,
+    }
+
+
+def publish_stream(symbol, interval):
+    """The market the bot switched to (its candle count restarts)"""
+    if _writer is None:
+        return
+    _state.update(symbol=symbol and symbol.upper(), interval=interval, candles=0, candle_time=None)
+    _flush()
+
+
+def publish_bot_state(position, active_buy_order, active_sell_order, buy_filled_price, candle_order_created_at):
+    """Position and order state (called by utils.bot_state on every change)"""
+    if _writer is None:
+        return
+    _state['position'] = position
+    _state.update(_order_fields('buy', active_buy_order))
+    _state.update(_order_fields('sell', active_sell_order))
+    _state['buy_filled_price'] = buy_filled_price
+    _state['candle_order_created_at'] = candle_order_created_at
+    _flush()
+
+
+def publish_candle(row):
+    """The last processed candle with its HA values and strategy levels (once per candle)"""
+    if _writer is None:
+        return
+    _state['candles'] = _state.get('candles', 0) + 1
+    _state['candle_time'] = row.get('timestamp')
+    for name in ('open', 'high', 'low', 'close', 'ha_open', 'ha_high', 'ha_low', 'ha_close', 'signal', 'entry', 'stop_loss'):
+        _state[name] = row.get(name)
+    _flush()
+
+
+# Reader side (API process)
+
+_reader = None
+
+
+def create_state_block(name=BOT_STATE_NAME):
+    """Create (and own) the block before starting the bot subprocess; reads in this process use it directly"""
+    global _reader
+    if _reader is None or not _reader.owner:
+        _reader = SharedStateBlock(name, create=True)
+        atexit.register(_reader.close)
+    return _reader
+
+
+def read_bot_state(name=BOT_STATE_NAME):
+    """Latest state published by the bot, or None if no block exists"""
+    global _reader
+    if _reader is None:
+        try:
+            _reader = SharedStateBlock(name)
+        except FileNotFoundError:
+            return None
+    return _reader.read()
+
+
+def format_bot_state(state):
+    """Nest the flat block fields for API responses"""
+    if state is None:
+        return None
+
+    def order(prefix):
+        if state[f'{prefix}_order_id'] is None:
+            return None
+        return {key: state[f'{prefix}_{key}'] for key in ('order_id', 'price', 'stop_price', 'quantity', 'status')}
+
+    return {
+        'updated_at': state['updated_at'],
+        'pid': state['pid'],
+        'symbol': state['symbol'],
+        'interval': state['interval'],
+        'position': state['position'],
+        'candles_processed': state['candles'],
+        'last_candle': None if state['candle_time'] is None else {
+            key: state[key] for key in ('candle_time', 'open', 'high', 'low', 'close', 'ha_open', 'ha_high',
+                                        'ha_low', 'ha_close', 'signal', 'entry', 'stop_loss')
+        },
+        'active_buy_order': order('buy'),
+        'active_sell_order': order('sell'),
+        'buy_filled_price': state['buy_filled_price'],
+        'candle_order_created_at': state['candle_order_created_at'],
+    }
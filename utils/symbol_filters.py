@@ -0,0 +1,238 @@
+"""
+Cached exchange filters and integer tick/step arithmetic for futures symbols.
+
+Prices and quantities are kept as integer multiples of the symbol's tickSize and
+stepSize, so rounding never suffers from float error and orders are sent to the
+exchange as exact decimal strings for any symbol precision.
+"""
+import math
+import time
+from decimal import Decimal
+import numpy as np
+from functools import total_ordering
+from utils.binance_client import create_client
+from utils.logger import log_error
+
+# Created on first exchange info request, so the grid math can be used offline (e.g. backtests)
+client = None
+
+# How long cached exchange info stays valid (filters change very rarely)
+FILTERS_REFRESH_SECONDS = 3600
+
+# Scaled values closer than this to an integer are treated as exact (absorbs float error)
+SNAP_EPSILON = 1e-6
+
+
+class TickGrid:
+    """
+    An exchange increment (tickSize or stepSize) as an integer grid.
+
+    A value on the grid is stored as a whole number of increments. The increment
+    itself is represented exactly as `unit / scale`, where `scale` is a power of ten.
+    """
+    __slots__ = ('increment', 'decimals', 'scale', 'unit')
+
+    def __init__(self, increment):
+        normalized = Decimal(str(increment)).normalize()
+        if normalized <= 0:
+            raise ValueError(f"Invalid increment: {increment}")
+        self.decimals = max(0, -normalized.as_tuple().exponent)
+        self.scale = 10 ** self.decimals
+        self.unit = int(normalized * self.scale)
+        self.increment = self.unit / self.scale
+
+    def _scaled(self, value):
+        # Snap to the decimal grid first, so 0.29 * 100 becomes 29 instead of 28.999999999999996
+        scaled = float(value) * self.scale
+        nearest = round(scaled)
+        return nearest if abs(scaled - nearest) < SNAP_EPSILON else scaled
+
+    def floor(self, value) -> 'GridValue':
+        """Round a float down to the grid"""
+        scaled = self._scaled(value)
+        units = scaled // self.unit if isinstance(scaled, int) else math.floor(scaled / self.unit)
+        return GridValue(units, self)
+
+    def ceil(self, value) -> 'GridValue':
+        """Round a float up to the grid"""
+        scaled = self._scaled(value)
+        units = -(-scaled // self.unit) if isinstance(scaled, int) else math.ceil(scaled / self.unit)
+        return GridValue(units, self)
+
+    def nearest(self, value) -> 'GridValue':
+        """Round a float to the closest grid value (halves round up)"""
+        return GridValue(math.floor(self._scaled(value) / self.unit + 0.5), self)
+
+    def _scaled_array(self, values):
+        scaled = np.asarray(values, dtype=np.float64) * self.scale
+        nearest = np.rint(scaled)
+        return np.where(np.abs(scaled - nearest) < SNAP_EPSILON, nearest, scaled)
+
+    def floor_units(self, values) -> np.ndarray:
+        """Vectorized floor(): round an array down to the grid, as int64 increments"""
+        return np.floor(self._scaled_array(values) / self.unit).astype(np.int64)
+
+    def nearest_units(self, values) -> np.ndarray:
+        """Vectorized nearest(): round an array to the closest grid value, as int64 increments"""
+        return np.floor(self._scaled_array(values) / self.unit + 0.5).astype(np.int64)
+
+    def to_floats(self, units) -> np.ndarray:
+        return np.asarray(units, dtype=np.int64) * self.unit / self.scale
+
+    def from_units(self, units: int) -> 'GridValue':
+        return GridValue(units, self)
+
+    def to_float(self, units: int) -> float:
+        return units * self.unit / self.scale
+
+    def to_str(self, units: int) -> str:
+        """Exact decimal string for a number of increments, as the exchange expects it"""
+        value = units * self.unit
+        sign = '-' if value < 0 else ''
+        whole, fraction = divmod(abs(value), self.scale)
+        if not self.decimals:
+            return f"{sign}{whole}"
+        return f"{sign}{whole}.{fraction:0{self.decimals}d}"
+
+    def __repr__(self):
+        return f"TickGrid({self.to_str(1)})"
+
+
+@total_ordering
+class GridValue:
+    """A price or quantity stored as an integer number of ticks/steps"""
+    __slots__ = ('units', 'grid')
+
+    def __init__(self, units: int, grid: TickGrid):
+        self.units = int(units)
+        self.grid = grid
+
+    def __float__(self):
+        return self.grid.to_float(self.units)
+
+    def __str__(self):
+        return self.grid.to_str(self.units)
+
+    def __repr__(self):
+        return f"GridValue({self.grid.to_str(self.units)})"
+
+    def __eq__(self, other):
+        if not isinstance(other, (GridValue, int, float)):
+            return NotImplemented
+        if isinstance(other, GridValue) and other.grid.scale == self.grid.scale and other.grid.unit == self.grid.unit:
+            return self.units == other.units
+        return float(self) == float(other)
+
+    def __lt__(self, other):
+        if not isinstance(other, (GridValue, int, float)):
+            return NotImplemented
+        if isinstance(other, GridValue) and other.grid.scale == self.grid.scale and other.grid.unit == self.grid.unit:
+            return self.units < other.units
+        return float(self) < float(other)
+
+    def __hash__(self):
+        return hash((self.units, self.grid.unit, self.grid.scale))
+
+    def __add__(self, ticks: int):
+        """Shift by a whole number of ticks/steps"""
+        return GridValue(self.units + int(ticks), self.grid)
+
+    def __sub__(self, ticks: int):
+        return GridValue(self.units - int(ticks), self.grid)
+
+
+class SymbolFilters:
+    """Trading rules of one futures symbol, parsed once from exchange info"""
+
+    def __init__(self, symbol_info: dict):
+        self.symbol = symbol_info['symbol']
+        self.min_price = self.max_price = None
+        self.min_qty = self.max_qty = None
+        self.market_min_qty = self.market_max_qty = None
+        self.min_notional = 20.0  # Binance's typical minimum if the filter is missing
+        self.multiplier_up = self.multiplier_down = None
+        self.max_num_orders = None
+        price_tick = qty_step = None
+
+        for f in symbol_info.get('filters', []):
+            filter_type = f.get('filterType')
+            if filter_type == 'PRICE_FILTER':
+                price_tick = f['tickSize']
+                self.min_price = float(f.get('minPrice', 0)) or None
+                self.max_price = float(f.get('maxPrice', 0)) or None
+            elif filter_type == 'LOT_SIZE':
+                qty_step = f['stepSize']
+                self.min_qty = float(f.get('minQty', 0)) or None
+                self.max_qty = float(f.get('maxQty', 0)) or None
+            elif filter_type == 'MARKET_LOT_SIZE':
+                self.market_min_qty = float(f.get('minQty', 0)) or None
+                self.market_max_qty = float(f.get('maxQty', 0)) or None
+            elif filter_type == 'MIN_NOTIONAL':
+                self.min_notional = float(f.get('notional', f.get('minNotional', self.min_notional)))
+            elif filter_type == 'PERCENT_PRICE':
+                self.multiplier_up = float(f['multiplierUp'])
+                self.multiplier_down = float(f['multiplierDown'])
+            elif filter_type == 'MAX_NUM_ORDERS':
+                self.max_num_orders = int(f['limit'])
+
+        if price_tick is None:
+            raise ValueError(f"Tick size not found for symbol {self.symbol}")
+        self.price = TickGrid(price_tick)
+        self.qty = TickGrid(qty_step if qty_step is not None else f"1e-{symbol_info.get('quantityPrecision', 8)}")
+
+    @property
+    def tick_size(self) -> float:
+        return self.price.increment
+
+    @property
+    def step_size(self) -> float:
+        return self.qty.increment
+
+    def price_str(self, price, rounding='floor') -> str:
+        """Format a price for the exchange after rounding it to the tick grid"""
+        return str(getattr(self.price, rounding)(price))
+
+    def qty_str(self, quantity) -> str:
+        """Format a quantity for the exchange, always rounding down to the step grid"""
+        return str(self.qty.floor(quantity))
+
+    def __repr__(self):
+        return f"SymbolFilters({self.symbol}, tick={self.price.to_str(1)}, step={self.qty.to_str(1)})"
+
+
+# Module level cache: symbol -> SymbolFilters
+filters_cache = {}
+filters_loaded_at = 0.0
+
+
+def refresh_symbol_filters():
+    """Reload the filters of every futures symbol with a single exchange info request"""
+    global client, filters_cache, filters_loaded_at
+    if client is None:
+        client = create_client()
+    info = client.futures_exchange_info()
+    cache = {}
+    for symbol_info in info.get('symbols', []):
+        try:
+            cache[symbol_info['symbol']] = SymbolFilters(symbol_info)
+        except (KeyError, ValueError) as e:
+            log_error(f"Skipping filters for {symbol_info.get('symbol')}: {e}")
+    filters_cache = cache
+    filters_loaded_at = time.time()
+    return filters_cache
+
+
+def get_symbol_filters(symbol: str) -> SymbolFilters:
+    """
+    Get the cached filters for a symbol, refreshing exchange info when stale
+
+    Raises:
+        ValueError: If the symbol is not listed on the exchange
+    """
+    symbol = symbol.upper()
+    if symbol not in filters_cache or time.time() - filters_loaded_at > FILTERS_REFRESH_SECONDS:
+        refresh_symbol_filters()
+    try:
+        return filters_cache[symbol]
+    except KeyError:
+        raise ValueError(f"Symbol {symbol} not found in exchange info")
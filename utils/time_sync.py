@@ -0,0 +1,165 @@
+"""
+Background synchronisation with the Binance Futures server clock.
+
+Keeps a smoothed clock offset, the measured round-trip time and the drift rate of
+the local clock. The offset is pushed into every attached python-binance client
+(`timestamp_offset`, used when signing requests) and `server_now_ms()` gives the
+exchange's current time for interval alignment and candle-close checks.
+"""
+import threading
+import time
+import weakref
+import requests
+from utils.config import MODE, SIM, SIM_URL
+from utils.logger import log_websocket, log_error
+
+FUTURES_MAINNET_TIME_URL = "https://fapi.binance.com/fapi/v1/time"
+FUTURES_TESTNET_TIME_URL = "https://testnet.binancefuture.com/fapi/v1/time"
+
+SYNC_INTERVAL_SECONDS = 60  # How often the background thread re-measures the offset
+SAMPLES_PER_SYNC = 3  # Requests per sync; the one with the lowest round-trip time wins
+OFFSET_SMOOTHING = 0.3  # EWMA weight of a new offset sample
+DRIFT_SMOOTHING = 0.2  # EWMA weight of a new drift sample
+DRIFT_WINDOW_SECONDS = 600  # Minimum time span a drift sample is measured over
+MAX_OFFSET_WARNING_MS = 1000  # Offsets above this are reported as an unsynchronised clock
+
+
+class TimeSync:
+    """Tracks the offset between the local clock and the exchange clock"""
+
+    def __init__(self, time_url, interval=SYNC_INTERVAL_SECONDS):
+        self.time_url = time_url
+        self.interval = interval
+        self.offset_ms = 0.0  # server time - local time
+        self.rtt_ms = None  # smoothed round-trip time of the time request
+        self.drift_ms_per_hour = 0.0  # how fast the offset changes
+        self.samples = 0
+        self.last_sync = None  # time.monotonic() of the last accepted sample
+        self._drift_anchor = None  # (time.monotonic(), smoothed offset) the next drift sample is measured from
+        self._lock = threading.Lock()
+        self._clients = weakref.WeakSet()
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def measure(self):
+        """
+        Take one offset sample
+
+        Returns:
+            (offset_ms, rtt_ms) where the offset assumes a symmetric network path
+        """
+        local_before = time.time()
+        response = requests.get(self.time_url, timeout=5)
+        local_after = time.time()
+        response.raise_for_status()
+        server_time = response.json()['serverTime']
+        rtt_ms = (local_after - local_before) * 1000
+        offset_ms = server_time - (local_before + local_after) * 500
+        return offset_ms, rtt_ms
+
+    def sync_now(self, samples=SAMPLES_PER_SYNC):
+        """Measure the offset now and fold it into the smoothed estimate"""
+        best = min((self.measure() for _ in range(samples)), key=lambda sample: sample[1])
+        self._update(*best)
+        return self.offset_ms
+
+    def _update(self, offset_ms, rtt_ms):
+        now = time.monotonic()
+        with self._lock:
+            if self.samples == 0:
+                self.offset_ms = offset_ms
+                self.rtt_ms = rtt_ms
+                self._drift_anchor = (now, offset_ms)
+            else:
+                predicted = self.offset_ms + self.drift_ms_per_hour * (now - self.last_sync) / 3600
+                self.offset_ms = predicted + OFFSET_SMOOTHING * (offset_ms - predicted)
+                self.rtt_ms += OFFSET_SMOOTHING * (rtt_ms - self.rtt_ms)
+                # Drift is measured over a long window so jitter between close samples doesn't dominate it
+                anchor_time, anchor_offset = self._drift_anchor
+                if now - anchor_time >= DRIFT_WINDOW_SECONDS:
+                    measured_drift = (self.offset_ms - anchor_offset) / ((now - anchor_time) / 3600)
+                    self.drift_ms_per_hour += DRIFT_SMOOTHING * (measured_drift - self.drift_ms_per_hour)
+                    self._drift_anchor = (now, self.offset_ms)
+            self.samples += 1
+            self.last_sync = now
+            offset = int(round(self.offset_ms))
+        for client in list(self._clients):
+            client.timestamp_offset = offset
+
+    def current_offset_ms(self):
+        """Smoothed offset, extrapolated with the drift rate since the last sample"""
+        with self._lock:
+            if self.last_sync is None:
+                return self.offset_ms
+            return self.offset_ms + self.drift_ms_per_hour * (time.monotonic() - self.last_sync) / 3600
+
+    def now_ms(self):
+        """Current exchange time in epoch milliseconds"""
+        return int(time.time() * 1000 + self.current_offset_ms())
+
+    def attach_client(self, client):
+        """Keep a python-binance client's signing timestamp offset in sync"""
+        self._clients.add(client)
+        client.timestamp_offset = int(round(self.current_offset_ms()))
+        return client
+
+    def status(self):
+        return {
+            'offset_ms': round(self.current_offset_ms(), 3),
+            'rtt_ms': round(self.rtt_ms, 3) if self.rtt_ms is not None else None,
+            'drift_ms_per_hour': round(self.drift_ms_per_hour, 3),
+            'samples': self.samples,
+        }
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.sync_now()
+            except Exception as e:
+                log_error(f"Time sync failed: {e}")
+            self._stop_event.wait(self.interval)
+
+    def start(self):
+        """Start the background sync thread (no-op if already running)"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name='time-sync', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+
+
+time_sync = TimeSync(f"{SIM_URL}/fapi/v1/time" if SIM else FUTURES_TESTNET_TIME_URL if MODE else FUTURES_MAINNET_TIME_URL)
+
+
+def start_time_sync():
+    return time_sync.start()
+
+
+def server_now_ms():
+    """Current Binance server time in epoch milliseconds"""
+    return time_sync.now_ms()
+
+
+def attach_client(client):
+    return time_sync.attach_client(client)
+
+
+def resync_time():
+    """Re-measure the offset immediately (e.g. after a -1021 timestamp error)"""
+    try:
+        time_sync.sync_now()
+    except Exception as e:
+        log_error(f"Time resync failed: {e}")
+    return time_sync.current_offset_ms()
+
+
+def log_time_sync_status():
+    """Log how far the local clock is from the Binance server clock"""
+    status = time_sync.status()
+    if abs(status['offset_ms']) > MAX_OFFSET_WARNING_MS:
+        log_websocket(f"⚠️ Local time is off by {status['offset_ms']:.0f} ms from Binance server time; signing and candle alignment use the server offset (rtt {status['rtt_ms']} ms).")
+    else:
+        log_websocket(f"⏰ Local time is synchronized with Binance server (offset: {status['offset_ms']:.0f} ms, rtt: {status['rtt_ms']} ms, drift: {status['drift_ms_per_hour']} ms/h)")
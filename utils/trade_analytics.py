@@ -0,0 +1,326 @@
+"""
+Round trips and performance statistics from the filled orders in order_book.json.
+
+Fills are paired into round trips in one pass over the order book, keyed by
+(symbol, position_side): opening fills (BUY for LONG, SELL for SHORT) build up a
+position at its average price, closing fills reduce it, and a round trip ends when
+the position is flat again. The trades table is a set of column arrays, cached in
+data/trades.npz together with the (mtime, size) of the order book it was built from,
+so it is only rebuilt after new fills.
+
+Statistics (win rate, expectancy, drawdown, holding time, MAE/MFE) are computed with
+NumPy over the columns. MAE/MFE come from the kline store: the lowest low and highest
+high of the candles the trade spans, at the interval the bot traded on.
+"""
+import datetime
+import os
+import numpy as np
+from utils.backtest import DEFAULT_FEE_RATE
+from utils.logger import log_api, log_error
+from utils.order_storage import ORDER_BOOK_FILE, DATA_DIR, load_json_file
+
+TRADES_FILE = os.path.join(DATA_DIR, 'trades.npz')
+TRADE_FIELDS = ('symbol', 'position_side', 'interval', 'entry_time', 'exit_time', 'entry_price', 'exit_price',
+                'quantity', 'pnl', 'fees', 'net_pnl', 'holding_ms', 'fills')
+TRADES_VERSION = 2  # Bump when pairing or pricing changes, so stored tables are rebuilt
+
+
+def _fill_time(order):
+    """Fill time in ms: the exchange's updateTime, else when the bot recorded it"""
+    update_time = order.get('updateTime')
+    if update_time:
+        return int(update_time)
+    for value in (order.get('meta', {}).get('recorded_at'), order.get('saved_at')):
+        if value:
+            try:
+                return int(datetime.datetime.fromisoformat(value).timestamp() * 1000)
+            except (TypeError, ValueError):
+                continue
+    return None
+
+
+def _fill_price(order):
+    meta = order.get('meta', {})
+    # avgPrice is the actual fill; executed_price of a stop-loss sell is only its limit price
+    for value in (order.get('avgPrice'), meta.get('executed_price'), meta.get('filled_price'), order.get('price'),
+                  order.get('stopPrice')):
+        if not value:
+            continue
+        try:
+            price = float(value)
+        except (TypeError, ValueError):
+            continue
+        if price > 0:
+            return price
+    return None
+
+
+def pair_round_trips(orders, fee_rate=DEFAULT_FEE_RATE):
+    """
+    Pair filled orders into round trips (one pass, orders in the order they were filled)
+
+    Fees are estimated at `fee_rate` of the notional of every fill, like the backtester.
+
+    Returns:
+        tuple: (trades as column arrays (see TRADE_FIELDS), number of fills that could not be paired)
+    """
+    fills = []
+    for order in orders:
+        if order.get('status') != 'FILLED':
+            continue
+        meta = order.get('meta', {})
+        symbol = (order.get('symbol') or meta.get('symbol') or '').upper()
+        side = (meta.get('order_type') or order.get('side') or '').upper()
+        position_side = (meta.get('position_side') or order.get('positionSide') or 'LONG').upper()
+        time_ms = _fill_time(order)
+        price = _fill_price(order)
+        try:
+            quantity = float(order.get('executedQty') or order.get('origQty') or 0)
+        except (TypeError, ValueError):
+            quantity = 0.0
+        if not symbol or side not in ('BUY', 'SELL') or time_ms is None or price is None or quantity <= 0:
+            continue
+        fills.append((time_ms, symbol, position_side, side, price, quantity, meta.get('time_interval') or ''))
+    fills.sort(key=lambda fill: fill[0])  # Stable: fills at the same ms keep their order book order
+
+    # (symbol, position_side) -> [open quantity, open cost, first fill ms, interval, fills,
+    #                              entered quantity, entry notional, exit notional, realized pnl]
+    open_positions = {}
+    rows = []
+    unpaired = 0
+    for time_ms, symbol, position_side, side, price, quantity, interval in fills:
+        key = (symbol, position_side)
+        position = open_positions.get(key)
+        if (side == 'BUY') == (position_side == 'LONG'):  # Opening fill
+            if position is None:
+                position = open_positions[key] = [0.0, 0.0, time_ms, interval, 0, 0.0, 0.0, 0.0, 0.0]
+            position[0] += quantity
+            position[1] += quantity * price
+            position[4] += 1
+            position[5] += quantity
+            position[6] += quantity * price
+            continue
+        if position is None:
+            unpaired += 1  # Closing fill without a recorded entry
+            continue
+        closed = min(quantity, position[0])
+        entry_price = position[1] / position[0]
+        position[0] -= closed
+        position[1] -= closed * entry_price
+        position[4] += 1
+        position[7] += closed * price
+        position[8] += closed * (price - entry_price) * (1 if position_side == 'LONG' else -1)
+        if position[0] > position[5] * 1e-9:
+            continue
+        entered = position[5]
+        fees = fee_rate * (position[6] + position[7])
+        rows.append((symbol, position_side, position[3], position[2], time_ms, position[6] / entered,
+                     position[7] / entered, entered, position[8], fees, position[8] - fees, time_ms - position[2],
+                     position[4]))
+        del open_positions[key]
+
+    dtypes = (str, str, str, np.int64, np.int64, np.float64, np.float64, np.float64, np.float64, np.float64,
+              np.float64, np.int64, np.int64)
+    trades = {name: np.array([row[i] for row in rows], dtype=dtype)
+              for i, (name, dtype) in enumerate(zip(TRADE_FIELDS, dtypes))}
+    return trades, unpaired
+
+
+def _order_book_stamp(path):
+    stat = os.stat(path)
+    return TRADES_VERSION, stat.st_mtime_ns, stat.st_size
+
+
+_cache = {}  # path -> (order book stamp, trades, unpaired)
+
+
+def load_trades(order_book_path=ORDER_BOOK_FILE, trades_path=TRADES_FILE):
+    """
+    The trades table of the order book, rebuilt only when the order book changed
+
+    Returns:
+        tuple: (trades as column arrays, number of unpaired closing fills)
+    """
+    try:
+        stamp = _order_book_stamp(order_book_path)
+    except OSError:
+        return pair_round_trips([])
+    cached = _cache.get(order_book_path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1], cached[2]
+    trades = unpaired = None
+    try:
+        with np.load(trades_path, allow_pickle=False) as stored:
+            if tuple(stored['stamp'].tolist()) == stamp:
+                trades = {name: stored[name] for name in TRADE_FIELDS}
+                unpaired = int(stored['unpaired'])
+    except (OSError, KeyError, ValueError):
+        pass
+    if trades is None:
+        trades, unpaired = pair_round_trips(load_json_file(order_book_path))
+        try:
+            tmp_path = trades_path + '.tmp.npz'
+            np.savez(tmp_path, stamp=np.array(stamp, dtype=np.int64), unpaired=unpaired, **trades)
+            os.replace(tmp_path, trades_path)
+        except OSError as e:
+            log_error(f"Could not save the trades table: {e}")
+        log_api(f"Paired {len(trades['symbol'])} round trips from the order book ({unpaired} unpaired fills)")
+    _cache[order_book_path] = (stamp, trades, unpaired)
+    return trades, unpaired
+
+
+def select_trades(trades, symbol=None, start_ms=None, end_ms=None):
+    """Trades of `symbol` closed within [start_ms, end_ms] (boolean mask over the columns)"""
+    mask = np.ones(len(trades['symbol']), dtype=bool)
+    if symbol:
+        mask &= trades['symbol'] == symbol.upper()
+    if start_ms is not None:
+        mask &= trades['exit_time'] >= start_ms
+    if end_ms is not None:
+        mask &= trades['exit_time'] <= end_ms
+    return {name: column[mask] for name, column in trades.items()}
+
+
+def trade_excursions(trades):
+    """
+    Maximum adverse and favourable excursion of every trade in quote currency (MAE <= 0 <= MFE)
+
+    Uses the klines of the interval each trade was taken on that are already in the local
+    store; nothing is downloaded. Trades without an interval or stored klines get NaN.
+    """
+    from utils.kline_store import KlineStore
+    from utils.interval_calendar import SUPPORTED_INTERVALS, align, step
+
+    count = len(trades['symbol'])
+    mae = np.full(count, np.nan)
+    mfe = np.full(count, np.nan)
+    if not count:
+        return mae, mfe
+    groups = {}
+    for i, key in enumerate(zip(trades['symbol'].tolist(), trades['interval'].tolist())):
+        groups.setdefault(key, []).append(i)
+    for (symbol, interval), indices in groups.items():
+        if interval not in SUPPORTED_INTERVALS:
+            continue
+        indices = np.asarray(indices)
+        entry_time = trades['entry_time'][indices]
+        exit_time = trades['exit_time'][indices]
+        try:
+            candles = KlineStore(symbol, interval).arrays(align(int(entry_time.min()), interval),
+                                                          step(align(int(exit_time.max()), interval), interval, 1))
+        except Exception as e:
+            log_error(f"No klines for the excursions of {symbol} {interval} trades: {e}")
+            continue
+        open_time = np.asarray(candles['open_time'])
+        if not len(open_time):
+            continue
+        # Candles from the one containing the entry to the one containing the exit
+        lo = np.clip(np.searchsorted(open_time, entry_time, side='right') - 1, 0, len(open_time) - 1)
+        hi = np.maximum(np.searchsorted(open_time, exit_time, side='right'), lo + 1)
+        bounds = np.column_stack((lo, hi)).ravel()
+        # reduceat over [lo, hi) pairs; a trailing element keeps hi == len valid
+        lows = np.minimum.reduceat(np.append(candles['low'], np.inf), bounds)[::2]
+        highs = np.maximum.reduceat(np.append(candles['high'], -np.inf), bounds)[::2]
+        entry_price = trades['entry_price'][indices]
+        quantity = trades['quantity'][indices]
+        long = trades['position_side'][indices] == 'LONG'
+        adverse = np.where(long, lows - entry_price, entry_price - highs) * quantity
+        favourable = np.where(long, highs - entry_price, entry_price - lows) * quantity
+        # Only trades whose entry and exit candles are both stored
+        covered = (open_time[lo] == align(entry_time, interval)) & (open_time[hi - 1] == align(exit_time, interval))
+        mae[indices[covered]] = np.minimum(adverse, 0.0)[covered]
+        mfe[indices[covered]] = np.maximum(favourable, 0.0)[covered]
+    return mae, mfe
+
+
+def trade_stats(trades, excursions=False):
+    """Summary statistics of a trades table (column arrays), in exit time order"""
+    order = np.argsort(trades['exit_time'], kind='stable')
+    net = trades['net_pnl'][order]
+    count = len(net)
+    wins = net[net > 0]
+    losses = net[net <= 0]
+    gross_profit = float(wins.sum())
+    gross_loss = float(abs(losses.sum()))
+    if count:
+        equity = np.cumsum(net)
+        peak = np.maximum.accumulate(np.maximum(equity, 0.0))
+        drawdown = peak - equity
+        worst = int(np.argmax(drawdown))
+        max_drawdown = float(drawdown[worst])
+        holding_minutes = trades['holding_ms'] / 60000
+    else:
+        max_drawdown = 0.0
+    win_rate = len(wins) / count if count else 0.0
+    avg_win = float(wins.mean()) if len(wins) else 0.0
+    avg_loss = float(losses.mean()) if len(losses) else 0.0
+    stats = {
+        'trades': int(count),
+        'wins': int(len(wins)),
+        'losses': int(len(losses)),
+        'win_rate': win_rate * 100,
+        'gross_profit': gross_profit,
+        'gross_loss': gross_loss,
+        # None rather than inf without losing trades: the stats are served as JSON
+        'profit_factor': gross_profit / gross_loss if gross_loss > 0 else (None if gross_profit > 0 else 0.0),
+        'net_pnl': float(net.sum()),
+        'total_fees': float(trades['fees'].sum()),
+        'avg_win': avg_win,
+        'avg_loss': avg_loss,
+        'expectancy': win_rate * avg_win + (1 - win_rate) * avg_loss,
+        'best_trade': float(net.max()) if count else 0.0,
+        'worst_trade': float(net.min()) if count else 0.0,
+        'max_drawdown': max_drawdown,
+        'avg_holding_minutes': float(holding_minutes.mean()) if count else 0.0,
+        'median_holding_minutes': float(np.median(holding_minutes)) if count else 0.0,
+    }
+    if excursions:
+        mae, mfe = trade_excursions(trades)
+        known = ~np.isnan(mae)
+        stats['avg_mae'] = float(mae[known].mean()) if known.any() else None
+        stats['avg_mfe'] = float(mfe[known].mean()) if known.any() else None
+        stats['worst_mae'] = float(mae[known].min()) if known.any() else None
+        # Share of the best price move that was kept, over trades that moved in their favour
+        favourable = known & (mfe > 0)
+        stats['mfe_capture_pct'] = (float(np.mean(trades['pnl'][favourable] / mfe[favourable]) * 100)
+                                    if favourable.any() else None)
+    return stats
+
+
+def trade_records(trades, limit=None):
+    """Trades as a list of dicts, latest exit last (the last `limit` if given)"""
+    order = np.argsort(trades['exit_time'], kind='stable')
+    if limit is not None:
+        order = order[-limit:] if limit > 0 else order[:0]
+    return [{name: trades[name][i].item() for name in TRADE_FIELDS} for i in order]
+
+
+def analyze_trades(symbol=None, days=30, start_date=None, end_date=None, tz='UTC', limit=50, excursions=False):
+    """
+    Statistics and the latest trades closed in a period, with the same date handling as the PnL summary
+
+    Args:
+        symbol (str, optional): Only trades of this symbol
+        days (int): Number of days to look back (ignored if start_date and end_date are provided)
+        start_date (str, optional): Start date in 'YYYY-MM-DD' format
+        end_date (str, optional): End date in 'YYYY-MM-DD' format (inclusive)
+        tz (str): Day boundaries of the dates ('UTC' or 'IST')
+        limit (int): Number of trades to return (latest exits)
+        excursions (bool): Also compute MAE/MFE from the locally stored klines
+
+    Raises:
+        ValueError: for an unknown timezone or a malformed date
+    """
+    from utils.income_ledger import date_range_ms
+
+    start_ms, end_ms = date_range_ms(days, start_date, end_date, tz)
+    trades, unpaired = load_trades()
+    selected = select_trades(trades, symbol, start_ms, end_ms)
+    return {
+        'stats': trade_stats(selected, excursions=excursions),
+        'trades': trade_records(selected, limit),
+        'unpaired_fills': unpaired,
+        'start_time': start_ms,
+        'end_time': end_ms,
+        'timezone': tz,
+    }
@@ -0,0 +1,70 @@
+# Fixed-capacity candle history for the websocket client display
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+DISPLAY_BUFFER_CAPACITY = 500  # Candles kept for the on-demand full table
+
+
+class CandleRow:
+    """One displayed candle (fixed attributes, no per-row dict)"""
+
+    __slots__ = ('symbol', 'time', 'timestamp', 'open', 'high', 'low', 'close',
+                 'ha_open', 'ha_high', 'ha_low', 'ha_close',
+                 'signal', 'entry', 'stop_loss', 'position', 'historical')
+
+    def __init__(self, row):
+        for name in self.__slots__:
+            setattr(self, name, row.get(name))
+
+    def get(self, name, default=None):
+        """dict-style access so rows render the same as the formatted candle dicts"""
+        value = getattr(self, name, None)
+        return default if value is None else value
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+
+class CandleRingBuffer:
+    """
+    Array-backed ring buffer of the last `capacity` candles
+
+    Appending overwrites the oldest slot once full, so memory stays constant over uptime.
+    Iteration yields rows oldest first.
+    """
+
+    def __init__(self, capacity=DISPLAY_BUFFER_CAPACITY):
+        self.capacity = capacity
+        self._rows = [None] * capacity
+        self._next = 0  # Slot the next row is written to
+        self._count = 0
+
+    def append(self, row):
+        """Store a formatted candle dict (or CandleRow) and return the stored CandleRow"""
+        candle = row if isinstance(row, CandleRow) else CandleRow(row)
+        self._rows[self._next] = candle
+        self._next = (self._next + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+        return candle
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        start = (self._next - self._count) % self.capacity
+        for i in range(self._count):
+            yield self._rows[(start + i) % self.capacity]
+
+    def latest(self, n=None):
+        """The newest `n` rows (all if omitted), oldest first"""
+        rows = list(self)
+        return rows if n is None else rows[-n:]
+
+    def last(self):
+        return self._rows[(self._next - 1) % self.capacity] if self._count else None
+
+    def clear(self):
+        self._rows = [None] * self.capacity
+        self._next = 0
+        self._count = 0
@@ -1,5 +1,4 @@
 # Table/printing functions for websocket client
-import io
 import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
@@ -11,71 +10,90 @@ RED = '\033[91m'     # Red for SELL signals
 GREY = '\033[90m'    # Light grey for HOLD signals and NONE positions
 RESET = '\033[0m'    # Reset color
 
-def print_ohlcv_table_with_signals(data, show_heikin_ashi=True, return_output=False):
-    # If return_output is True, redirect stdout to a string buffer
-    if return_output:
-        old_stdout = sys.stdout
-        output_buffer = io.StringIO()
-        sys.stdout = output_buffer
-    
-    # Fixed column widths
-    col_widths = {
-        'time': 8,
-        'symbol': 10,
-        'ohlc': 10,
-        'signal': 10,
-        'entry': 10,
-        'sl': 10,
-        'position': 10
-    }
-    
-    # Print table header
-    print("=" * 120)
+# Fixed column widths
+COL_WIDTHS = {
+    'time': 8,
+    'symbol': 10,
+    'ohlc': 10,
+    'signal': 10,
+    'entry': 10,
+    'sl': 10,
+    'position': 10
+}
+HEADER_EVERY_ROWS = 20  # Incremental output repeats the header this often
+
+def format_table_header(show_heikin_ashi=True):
+    """Table header lines (without trailing newline)"""
+    col_widths = COL_WIDTHS
     header = f"{'Time':<{col_widths['time']}} {'Symbol':<{col_widths['symbol']}}"
     if show_heikin_ashi:
         header += f" {'HA_Open':<{col_widths['ohlc']}} {'HA_High':<{col_widths['ohlc']}} {'HA_Low':<{col_widths['ohlc']}} {'HA_Close':<{col_widths['ohlc']}}"
     else:
         header += f" {'Open':<{col_widths['ohlc']}} {'High':<{col_widths['ohlc']}} {'Low':<{col_widths['ohlc']}} {'Close':<{col_widths['ohlc']}}"
     header += f" {'Signal':<{col_widths['signal']}}   {'Entry':<{col_widths['entry']}}   {'SL':<{col_widths['sl']}} {'POSITION':<{col_widths['position']}}"
-    print(header)
-    print("=" * 120)
+    return "\n".join(("=" * 120, header, "=" * 120))
+
+def format_table_row(row, show_heikin_ashi=True):
+    """One table line for a formatted candle (dict or CandleRow)"""
+    col_widths = COL_WIDTHS
+    signal = row.get('signal', 'HOLD')
+    entry = row.get('entry')
+    stop_loss = row.get('stop_loss')
+    position = row.get('position', '-')        # Format strings with proper spacing
+    entry_str = f"{entry:.2f}" if isinstance(entry, (int, float)) and entry is not None else "-"
+    sl_str = f"{stop_loss:.2f}" if isinstance(stop_loss, (int, float)) and stop_loss is not None else "-"
     
-    for row in data:
-        signal = row.get('signal', 'HOLD')
-        entry = row.get('entry')
-        stop_loss = row.get('stop_loss')
-        position = row.get('position', '-')        # Format strings with proper spacing
-        entry_str = f"{entry:.2f}" if isinstance(entry, (int, float)) and entry is not None else "-"
-        sl_str = f"{stop_loss:.2f}" if isinstance(stop_loss, (int, float)) and stop_loss is not None else "-"
-        
-        # Format position display (LONG or NONE) with color
-        position_str = position if position else 'NONE'
-          
-        # Get colored versions using our logger helper functions
-        colored_signal = get_colored_signal(signal)
-        colored_position = get_colored_position(position_str)
-        
-        # Build the line
-        line = f"{row['time']:<{col_widths['time']}} {row['symbol']:<{col_widths['symbol']}}"
-        if show_heikin_ashi:
-            line += f" {row.get('ha_open', '-'):<{col_widths['ohlc']}.2f} {row.get('ha_high', '-'):<{col_widths['ohlc']}.2f}"
-            line += f" {row.get('ha_low', '-'):<{col_widths['ohlc']}.2f} {row.get('ha_close', '-'):<{col_widths['ohlc']}.2f}"
-        else:
-            line += f" {row['open']:<{col_widths['ohlc']}.2f} {row['high']:<{col_widths['ohlc']}.2f}"
-            line += f" {row['low']:<{col_widths['ohlc']}.2f} {row['close']:<{col_widths['ohlc']}.2f}"
-            
-        # Fixed width columns with padding for signal and position text only (not ANSI codes)
-        padding_signal = " " * (col_widths['signal'] - len(signal))
-        padding_entry = " " * (col_widths['entry'] - len(entry_str))
-        padding_sl = " " * (col_widths['sl'] - len(sl_str))
-        padding_position = " " * (col_widths['position'] - len(position_str))
+    # Format position display (LONG or NONE) with color
+    position_str = position if position else 'NONE'
+      
+    # Get colored versions using our logger helper functions
+    colored_signal = get_colored_signal(signal)
+    colored_position = get_colored_position(position_str)
+    
+    # Build the line
+    line = f"{row['time']:<{col_widths['time']}} {row['symbol']:<{col_widths['symbol']}}"
+    if show_heikin_ashi:
+        line += f" {row.get('ha_open', '-'):<{col_widths['ohlc']}.2f} {row.get('ha_high', '-'):<{col_widths['ohlc']}.2f}"
+        line += f" {row.get('ha_low', '-'):<{col_widths['ohlc']}.2f} {row.get('ha_close', '-'):<{col_widths['ohlc']}.2f}"
+    else:
+        line += f" {row['open']:<{col_widths['ohlc']}.2f} {row['high']:<{col_widths['ohlc']}.2f}"
+        line += f" {row['low']:<{col_widths['ohlc']}.2f} {row['close']:<{col_widths['ohlc']}.2f}"
         
-        # Add signal, entry, SL, and position with proper spacing
-        line += f" {colored_signal}{padding_signal}   {entry_str}{padding_entry}   {sl_str}{padding_sl} {colored_position}{padding_position}"
-        print(line)
+    # Fixed width columns with padding for signal and position text only (not ANSI codes)
+    padding_signal = " " * (col_widths['signal'] - len(signal))
+    padding_entry = " " * (col_widths['entry'] - len(entry_str))
+    padding_sl = " " * (col_widths['sl'] - len(sl_str))
+    padding_position = " " * (col_widths['position'] - len(position_str))
     
-    # If return_output is True, get the output and restore stdout
+    # Add signal, entry, SL, and position with proper spacing
+    line += f" {colored_signal}{padding_signal}   {entry_str}{padding_entry}   {sl_str}{padding_sl} {colored_position}{padding_position}"
+    return line
+
+def print_ohlcv_table_with_signals(data, show_heikin_ashi=True, return_output=False):
+    """Full table for the given rows (printed, or returned as a string with return_output)"""
+    lines = [format_table_header(show_heikin_ashi)]
+    lines.extend(format_table_row(row, show_heikin_ashi) for row in data)
+    output = "\n".join(lines) + "\n"
     if return_output:
-        output = output_buffer.getvalue()
-        sys.stdout = old_stdout
         return output
+    print(output, end="")
+
+class IncrementalTableRenderer:
+    """Renders only the newest row per candle, repeating the header every `header_every` rows"""
+
+    def __init__(self, show_heikin_ashi=True, header_every=HEADER_EVERY_ROWS):
+        self.show_heikin_ashi = show_heikin_ashi
+        self.header_every = header_every
+        self._rows_since_header = None  # None until the first header is printed
+
+    def render(self, row):
+        line = format_table_row(row, self.show_heikin_ashi)
+        if self._rows_since_header is None or self._rows_since_header >= self.header_every:
+            self._rows_since_header = 0
+            line = format_table_header(self.show_heikin_ashi) + "\n" + line
+        self._rows_since_header += 1
+        return line
+
+    def reset(self):
+        """Force a header before the next row (e.g. after a full-table dump)"""
+        self._rows_since_header = None
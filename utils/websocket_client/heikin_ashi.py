@@ -1,3 +1,6 @@
+import numpy as np
+
+
 def calculate_heikin_ashi(current, previous=None):
     if previous is None:
         ha_open = current['open']
@@ -13,3 +16,44 @@ def calculate_heikin_ashi(current, previous=None):
         'ha_low': ha_low,
         'ha_close': ha_close
     }
+
+
+# Beyond this, older HA closes contribute less than 2**-64 of their value to HA open
+HA_OPEN_MIN_WEIGHT = 2.0 ** -64
+
+
+def calculate_heikin_ashi_arrays(open_, high, low, close, previous=None):
+    """
+    Vectorized calculate_heikin_ashi() over whole arrays of candles.
+
+    HA open follows the recurrence ha_open[i] = (ha_open[i-1] + ha_close[i-1]) / 2, which is
+    solved with a doubling scan (log2 passes over the arrays) instead of a Python loop.
+
+    Args:
+        open_, high, low, close: Equal-length float arrays of regular candle values
+        previous (dict, optional): HA values of the candle before the first one
+
+    Returns:
+        (ha_open, ha_high, ha_low, ha_close) float64 arrays
+    """
+    open_ = np.asarray(open_, dtype=np.float64)
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    close = np.asarray(close, dtype=np.float64)
+    ha_close = (open_ + high + low + close) / 4
+    ha_open = np.empty_like(ha_close)
+    if len(ha_close) == 0:
+        return ha_open, ha_open.copy(), ha_open.copy(), ha_close
+    if previous is None:
+        ha_open[0] = open_[0]
+    else:
+        ha_open[0] = (previous['ha_open'] + previous['ha_close']) / 2
+    ha_open[1:] = ha_close[:-1] / 2
+    weight, shift = 0.5, 1
+    while shift < len(ha_open) and weight > HA_OPEN_MIN_WEIGHT:
+        ha_open[shift:] += weight * ha_open[:-shift]
+        weight *= weight
+        shift *= 2
+    ha_high = np.maximum(high, np.maximum(ha_open, ha_close))
+    ha_low = np.minimum(low, np.minimum(ha_open, ha_close))
+    return ha_open, ha_high, ha_low, ha_close
@@ -1,48 +1,83 @@
 import asyncio
-from datetime import datetime
 import sys
 import os
 import traceback
 import time
+import signal
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
-from utils.websocket_client.ws_listener import ohlc_listener_futures_ws
-from utils.websocket_client.ha_utils import get_historical_ha_data, align_time_to_interval
+from utils.websocket_client.ws_listener import ohlc_listener_futures_ws, KlineStream
+from utils.websocket_client.ha_utils import get_historical_ha_data
+from utils.historical_handler import get_klines
+from utils.interval_calendar import align, is_aligned, step
 from utils.websocket_client.clear_screen import clear_screen
-from utils.websocket_client.display import print_ohlcv_table_with_signals
+from utils.websocket_client.display import print_ohlcv_table_with_signals, IncrementalTableRenderer
+from utils.websocket_client.candle_buffer import CandleRingBuffer
 from utils.websocket_client.heikin_ashi import calculate_heikin_ashi
-from utils.websocket_client.strategy import format_row_with_strategy, add_strategy_to_historical_data
-from utils.config import get_fixed_quantity, get_quantity_type, get_quantity_percentage, DEBUG_MODE, SHOW_ERRORS
+from utils.websocket_client.strategy import format_row_with_strategy, add_strategy_to_historical_data, release_symbol
+from utils.config import get_fixed_quantity, get_quantity_type, get_quantity_percentage, refresh_trading_config, get_trading_config, DEBUG_MODE, SHOW_ERRORS
 from utils.quantity_calculator import calculate_quantity
 from utils.bot_state import reset_state
+from utils.shared_state import publish_candle, publish_stream
 from utils.logger import log_websocket, log_error
+from utils.market_state import update_last_price
+from utils.time_sync import start_time_sync, resync_time, log_time_sync_status, server_now_ms
 
-try:
-    from binance.client import Client
-except ImportError:
-    Client = None
+# Closed candles that reach us later than this (by server clock) are processed without trading
+MAX_CANDLE_CLOSE_LAG_MS = 10000
+# How often the live collector checks trading_config.json for a new symbol or interval
+MARKET_SWITCH_CHECK_SECONDS = 1.0
 
-async def ohlc_strategy_collector(symbol: str, interval: str, testnet: bool = False, debug_mode: bool = False, stop_event=None):
-    # Sync system time with Binance server time if possible
-    if Client is not None:
-        try:
-            # You may want to use your actual API keys here if needed
-            client = Client()
-            server_time = client.futures_time()['serverTime']
-            local_time = int(time.time() * 1000)
-            time_diff = server_time - local_time
-            if abs(time_diff) > 1000:
-                log_websocket(f"⚠️ Local time is off by {time_diff} ms from Binance server time. Please sync your system clock.")
-            else:
-                log_websocket(f"⏰ Local time is synchronized with Binance server (diff: {time_diff} ms)")
-        except Exception as e:
-            log_websocket(f"⚠️ Could not fetch Binance server time: {e}")
+async def ohlc_strategy_collector(symbol: str, interval: str, testnet: bool = False, debug_mode: bool = False, stop_event=None,
+                                  recorder=None, source=None, clock=None, progress=None, trading=None):
+    """
+    Run the strategy on closed candles from the kline stream.
+
+    Args:
+        recorder (FrameRecorder, optional): Capture raw frames while listening live
+        source (callable, optional): Kline source with the signature of ohlc_listener_futures_ws,
+            e.g. a ws_recorder.ReplaySource; defaults to the live websocket
+        clock (callable, optional): Current server time in ms; a replay passes its own clock
+        progress (dict, optional): Carries 'last_candle_time' and 'previous_ha_candle' across collector
+            restarts, so candles missed while restarting are backfilled into the same HA chain, and
+            'market' (symbol, interval) after a live switch
+        trading (bool, optional): Send orders; defaults to True on the live websocket and False for
+            any other source, so a replay is a dry run unless the caller opts in
+
+    On the live websocket, a new symbol_name or candle_interval in trading_config.json is picked
+    up within MARKET_SWITCH_CHECK_SECONDS: the HA chain of the new market is seeded from the kline
+    store and the connection is moved with SUBSCRIBE/UNSUBSCRIBE instead of restarting the bot.
+    """
+    # Only the live listener can change streams; a replay keeps the market it was recorded on
+    kline_stream = KlineStream(symbol, interval) if source is None else None
+    if trading is None:
+        trading = source is None
+    source = source or ohlc_listener_futures_ws
+    clock = clock or server_now_ms
+    # Make sure the server clock offset is known before aligning candles or signing orders
+    try:
+        start_time_sync()
+        resync_time()
+        log_time_sync_status()
+    except Exception as e:
+        log_websocket(f"⚠️ Could not fetch Binance server time: {e}")
             
-    display_data = []
+    # Bounded candle history; each candle renders only its own row (full table on SIGUSR1)
+    display_data = CandleRingBuffer()
     show_heikin_ashi = True
+    renderer = IncrementalTableRenderer(show_heikin_ashi)
+
+    def dump_full_table():
+        renderer.reset()
+        log_websocket(print_ohlcv_table_with_signals(display_data, show_heikin_ashi, return_output=True))
+
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, dump_full_table)
+    except (AttributeError, NotImplementedError, RuntimeError, ValueError):
+        pass  # No SIGUSR1 on Windows (or not in the main thread)
     last_candle_time = None
     try:
         # Get historical data and initialize previous_ha_candle
-        historical_raw_data, raw_previous_ha_candle = await get_historical_ha_data(symbol, interval, 5)
+        historical_raw_data, raw_previous_ha_candle = await get_historical_ha_data(symbol, interval, 5, now_ms=clock())
         
         if historical_raw_data:
             # Reset bot state before processing
@@ -53,6 +88,7 @@ async def ohlc_strategy_collector(symbol: str, interval: str, testnet: bool = Fa
             # Add the latest historical candle to display data
             latest_historical = historical_ha_data[-1]
             display_data.append(latest_historical)
+            publish_candle(latest_historical)
             
             # Store the latest historical timestamp to avoid placing orders on historical data
             latest_historical_timestamp = latest_historical['timestamp']
@@ -60,8 +96,7 @@ async def ohlc_strategy_collector(symbol: str, interval: str, testnet: bool = Fa
             # Show initial data - only clear screen if not in debug mode
             if not debug_mode and not DEBUG_MODE:
                 clear_screen()
-            table_output = print_ohlcv_table_with_signals([latest_historical], show_heikin_ashi, return_output=True)
-            log_websocket(table_output)
+            log_websocket(renderer.render(latest_historical))
             
             # Use the last historical candle for HA calculations
             previous_ha_candle = {
@@ -69,61 +104,203 @@ async def ohlc_strategy_collector(symbol: str, interval: str, testnet: bool = Fa
                 'ha_high': latest_historical['ha_high'],
                 'ha_low': latest_historical['ha_low'],
                 'ha_close': latest_historical['ha_close']            }
+            last_candle_time = latest_historical_timestamp
         else:
             previous_ha_candle = None
+
+        # After a collector restart, continue the HA chain of the previous run instead of the fresh seed
+        if progress and progress.get('last_candle_time') and progress.get('previous_ha_candle'):
+            last_candle_time = progress['last_candle_time']
+            previous_ha_candle = progress['previous_ha_candle']
+
+        def process_closed_candle(kline, allow_trading):
+            nonlocal previous_ha_candle, last_candle_time
+            candle_time = int(kline['t'])
+            last_candle_time = candle_time
+
+            # Pick up trading_config.json edits between candles (a stat call unless it changed)
+            try:
+                refresh_trading_config()
+            except (OSError, ValueError) as e:
+                log_error(f"Could not refresh trading config: {e}")
+
+            # Format the candle data with our new strategy implementation
+            formatted_candle = format_row_with_strategy(kline, symbol, previous_ha_candle, allow_trading)
+            formatted_candle['historical'] = False
             
-        async def on_kline(kline):
-            nonlocal previous_ha_candle, last_candle_time, latest_historical_timestamp
+            # Add to display data
+            display_data.append(formatted_candle)
+            publish_candle(formatted_candle)
+              # Update previous_ha_candle for next iteration
+            previous_ha_candle = {
+                'ha_open': formatted_candle['ha_open'],
+                'ha_high': formatted_candle['ha_high'],
+                'ha_low': formatted_candle['ha_low'],
+                'ha_close': formatted_candle['ha_close']
+            }
+            if progress is not None:
+                progress['last_candle_time'] = last_candle_time
+                progress['previous_ha_candle'] = previous_ha_candle
+
+            # Only this candle's row (with the periodic header) reaches the log; full table on SIGUSR1
+            log_websocket(renderer.render(formatted_candle))
+
+        async def backfill(until_open_ms=None):
+            """Replay closed candles missed since the last processed one through HA, without trading"""
+            if last_candle_time is None or previous_ha_candle is None:
+                return
+            if until_open_ms is None:
+                until_open_ms = align(clock(), interval)  # Open time of the current (unclosed) candle
+            first_missing = step(last_candle_time, interval, 1)
+            if first_missing >= until_open_ms:
+                return
+            log_websocket(f"🧩 Gap detected: candles from {first_missing} to {until_open_ms} were not received, backfilling")
+            klines = await asyncio.to_thread(get_klines, symbol, interval, first_missing, step(until_open_ms, interval, -1))
+            missed = [row for row in klines or [] if first_missing <= int(row[0]) < until_open_ms]
+            if not missed:
+                log_websocket(f"⚠️ Could not backfill the gap before {until_open_ms}; HA continues from the last processed candle")
+                return
+            for row in missed:
+                kline = {'t': int(row[0]), 'T': int(row[6]), 'o': row[1], 'h': row[2], 'l': row[3], 'c': row[4],
+                         'v': row[5], 'x': True}
+                process_closed_candle(kline, allow_trading=False)
+            log_websocket(f"🧩 Backfilled {len(missed)} candle(s) without trading")
+
+        # A restart (or a slow seed) may already have skipped candles
+        await backfill()
+
+        # Candle processing and market switches never interleave
+        candle_lock = asyncio.Lock()
+        deferred_market = None
+
+        async def switch_market(new_symbol, new_interval):
+            """Seed the new market's HA chain, release the old symbol's state and move the stream"""
+            nonlocal symbol, interval, historical_raw_data, latest_historical_timestamp
+            nonlocal previous_ha_candle, last_candle_time, deferred_market
+            started = time.perf_counter()
+            async with candle_lock:
+                # A switch that could not happen is retried once per processed candle, not every check
+                retried = deferred_market is not None and deferred_market[0] == (new_symbol, new_interval)
+                deferred_market = ((new_symbol, new_interval), last_candle_time)
+                seeded, seed_ha_candle = await get_historical_ha_data(new_symbol, new_interval, 5, now_ms=clock())
+                if not seeded:
+                    if not retried:
+                        log_error(f"Could not load history for {new_symbol} {new_interval}; staying on {symbol} {interval}")
+                    return False
+                if new_symbol != symbol.upper() and not release_symbol(symbol):
+                    if not retried:
+                        log_websocket(f"⏳ Switch to {new_symbol} waits until the position and orders on {symbol} are closed")
+                    return False
+                # Same symbol: position and orders carry over and trail on the new interval's candles
+                log_websocket(f"🔀 Switching from {symbol} {interval} to {new_symbol} {new_interval}")
+                try:
+                    await kline_stream.switch(new_symbol, new_interval)
+                except Exception as e:
+                    # The stream already points at the new market, so the listener's reconnect subscribes to it
+                    log_error(f"Could not resubscribe on the live connection: {e}")
+                if recorder is not None:
+                    recorder.retarget(new_symbol, new_interval)
+                symbol, interval = new_symbol, new_interval
+                deferred_market = None
+                historical_raw_data = add_strategy_to_historical_data(seeded)
+                latest_historical = historical_raw_data[-1]
+                latest_historical_timestamp = last_candle_time = latest_historical['timestamp']
+                previous_ha_candle = seed_ha_candle
+                if progress is not None:
+                    progress.update(market=(symbol, interval), last_candle_time=last_candle_time,
+                                    previous_ha_candle=previous_ha_candle)
+                display_data.clear()
+                display_data.append(latest_historical)
+                renderer.reset()
+                publish_stream(symbol, interval)
+                publish_candle(latest_historical)
+                log_websocket(renderer.render(latest_historical))
+            log_websocket(f"🔀 Market switch took {time.perf_counter() - started:.2f}s")
+            return True
+
+        async def watch_market():
+            while stop_event is None or not stop_event.is_set():
+                await asyncio.sleep(MARKET_SWITCH_CHECK_SECONDS)
+                try:
+                    refresh_trading_config()
+                except (OSError, ValueError) as e:
+                    log_error(f"Could not refresh trading config: {e}")
+                    continue
+                config = get_trading_config()
+                target = (config.symbol_name, config.candle_interval)
+                if target != (symbol.upper(), interval) and deferred_market != (target, last_candle_time):
+                    try:
+                        await switch_market(config.symbol_name, config.candle_interval)
+                    except Exception as e:
+                        log_error(f"Error switching to {config.symbol_name} {config.candle_interval}: {e}", exc_info=True)
             
+        async def on_kline(kline):
+            async with candle_lock:
+                await handle_kline(kline)
+
+        async def handle_kline(kline):
             if stop_event is not None and stop_event.is_set():
                 log_websocket("\n🛑 Stop event detected in on_kline. Exiting async loop.")
                 raise asyncio.CancelledError()
+
+            # A frame of the previous market that was waiting while the stream switched
+            if kline_stream is not None and not kline_stream.matches(kline):
+                return
+            
+            # Keep the live price cache current with every kline update
+            if kline.get('c') is not None:
+                update_last_price(symbol, kline['c'], kline.get('T'))
             
             # Skip if candle is not closed yet
             if not kline.get('x'):
                 return
                   # Process timestamp and align to interval
             candle_time = int(kline['t'])
-            candle_datetime = datetime.fromtimestamp(candle_time / 1000)
-            aligned_candle_time = align_time_to_interval(candle_datetime, interval)
             
             # Skip if candle time doesn't align exactly with the interval start time
-            if candle_datetime != aligned_candle_time:
+            if not is_aligned(candle_time, interval):
                 return
                 
             # Skip duplicate candles
             if last_candle_time == candle_time:
                 return
                 
-            # Skip if candle is older than our latest historical candle
+            # Skip if candle is older than our latest historical candle (or one already backfilled)
             if historical_raw_data and candle_time <= historical_raw_data[-1]['timestamp']:
                 return
-                
-            last_candle_time = candle_time            # Format the candle data with our new strategy implementation
-            # Always allow trading for real-time candles, historical check is handled in strategy
-            formatted_candle = format_row_with_strategy(kline, symbol, previous_ha_candle, True)
-            formatted_candle['historical'] = False
+            if last_candle_time is not None and candle_time <= last_candle_time:
+                return
+
+            # Candles between the last processed one and this one were missed (dropped frames)
+            await backfill(candle_time)
             
-            # Add to display data
-            display_data.append(formatted_candle)
-              # Update previous_ha_candle for next iteration
-            previous_ha_candle = {
-                'ha_open': formatted_candle['ha_open'],
-                'ha_high': formatted_candle['ha_high'],
-                'ha_low': formatted_candle['ha_low'],
-                'ha_close': formatted_candle['ha_close']
-            }
-              # Update display - only clear screen if not in debug mode
-            if not DEBUG_MODE:
-                clear_screen()
-            table_output = print_ohlcv_table_with_signals(display_data, show_heikin_ashi, return_output=True)
-            log_websocket(table_output)
+            # Use the server clock to detect candles that closed long before they arrived
+            # (e.g. frames buffered during a stall); their prices are stale, so don't trade on them
+            close_lag_ms = clock() - int(kline.get('T', candle_time))
+            allow_trading = trading and close_lag_ms <= MAX_CANDLE_CLOSE_LAG_MS
+            if trading and not allow_trading:
+                log_websocket(f"⚠️ Candle {candle_time} closed {close_lag_ms} ms ago by server time, processing without trading")
+            
+            process_closed_candle(kline, allow_trading)
             
         # Start websocket listener with retry mechanism
         if stop_event is not None and stop_event.is_set():
             log_websocket("\n🛑 Stop event detected before websocket listener. Exiting async function.")
             return
-        await ohlc_listener_futures_ws(symbol, interval, on_kline, testnet=testnet, stop_event=stop_event)
+        # Backfill whatever closed while (re)connecting before live frames are processed
+        if kline_stream is None:
+            if recorder is not None:
+                await source(symbol, interval, on_kline, testnet=testnet, stop_event=stop_event, recorder=recorder,
+                             on_connect=backfill)
+            else:
+                await source(symbol, interval, on_kline, testnet=testnet, stop_event=stop_event, on_connect=backfill)
+            return
+        watcher = asyncio.create_task(watch_market())
+        try:
+            await source(symbol, interval, on_kline, testnet=testnet, stop_event=stop_event, recorder=recorder,
+                         on_connect=backfill, stream=kline_stream)
+        finally:
+            watcher.cancel()
         
     except KeyboardInterrupt:
         log_websocket("\n🔄 Shutting down gracefully...")
@@ -139,3 +316,8 @@ async def ohlc_strategy_collector(symbol: str, interval: str, testnet: bool = Fa
         
         log_websocket("\n🔄 The connection will be retried automatically...")
         raise
+    finally:
+        try:
+            asyncio.get_running_loop().remove_signal_handler(signal.SIGUSR1)
+        except (AttributeError, NotImplementedError, RuntimeError, ValueError):
+            pass
@@ -4,7 +4,8 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')
 from datetime import datetime
 import time
 import math  # Add math module import for floor function
-from utils.buy_sell_handler import buy_long, sell_long, client, get_tick_size
+from utils.buy_sell_handler import buy_long, sell_long, client
+from utils.symbol_filters import get_symbol_filters
 from utils.order_utils import get_order_status, cancel_order
 from utils.order_storage import save_filled_order, save_open_order, remove_open_order, enrich_order_details
 from utils.bot_state import (
@@ -12,21 +13,41 @@ from utils.bot_state import (
     get_active_buy_order, set_active_buy_order,
     get_active_sell_order, set_active_sell_order,
     get_buy_filled_price, set_buy_filled_price,
-    get_candle_order_created_at, set_candle_order_created_at
-)
-from utils.config import (
-    get_fixed_quantity, get_quantity_type, get_quantity_percentage, get_price_value, get_leverage, get_buy_offset, get_sell_offset
+    get_candle_order_created_at, set_candle_order_created_at,
+    reset_state
 )
+from utils.config import get_trading_config
 from utils.quantity_calculator import calculate_quantity
+from utils.pretrade_validator import PRICE_MAX_AGE_SECONDS
+from utils import market_state
 from rich import print as rich_print
 from rich.pretty import Pretty
-from utils.logger import log_websocket, log_error
+from utils.logger import log_websocket, log_error, log_verbose
+from utils.latency_trace import mark as latency_mark
+from utils import metrics
+
+ORDERS = metrics.counter('bot_orders_total', 'Strategy order placements and cancellations by outcome', ('side', 'result'))
 
 # Helper function to replace rich_print with log_websocket
 def log_message(message):
     log_websocket(message)
     # We still show in console via the log_websocket implementation
 
+def configured_quantity():
+    """Order quantity from the current trading config snapshot"""
+    config = get_trading_config()
+    return calculate_quantity(config.quantity, config.quantity_percentage, config.quantity_type, config.price_value, config.leverage)
+
+def record_order(side, order):
+    """Count an order placement by the strategy (None means it was rejected or could not be placed)"""
+    ORDERS.labels(side=side, result='placed' if order else 'rejected').inc()
+    return order
+
+def record_cancel(side, result):
+    """Count an order cancellation by the strategy"""
+    ORDERS.labels(side=side, result='cancelled' if result else 'cancel_failed').inc()
+    return result
+
 # Strategy summary:
 # BUY: Place a buy order at current candle's HA_High + BUY_OFFSET 
 # SELL/STOP LOSS: Place a sell order at current candle's HA_Low - SELL_OFFSET
@@ -44,6 +65,36 @@ def add_strategy_to_historical_data(historical_data):
         })
     return historical_data
 
+def release_symbol(symbol):
+    """
+    Flatten the strategy state on `symbol` before the bot switches to another symbol
+
+    An unfilled buy order is cancelled. An open LONG is not closed at market: it stays
+    managed (and protected by its stop loss) until it is flat, and the switch waits.
+
+    Returns:
+        bool: True if nothing is left on `symbol` and the state was reset
+    """
+    if get_position() == "LONG":
+        return False
+    active_buy_order = get_active_buy_order()
+    if active_buy_order:
+        order_id = active_buy_order.get("orderId")
+        status, order_details = get_order_status(symbol, order_id)
+        if status in ["FILLED", "PARTIALLY_FILLED"]:
+            # The next candle records the fill and places its stop loss
+            return False
+        if status not in ["CANCELED", "REJECTED", "EXPIRED"]:
+            log_message(f"[STRATEGY] Cancelling buy order {order_id} on {symbol} before switching symbol")
+            if not record_cancel('BUY', cancel_order(symbol, order_id)):
+                status, order_details = get_order_status(symbol, order_id)
+                if status not in ["CANCELED", "REJECTED", "EXPIRED"]:
+                    return False
+        remove_open_order(order_id)
+    reset_state()
+    market_state.set_position_amount(symbol, 'LONG', 0)
+    return True
+
 def check_order_status_multiple_times(symbol, order_id, max_attempts=3, delay_seconds=10):
     """
     Check order status multiple times for partially filled orders
@@ -127,32 +178,36 @@ def handle_filled_buy_order(row_data, symbol, order_details, filled_price):
     
     # Calculate stop loss price using floor to match exchange behavior
     # First calculate the raw price
-    raw_stop_price = row_data["ha_low"] - get_sell_offset()
+    raw_stop_price = row_data["ha_low"] - get_trading_config().sell_long_offset
     
-    # Apply floor with tick size for exact matching with exchange
-    tick_size = get_tick_size(symbol)
-    stop_trigger_price = math.floor(raw_stop_price / tick_size) * tick_size
-    stop_trigger_price = round(stop_trigger_price, 2)  # Ensure clean 2 decimal places
+    # Apply floor on the integer tick grid for exact matching with exchange
+    stop_trigger_price = float(get_symbol_filters(symbol).price.floor(raw_stop_price))
     
     # For display purposes, use the exact calculated value
     row_data["stop_loss"] = stop_trigger_price
     
     # Get the actual filled quantity from the order details
-    filled_quantity = float(order_details.get('executedQty', calculate_quantity(get_fixed_quantity(), get_quantity_percentage(), get_quantity_type(), get_price_value(), get_leverage())))
+    filled_quantity = float(order_details.get('executedQty') or 0)
     if filled_quantity <= 0:
-        filled_quantity = calculate_quantity(get_fixed_quantity(), get_quantity_percentage(), get_quantity_type(), get_price_value(), get_leverage())  # Fallback to configured quantity
+        filled_quantity = configured_quantity()  # Fallback to configured quantity
+    
+    market_state.set_position_amount(symbol, 'LONG', filled_quantity)
     
     log_message(f"[STRATEGY] Creating initial stop loss after buy fill with trigger at: {stop_trigger_price}")
-    sell_order = sell_long(symbol, price=stop_trigger_price, stop_limit=stop_trigger_price, quantity=filled_quantity)
+    sell_order = sell_long(symbol, price=stop_trigger_price, stop_limit=stop_trigger_price, quantity=filled_quantity,
+                           candle_time=row_data["timestamp"], intent='SLI')
+    record_order('SELL', sell_order)
     if sell_order:
         set_active_sell_order(sell_order)
         log_message(f"[STRATEGY] Stop Loss order placed with trigger price: {stop_trigger_price}, order price: {sell_order.get('price')}")
-        log_message(str(sell_order))
+        log_verbose("[STRATEGY] Stop loss order details: %s", sell_order)
     
     return row_data
 
 def format_row_with_strategy(kline, symbol, previous_ha_candle, allow_trading=True):
     """Process new candle data and execute the trading strategy"""
+    # One config snapshot for the whole candle (swapped between candles, never mid-candle)
+    config = get_trading_config()
     # Create basic row data from kline
     row_data = {
         "symbol": symbol.upper(),
@@ -183,6 +238,7 @@ def format_row_with_strategy(kline, symbol, previous_ha_candle, allow_trading=Tr
     from utils.websocket_client.heikin_ashi import calculate_heikin_ashi
     ha_values = calculate_heikin_ashi(row_data, previous_ha_candle)
     row_data.update(ha_values)
+    latency_mark('ha')
       # Current candle values
     current_candle_high = row_data["high"]
     current_candle_low = row_data["low"]
@@ -191,23 +247,22 @@ def format_row_with_strategy(kline, symbol, previous_ha_candle, allow_trading=Tr
     # Calculate buy parameters
     # Price = HA_High + BUY_OFFSET
     # Stop limit = Current HA_High (not previous candle)
-    buy_price_display = round(row_data["ha_high"] + get_buy_offset(), 2)
+    price_grid = get_symbol_filters(symbol).price
+    buy_price_display = float(price_grid.nearest(row_data["ha_high"] + config.buy_long_offset))
     buy_price = buy_price_display  # Keep the original value for display
     
     # Use current candle HA high for stop limit
-    buy_stop_limit = round(row_data["ha_high"], 2)
+    buy_stop_limit = float(price_grid.nearest(row_data["ha_high"]))
     
-    # Calculate sell parameters with math.floor for exact tick size matching
-    tick_size = get_tick_size(symbol)
-    raw_stop_price = row_data["ha_low"] - get_sell_offset()
-    sell_stop_limit_display = math.floor(raw_stop_price / tick_size) * tick_size
-    sell_stop_limit_display = round(sell_stop_limit_display, 2)  # Format to clean 2 decimal places
+    # Calculate sell parameters with a floor on the integer tick grid for exact tick size matching
+    raw_stop_price = row_data["ha_low"] - config.sell_long_offset
+    sell_stop_limit_display = float(price_grid.floor(raw_stop_price))
     sell_stop_limit = sell_stop_limit_display  # Keep the original value for order placement
     
     # Set display values
     if get_position() == "LONG":
         buy_filled_price = get_buy_filled_price() or buy_price_display
-        row_data["entry"] = round(buy_filled_price, 2)
+        row_data["entry"] = float(price_grid.nearest(buy_filled_price))
         # For stop loss when in LONG position, use the current candle's HA_Low minus SELL_OFFSET
         row_data["stop_loss"] = sell_stop_limit_display
     elif get_position() == "NONE":
@@ -228,11 +283,11 @@ def format_row_with_strategy(kline, symbol, previous_ha_candle, allow_trading=Tr
             
             if status == "NEW":
                 log_message(f"[STRATEGY] Cancelling unfilled buy order from previous candle: {order_id}")
-                cancel_order(symbol, order_id)
+                record_cancel('BUY', cancel_order(symbol, order_id))
                 set_active_buy_order(None)
             elif status == "FILLED":
                 log_message(f"[STRATEGY] Buy order filled: {order_id}")
-                filled_price = round(float(order_details.get("price", 0)), 2)
+                filled_price = float(price_grid.nearest(float(order_details.get("price", 0))))
                 row_data = handle_filled_buy_order(row_data, symbol, order_details, filled_price)
             elif status == "PARTIALLY_FILLED":
                 log_message(f"[STRATEGY] Buy order partially filled: {order_id}. Not creating new orders.")
@@ -256,7 +311,7 @@ def format_row_with_strategy(kline, symbol, previous_ha_candle, allow_trading=Tr
             if status == "FILLED":
                 # Order was filled between candles
                 log_message(f"[STRATEGY] Buy order filled: {order_id}")
-                filled_price = round(float(order_details.get("price", 0)), 2)
+                filled_price = float(price_grid.nearest(float(order_details.get("price", 0))))
                 row_data = handle_filled_buy_order(row_data, symbol, order_details, filled_price)
             elif status == "PARTIALLY_FILLED":
                 log_message(f"[STRATEGY] Buy order partially filled: {order_id}. Waiting for full fill.")
@@ -264,25 +319,31 @@ def format_row_with_strategy(kline, symbol, previous_ha_candle, allow_trading=Tr
             else:
                 # Cancel existing order to place a new one with updated prices
                 log_message(f"[STRATEGY] Cancelling existing buy order (status: {status}) to update with new prices: {order_id}")
-                cancel_order(symbol, order_id)
+                record_cancel('BUY', cancel_order(symbol, order_id))
                 set_active_buy_order(None)
           # If we don't have an active order (either there never was one or we just cancelled it),
-    # create a new buy order for the next candle
-    if not get_active_buy_order() and get_position() == "NONE":
+    # create a new buy order for the next candle (only when trading: stale, backfilled and replayed
+    # candles are dry runs that log the order they would have placed)
+    if not allow_trading and not get_active_buy_order() and get_position() == "NONE":
+        log_verbose("[STRATEGY] Dry run, no order: buy %s at price %s, stop_limit %s", symbol, buy_price, buy_stop_limit)
+    if allow_trading and not get_active_buy_order() and get_position() == "NONE":
         # Check current market price to avoid "would immediately trigger" error
         try:
-            # Get recent market price
-            ticker = client.futures_symbol_ticker(symbol=symbol)
-            current_price = float(ticker['price'])
+            # Get recent market price from the live price cache, falling back to REST
+            current_price = market_state.get_last_price(symbol, max_age=PRICE_MAX_AGE_SECONDS)
+            if current_price is None:
+                ticker = client.futures_symbol_ticker(symbol=symbol)
+                current_price = float(ticker['price'])
             
             # Only place stop order if current price is below stop_limit
             if current_price < buy_stop_limit:
-                log_message(f"[STRATEGY] Creating buy order for next candle: {symbol} at price: {buy_price} (HA_High + {get_buy_offset()}), stop_limit: {buy_stop_limit} (HA_High)")
-                buy_order = buy_long(symbol, price=buy_price, stop_limit=buy_stop_limit, quantity=calculate_quantity(get_fixed_quantity(), get_quantity_percentage(), get_quantity_type(), get_price_value(), get_leverage()))
+                log_message(f"[STRATEGY] Creating buy order for next candle: {symbol} at price: {buy_price} (HA_High + {config.buy_long_offset}), stop_limit: {buy_stop_limit} (HA_High)")
+                buy_order = buy_long(symbol, price=buy_price, stop_limit=buy_stop_limit, quantity=configured_quantity(), candle_time=row_data["timestamp"])
+                record_order('BUY', buy_order)
                 if buy_order:
                     set_active_buy_order(buy_order)
                     set_candle_order_created_at(row_data["timestamp"])
-                    log_message(str(buy_order))
+                    log_verbose("[STRATEGY] Buy order details: %s", buy_order)
             else:
                 log_message(f"[STRATEGY] Skipping buy order creation - current price ({current_price}) is already above stop limit ({buy_stop_limit})")
                 log_message(f"[STRATEGY] Would have created: price={buy_price}, stop_limit={buy_stop_limit}")
@@ -290,11 +351,12 @@ def format_row_with_strategy(kline, symbol, previous_ha_candle, allow_trading=Tr
             log_error(f"Error checking market price before placing order: {e}", exc_info=True)
             # Fallback - try placing the order anyway
             log_message(f"[STRATEGY] Creating buy order for next candle (fallback): {symbol} at price: {buy_price}, stop_limit: {buy_stop_limit}")
-            buy_order = buy_long(symbol, price=buy_price, stop_limit=buy_stop_limit, quantity=calculate_quantity(get_fixed_quantity(), get_quantity_percentage(), get_quantity_type(), get_price_value(), get_leverage()))
+            buy_order = buy_long(symbol, price=buy_price, stop_limit=buy_stop_limit, quantity=configured_quantity(), candle_time=row_data["timestamp"])
+            record_order('BUY', buy_order)
             if buy_order:
                 set_active_buy_order(buy_order)
                 set_candle_order_created_at(row_data["timestamp"])
-                log_message(str(buy_order))
+                log_verbose("[STRATEGY] Buy order details: %s", buy_order)
     elif get_position() == "LONG" and allow_trading:
         # Handle stop loss orders
         active_sell_order = get_active_sell_order()
@@ -305,6 +367,7 @@ def format_row_with_strategy(kline, symbol, previous_ha_candle, allow_trading=Tr
             if status == "FILLED":
                 log_message(f"[STRATEGY] Sell order filled (stop loss hit): {order_id}")
                 set_position("CLOSED_LONG")  # Change from NONE to CLOSED_LONG
+                market_state.set_position_amount(symbol, 'LONG', 0)
                 set_active_sell_order(None)
                 set_active_buy_order(None)
                 set_buy_filled_price(None)
@@ -323,7 +386,7 @@ def format_row_with_strategy(kline, symbol, previous_ha_candle, allow_trading=Tr
                 
                 # Set the stop_loss value to the actual sell price to show where position was closed
                 if executed_price > 0:
-                    row_data["stop_loss"] = round(executed_price, 2)
+                    row_data["stop_loss"] = float(price_grid.nearest(executed_price))
                     log_message(f"[STRATEGY] Position closed at price: {row_data['stop_loss']}")
                 
                 # Save the filled sell order details to order_book.json
@@ -363,6 +426,7 @@ def format_row_with_strategy(kline, symbol, previous_ha_candle, allow_trading=Tr
                 # We don't create a new stop loss immediately because we need to determine
                 # if the position is still open
                 position_check = client.futures_position_information(symbol=symbol)
+                market_state.update_positions(symbol, position_check)
                 position_found = False
                 for pos in position_check:
                     if pos['symbol'] == symbol and pos['positionSide'] == 'LONG' and float(pos['positionAmt']) > 0:
@@ -382,7 +446,7 @@ def format_row_with_strategy(kline, symbol, previous_ha_candle, allow_trading=Tr
             else:
                 # For all other statuses, cancel the existing order to create a new one with updated prices
                 log_message(f"[STRATEGY] Cancelling existing sell order (status: {status}) to update with new stop loss price")
-                cancel_order(symbol, order_id)
+                record_cancel('SELL', cancel_order(symbol, order_id))
                 set_active_sell_order(None)
                 # We'll check again next candle
         # Create or update stop loss for the next candle
@@ -391,6 +455,7 @@ def format_row_with_strategy(kline, symbol, previous_ha_candle, allow_trading=Tr
             
             # Check if the position really exists (in case we missed a fill or the position was closed manually)
             position_check = client.futures_position_information(symbol=symbol)
+            market_state.update_positions(symbol, position_check)
             position_found = False
             position_amt = 0
             for pos in position_check:
@@ -402,10 +467,8 @@ def format_row_with_strategy(kline, symbol, previous_ha_candle, allow_trading=Tr
             # Only create a new stop loss if the position actually exists
             if position_found:
                 # Calculate the new stop loss price based on current candle with tick size adjustment
-                raw_stop_price = row_data["ha_low"] - get_sell_offset()
-                tick_size = get_tick_size(symbol)
-                sell_stop_limit = math.floor(raw_stop_price / tick_size) * tick_size
-                sell_stop_limit = round(sell_stop_limit, 2)  # Format to clean 2 decimal places
+                raw_stop_price = row_data["ha_low"] - config.sell_long_offset
+                sell_stop_limit = float(price_grid.floor(raw_stop_price))
                 
                 # Set display value to exact calculated value
                 row_data["stop_loss"] = sell_stop_limit
@@ -414,7 +477,7 @@ def format_row_with_strategy(kline, symbol, previous_ha_candle, allow_trading=Tr
                 if get_active_sell_order():
                     order_id = get_active_sell_order().get("orderId")
                     log_message(f"[STRATEGY] Cancelling existing stop loss order to update with new price: {order_id}")
-                    cancel_result = cancel_order(symbol, order_id)
+                    cancel_result = record_cancel('SELL', cancel_order(symbol, order_id))
                     
                     if cancel_result:
                         log_message(f"[STRATEGY] Successfully cancelled stop loss order: {order_id}")
@@ -434,12 +497,14 @@ def format_row_with_strategy(kline, symbol, previous_ha_candle, allow_trading=Tr
                 # Create new stop loss order with updated price
                 log_message(f"[STRATEGY] Creating/updating stop loss for next candle: {symbol} at price: {sell_stop_limit}, stop_limit: {sell_stop_limit}")
                 # Use the same value for both price and stop_limit
-                sell_order = sell_long(symbol, price=sell_stop_limit, stop_limit=sell_stop_limit, quantity=position_amt)
+                sell_order = sell_long(symbol, price=sell_stop_limit, stop_limit=sell_stop_limit, quantity=position_amt,
+                                       candle_time=row_data["timestamp"], intent='SLT')
+                record_order('SELL', sell_order)
                 if sell_order:
                     set_active_sell_order(sell_order)
                     # Keep using the exact calculated value for display
                     log_message(f"[STRATEGY] Stop Loss order placed with trigger price: {sell_stop_limit}, order price: {sell_order.get('price')}")
-                    log_message(str(sell_order))
+                    log_verbose("[STRATEGY] Stop loss order details: %s", sell_order)
                 else:
                     log_message(f"[STRATEGY] Failed to create stop loss order. Will try again with next candle.")
             else:
@@ -3,13 +3,61 @@ import json
 import asyncio
 import sys
 import os
+import time
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
 from utils.logger import log_websocket, log_error
+from utils.config import SIM, SIM_WS_URL
+from utils.latency_trace import begin_trace, mark, end_trace
+from utils.time_sync import server_now_ms
+from utils import metrics
+
+WS_FRAMES = metrics.counter('ws_frames_total', 'Kline websocket frames received', ('stream',))
+WS_RECONNECTS = metrics.counter('ws_reconnects_total', 'Kline websocket reconnections after an error or close')
+WS_CONNECTED = metrics.gauge('ws_connected', '1 while the kline websocket is connected')
+WS_LAG = metrics.histogram('ws_frame_lag_seconds', 'Exchange event time to frame receipt, by the server clock',
+                           buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
 
 FUTURES_MAINNET_WS_URL = "wss://fstream.binance.com/ws"
 FUTURES_TESTNET_WS_URL = "wss://stream.binancefuture.com/ws"
 
-async def ohlc_listener_futures_ws(symbol: str, interval: str, callback, testnet: bool = False, max_retries: int = 10, retry_delay: int = 5, stop_event=None):
+
+class KlineStream:
+    """
+    The kline stream a listener follows; switch() moves a live connection to another market
+
+    The new stream is subscribed before the old one is unsubscribed, so no closed candle is
+    lost, and frames of the old stream still in flight are dropped by matches().
+    """
+
+    def __init__(self, symbol: str, interval: str):
+        self.symbol = symbol.upper()
+        self.interval = interval
+        self._ws = None
+        self._request_id = 0
+
+    @property
+    def name(self):
+        return f"{self.symbol.lower()}@kline_{self.interval}"
+
+    def matches(self, kline):
+        return kline.get("s", self.symbol).upper() == self.symbol and kline.get("i", self.interval) == self.interval
+
+    async def _send(self, method, params):
+        self._request_id += 1
+        await self._ws.send(json.dumps({"method": method, "params": params, "id": self._request_id}))
+
+    async def switch(self, symbol: str, interval: str):
+        """Follow `symbol`/`interval` on the current connection (or from the next connection if there is none)"""
+        previous = self.name
+        self.symbol, self.interval = symbol.upper(), interval
+        if self._ws is None or self.name == previous:
+            return
+        await self._send("SUBSCRIBE", [self.name])
+        await self._send("UNSUBSCRIBE", [previous])
+        log_websocket(f"🔀 Subscribed to {self.name}, unsubscribed from {previous}")
+
+
+async def ohlc_listener_futures_ws(symbol: str, interval: str, callback, testnet: bool = False, max_retries: int = 10, retry_delay: int = 5, stop_event=None, recorder=None, on_connect=None, stream=None):
     """
     Connects to Binance Futures WebSocket (mainnet or testnet, based on testnet argument) and listens for OHLC (kline) data.
     Includes automatic retry mechanism for connection issues.
@@ -21,35 +69,67 @@ async def ohlc_listener_futures_ws(symbol: str, interval: str, callback, testnet
         testnet (bool): Whether to use testnet (True) or mainnet (False)
         max_retries (int): Maximum number of reconnection attempts
         retry_delay (int): Delay in seconds between retry attempts
+        recorder (FrameRecorder, optional): Writes every raw frame to capture segments
+        on_connect (async callable, optional): Awaited after every (re)connection, before frames
+            are consumed, e.g. to backfill candles that closed during the outage
+        stream (KlineStream, optional): Lets the caller switch symbol/interval on the live connection;
+            reconnections use its current stream
     """
-    ws_url = FUTURES_TESTNET_WS_URL if testnet else FUTURES_MAINNET_WS_URL
-    stream = f"{symbol.lower()}@kline_{interval}"
-    url = f"{ws_url}/{stream}"
+    ws_url = SIM_WS_URL if SIM else FUTURES_TESTNET_WS_URL if testnet else FUTURES_MAINNET_WS_URL
+    if stream is None:
+        stream = KlineStream(symbol, interval)
     
     retry_count = 0
     backoff_factor = 1.5  # Exponential backoff factor
     
     while retry_count < max_retries:
+        url = f"{ws_url}/{stream.name}"
         try:
             if retry_count > 0:
                 log_websocket(f"📡 Attempting to reconnect... (Attempt {retry_count}/{max_retries})")
             else:
-                log_websocket(f"🔌 Starting WebSocket connection for {symbol.upper()}...")
-                log_websocket(f"📡 Connected to {'futures testnet' if testnet else 'futures mainnet'}: {url}")
+                log_websocket(f"🔌 Starting WebSocket connection for {stream.symbol}...")
+                log_websocket(f"📡 Connected to {'exchange simulator' if SIM else 'futures testnet' if testnet else 'futures mainnet'}: {url}")
                 
             async with websockets.connect(url) as ws:
-                # Reset retry count on successful connection
-                retry_count = 0
+                WS_CONNECTED.set(1)
+                stream._ws = ws
+                try:
+                    # Reset retry count on successful connection
+                    retry_count = 0
+                    if on_connect is not None:
+                        await on_connect()
                 
-                async for message in ws:
+                    async for message in ws:
+                        if stop_event is not None and stop_event.is_set():
+                            log_websocket("\n🛑 Stop event detected in ws_listener. Breaking WebSocket loop.")
+                            break
+                        received_ns = time.monotonic_ns()
+                        data = json.loads(message)
+                        kline = data.get("k")
+                        # Skip SUBSCRIBE/UNSUBSCRIBE replies and frames of a stream we just left
+                        if kline is None or not stream.matches(kline):
+                            continue
+                        if recorder is not None:
+                            recorder.write(message)
+                        WS_FRAMES.labels(stream=stream.name).inc()
+                        if data.get("E") is not None:
+                            WS_LAG.observe(max(server_now_ms() - data["E"], 0) / 1000)
+                        if not kline.get("x"):
+                            await callback(kline)
+                            continue
+                        # Closed candles are traced from frame receipt to order ack
+                        begin_trace(kline, received_ns, data.get("E"))
+                        mark("decode")
+                        try:
+                            await callback(kline)
+                        finally:
+                            end_trace()
                     if stop_event is not None and stop_event.is_set():
-                        log_websocket("\n🛑 Stop event detected in ws_listener. Breaking WebSocket loop.")
                         break
-                    data = json.loads(message)
-                    kline = data.get("k", {})
-                    await callback(kline)
-                if stop_event is not None and stop_event.is_set():
-                    break
+                finally:
+                    stream._ws = None
+                    WS_CONNECTED.set(0)
                 
         except KeyboardInterrupt:
             log_websocket("📡 WebSocket connection closed by user")
@@ -57,6 +137,7 @@ async def ohlc_listener_futures_ws(symbol: str, interval: str, callback, testnet
             
         except websockets.exceptions.ConnectionClosedError as e:
             retry_count += 1
+            WS_RECONNECTS.inc()
             current_delay = retry_delay * (backoff_factor ** (retry_count - 1))
             
             log_websocket(f"📡 WebSocket connection closed: {e}")
@@ -68,6 +149,7 @@ async def ohlc_listener_futures_ws(symbol: str, interval: str, callback, testnet
                 
         except Exception as e:
             retry_count += 1
+            WS_RECONNECTS.inc()
             current_delay = retry_delay * (backoff_factor ** (retry_count - 1))
             
             log_websocket(f"❌ Error in WebSocket listener: {e}")
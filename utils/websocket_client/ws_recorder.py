@@ -0,0 +1,210 @@
+"""
+Capture and replay of the kline websocket stream.
+
+The recorder writes every raw frame with its receive time (Binance server clock, ms)
+to gzip-compressed, rotating segment files, one "<recv_ms>\\t<raw frame>" line each.
+ReplaySource reads those segments back and drives the same `callback(kline)` that
+`ohlc_listener_futures_ws` drives, at real time, N times faster, or as fast as possible.
+A replay is a dry run: the strategy runs on every candle but sends no orders, except
+under MODE=sim, where they go to the local exchange simulator.
+"""
+import asyncio
+import glob
+import gzip
+import json
+import os
+import sys
+import time
+import zlib
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from utils.logger import log_websocket, log_error
+from utils.time_sync import server_now_ms
+
+CAPTURE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'data', 'ws_capture')
+SEGMENT_SUFFIX = '.frames.gz'
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024  # Uncompressed bytes per segment before rotating
+SEGMENT_MAX_SECONDS = 3600  # Segment age before rotating
+FLUSH_INTERVAL_SECONDS = 1.0  # At most this much capture is lost if the process dies
+
+
+def segment_pattern(directory, symbol, interval):
+    return os.path.join(directory, f"{symbol.upper()}_{interval}_*{SEGMENT_SUFFIX}")
+
+
+class FrameRecorder:
+    """Appends raw websocket frames to rotating gzip segments"""
+
+    def __init__(self, symbol, interval, directory=CAPTURE_DIR,
+                 max_bytes=SEGMENT_MAX_BYTES, max_seconds=SEGMENT_MAX_SECONDS):
+        self.symbol = symbol.upper()
+        self.interval = interval
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.path = None
+        self.frames = 0
+        self._file = None
+        self._bytes = 0
+        self._opened_at = 0.0
+        self._flushed_at = 0.0
+
+    def _open_segment(self, recv_ms):
+        self.close()
+        os.makedirs(self.directory, exist_ok=True)
+        # Zero-padded start time keeps segments in chronological order by name
+        self.path = os.path.join(self.directory, f"{self.symbol}_{self.interval}_{recv_ms:013d}{SEGMENT_SUFFIX}")
+        self._file = gzip.open(self.path, 'ab', compresslevel=6)
+        self._bytes = 0
+        self._opened_at = time.monotonic()
+        log_websocket(f"🎥 Recording websocket frames to {self.path}")
+
+    def write(self, message, recv_ms=None):
+        """Record one raw frame (str or bytes) received at `recv_ms` (server clock)"""
+        if recv_ms is None:
+            recv_ms = server_now_ms()
+        if isinstance(message, bytes):
+            message = message.decode('utf-8')
+        line = f"{recv_ms}\t{message}\n".encode('utf-8')
+        now = time.monotonic()
+        if self._file is None or self._bytes + len(line) > self.max_bytes or now - self._opened_at > self.max_seconds:
+            self._open_segment(recv_ms)
+        self._file.write(line)
+        self._bytes += len(line)
+        self.frames += 1
+        if now - self._flushed_at >= FLUSH_INTERVAL_SECONDS:
+            # Sync flush: everything so far is decodable even if the trailer is never written
+            self._file.flush(zlib.Z_SYNC_FLUSH)
+            self._flushed_at = now
+
+    def retarget(self, symbol, interval):
+        """Record a different market from the next frame on (in its own segments)"""
+        self.close()
+        self.symbol = symbol.upper()
+        self.interval = interval
+
+    def close(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except Exception as e:
+                log_error(f"Error closing capture segment {self.path}: {e}")
+            self._file = None
+
+
+def read_segment(path):
+    """
+    Yield (recv_ms, raw frame) from one segment
+
+    A segment cut off by a crash has no gzip trailer; everything before the cut is still returned.
+    """
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                recv, sep, message = line.rstrip('\n').partition('\t')
+                if not sep:
+                    continue  # Partial last line
+                yield int(recv), message
+    except (EOFError, zlib.error, gzip.BadGzipFile) as e:
+        log_websocket(f"⚠️ Capture segment {os.path.basename(path)} is truncated ({e}); replayed up to the cut")
+
+
+def list_segments(directory, symbol, interval):
+    return sorted(glob.glob(segment_pattern(directory, symbol, interval)))
+
+
+class ReplaySource:
+    """
+    Replays recorded frames through a kline callback, with the listener's call signature
+
+    Usage:
+        source = ReplaySource(directory, speed=10)
+        await ohlc_strategy_collector(symbol, interval, source=source, clock=source.clock)
+
+    Args:
+        directory (str): Directory with capture segments (or a single segment file)
+        speed (float): 1 for real time, N for N times faster, 0/None for as fast as possible
+        start_ms / end_ms (int, optional): Only replay frames received in [start_ms, end_ms)
+    """
+
+    def __init__(self, directory=CAPTURE_DIR, speed=None, start_ms=None, end_ms=None):
+        self.directory = directory
+        self.speed = speed or None
+        self.start_ms = start_ms
+        self.end_ms = end_ms
+        self.current_ms = None  # Receive time of the frame being dispatched
+        self.frames = 0
+
+    def _segments(self, symbol, interval):
+        if os.path.isfile(self.directory):
+            return [self.directory]
+        return list_segments(self.directory, symbol, interval)
+
+    def _frames(self, symbol, interval):
+        for path in self._segments(symbol, interval):
+            for recv_ms, message in read_segment(path):
+                if self.start_ms is not None and recv_ms < self.start_ms:
+                    continue
+                if self.end_ms is not None and recv_ms >= self.end_ms:
+                    return
+                yield recv_ms, message
+
+    def prime(self, symbol, interval):
+        """Set the replay clock to the first frame's receive time (before replay starts)"""
+        for recv_ms, _ in self._frames(symbol, interval):
+            self.current_ms = recv_ms
+            break
+        return self.current_ms
+
+    def clock(self):
+        """Replay time in server-clock ms, standing in for server_now_ms()"""
+        return self.current_ms if self.current_ms is not None else server_now_ms()
+
+    async def __call__(self, symbol, interval, callback, testnet=False, stop_event=None, **_):
+        first_recv = None
+        started = time.monotonic()
+        log_websocket(f"▶️ Replaying {symbol.upper()} {interval} frames from {self.directory} at {f'{self.speed}x' if self.speed else 'max'} speed")
+        for index, (recv_ms, message) in enumerate(self._frames(symbol, interval)):
+            if stop_event is not None and stop_event.is_set():
+                log_websocket("\n🛑 Stop event detected in replay. Stopping.")
+                break
+            if first_recv is None:
+                first_recv = recv_ms
+            if self.speed:
+                # Schedule against the replay start so sleep overshoot doesn't accumulate
+                delay = started + (recv_ms - first_recv) / 1000 / self.speed - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif index % 1000 == 0:
+                await asyncio.sleep(0)  # Let other tasks run during max-speed replay
+            self.current_ms = recv_ms
+            data = json.loads(message)
+            kline = data.get("k", {})
+            if kline.get("s", symbol.upper()) != symbol.upper() or kline.get("i", interval) != interval:
+                continue
+            self.frames += 1
+            await callback(kline)
+        log_websocket(f"⏹️ Replay finished: {self.frames} frames in {time.monotonic() - started:.2f}s")
+
+
+# Replay a capture through the strategy collector from the command line
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        log_websocket("Usage: python -m utils.websocket_client.ws_recorder <symbol> <interval> [speed|max] [capture dir or segment]")
+        log_websocket("Example: python -m utils.websocket_client.ws_recorder ETHUSDT 1m 60")
+        log_websocket("A replay is a dry run: signals are computed and logged, no orders are sent. "
+                      "With MODE=sim the orders go to the local exchange simulator instead.")
+        sys.exit(1)
+
+    from utils.config import SIM
+    from utils.websocket_client.ohlc_collector import ohlc_strategy_collector
+    replay_symbol = sys.argv[1].upper()
+    replay_interval = sys.argv[2]
+    replay_speed = None if len(sys.argv) < 4 or sys.argv[3] == 'max' else float(sys.argv[3])
+    replay_dir = sys.argv[4] if len(sys.argv) > 4 else CAPTURE_DIR
+
+    source = ReplaySource(replay_dir, speed=replay_speed)
+    source.prime(replay_symbol, replay_interval)
+    # Orders only ever go to the simulator; against a real account the replay is a dry run
+    log_websocket("🧪 Replay orders go to the exchange simulator" if SIM else "🧪 Dry run: replay sends no orders")
+    asyncio.run(ohlc_strategy_collector(replay_symbol, replay_interval, debug_mode=True, source=source,
+                                        clock=source.clock, trading=SIM))
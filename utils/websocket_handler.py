@@ -8,9 +8,13 @@ import signal
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 # custom imports
-from utils.config import MODE, DEBUG_MODE, SHOW_ERRORS, get_trading_symbol, get_candle_interval
+from utils.config import MODE, DEBUG_MODE, SHOW_ERRORS, WS_RECORD, WS_RECORD_DIR, get_trading_symbol, get_candle_interval
 from utils.websocket_client.ohlc_collector import ohlc_strategy_collector
+from utils.websocket_client.ws_recorder import FrameRecorder, CAPTURE_DIR
 from utils.logger import log_websocket, log_error
+from utils.metrics import MetricsServer
+from utils.shared_state import attach_writer, detach_writer
+from utils.time_sync import start_time_sync
 
 def websocket_runner(stop_event=None):
     # Process command line arguments
@@ -36,18 +40,37 @@ def websocket_runner(stop_event=None):
 
     signal.signal(signal.SIGTERM, handle_terminate)
     signal.signal(signal.SIGINT, handle_terminate)
+    # Keep every client of this process signing with the exchange clock
+    start_time_sync()
     
     log_websocket(f"🚀 Starting {interval} interval data collection for {symbol.upper()}")
     log_websocket(f"📈 Will fetch 5 historical Heikin Ashi candles for proper calculation")
     log_websocket(f"⏰ For {interval} interval, expect data every {interval}")
     log_websocket(f"💡 Press Ctrl+C to stop the bot")
+    # Capture raw frames for offline replay when WS_RECORD is enabled
+    recorder = FrameRecorder(symbol, interval, WS_RECORD_DIR or CAPTURE_DIR) if WS_RECORD else None
+    # Last processed candle and HA values, kept across collector restarts for gap backfill
+    progress = {}
+    # Live position, orders and last candle for the API (/bot/state), in shared memory
+    try:
+        attach_writer(symbol=symbol, interval=interval)
+    except OSError as e:
+        log_error(f"Could not attach the shared bot state block: {e}")
+    # The API process reads this process's metrics over a local socket on every /metrics scrape
+    try:
+        metrics_server = MetricsServer().start()
+    except OSError as e:
+        metrics_server = None
+        log_error(f"Could not start the metrics socket: {e}")
     if debug_mode:
         log_websocket(f"🐛 DEBUG MODE ENABLED: Screen will not be cleared and errors will be shown in detail")
     log_websocket("=" * 60)
     
     while retry_count < max_retries and not local_stop_event and (stop_event is None or not stop_event.is_set()):
         try:
-            asyncio.run(ohlc_strategy_collector(symbol, interval, testnet=testnet, debug_mode=debug_mode, stop_event=stop_event))
+            # A live switch (see ohlc_strategy_collector) outlasts collector restarts
+            symbol, interval = progress.get('market', (symbol, interval))
+            asyncio.run(ohlc_strategy_collector(symbol, interval, testnet=testnet, debug_mode=debug_mode, stop_event=stop_event, recorder=recorder, progress=progress))
             # If the WebSocket closes cleanly, we still want to reconnect
             retry_count += 1
             retry_delay = retry_delay_initial * (2 ** min(retry_count, 3))  # Exponential backoff up to 8x
@@ -86,6 +109,11 @@ def websocket_runner(stop_event=None):
                 log_websocket("👋 Bot stopped due to repeated errors")
                 break
     
+    if recorder is not None:
+        recorder.close()
+    if metrics_server is not None:
+        metrics_server.stop()
+    detach_writer()
     if local_stop_event or (stop_event is not None and stop_event.is_set()):
         log_websocket("\n🛑 Bot stopped by termination signal.")
     if retry_count >= max_retries: